@@ -1,4 +1,7 @@
 from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
+
+from posts import search
 from posts.models import Post
 
 
@@ -9,3 +12,17 @@ class PostFilter(filters.FilterSet):
     class Meta:
         model = Post
         fields = ['date_from', 'date_to']
+
+
+class FullTextSearchFilter(SearchFilter):
+    """SearchFilter поверх полнотекстового индекса записей.
+
+    Результаты упорядочены по релевантности и несут search_snippet с
+    подсветкой; без индекса работает как обычный SearchFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not search.available():
+            return super().filter_queryset(request, queryset, view)
+        return search.search(queryset, ' '.join(terms))
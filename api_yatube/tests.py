@@ -1,3 +1,498 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from posts import trending
+from posts.models import Comment, Follow, Group, Post, User, UserStats
+from posts.pagination import encode_cursor
+from posts.serializers import (CommentSerializer, FollowerSerializer,
+                               PostSearchSerializer, PostSerializer,
+                               ValuesRepresentation)
+from posts.testing import QueryBudgetMixin, QueryPlanMixin, asgi_get
+from yatube.handlers import ASGIHandler
+
+from . import throttling, urls
+
+_throttle_settings = None
+
+
+def setUpModule():
+    # Ведра ограничения частоты живут в файле: тестам - свой файл
+    global _throttle_settings
+    directory = tempfile.mkdtemp()
+    _throttle_settings = override_settings(
+        THROTTLE_DB_PATH=os.path.join(directory, "throttle.sqlite3"))
+    _throttle_settings.enable()
+
+
+def tearDownModule():
+    directory = os.path.dirname(throttling.get_store().path)
+    _throttle_settings.disable()
+    shutil.rmtree(directory)
+
+
+def _consume(key):
+    return throttling.get_store().consume(key, 6, 0.001)[0]
+
+
+class PostListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        self.client.force_authenticate(user=self.user)
+        Post.objects.bulk_create([
+            Post(text=f"Post number {i}", author=self.user) for i in range(15)
+        ])
+
+    def test_posts_are_paginated_by_cursor(self):
+        response = self.client.get(reverse("api_posts"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertIsNone(response.data["previous"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertIsNone(response.data["next"])
+        self.assertIsNotNone(response.data["previous"])
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get(reverse("api_posts"), {"cursor": "broken"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_is_404(self):
+        post = Post.objects.first()
+        cursor = encode_cursor(["garbage", 1])
+        for url in (reverse("api_posts"),
+                    f"/api/v1/posts/{post.pk}/comments/"):
+            with self.subTest(url=url):
+                response = self.client.get(url, {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class ApiQueryBudgetTest(QueryBudgetMixin, QueryPlanMixin, TestCase):
+    urlpatterns = urls.urlpatterns
+    query_budgets = {
+        '^api/v1/posts/(?P<post_id>[0-9]+)/comments/$': 2,
+        '^api/v1/posts/(?P<post_id>[0-9]+)/comments/(?P<pk>[^/.]+)/$': 1,
+        '^api/v1/users/(?P<username>\\w+)/$': 5,
+        '^api/v1/users/(?P<username>\\w+)/(?P<pk>[^/.]+)/$': 4,
+        '^api/v1/users/$': 5,
+        '^api/v1/users/(?P<pk>[^/.]+)/$': 5,
+        '^$': 2,
+        'api/v1/posts/<int:pk>/': 1,
+        'api/v1/posts/': 1,
+        'api/v1/posts/export/': 1,
+        'api/v1/follow/': 2,
+        'api/v1/batch/': 0,
+        'api/v1/trending/': 1,
+        'api/v1/token/': 0,
+        'api/v1/token/refresh/': 0,
+        'api/v1/group/': 2,
+    }
+    plan_exceptions = {
+        # Права пользователя Django сортирует по типу содержимого
+        '^api/v1/users/(?P<username>\\w+)/$': ('auth_permission',),
+        '^api/v1/users/(?P<username>\\w+)/(?P<pk>[^/.]+)/$':
+            ('auth_permission',),
+        # Списки без сортировки читают только LIMIT строк
+        '^api/v1/users/$': ('auth_user', 'auth_permission'),
+        'api/v1/follow/': ('posts_follow',),
+        'api/v1/group/': ('posts_group',),
+    }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        self.author = User.objects.create(username="Kate")
+        group = Group.objects.create(title="Group", slug="group",
+                                     description="Group")
+        for i in range(5):
+            self.post = Post.objects.create(text=f"Post {i}",
+                                            author=self.author, group=group)
+            self.comment = Comment.objects.create(post=self.post,
+                                                  author=self.user, text="Hi")
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.force_authenticate(user=self.user)
+
+    def get_route_kwargs(self, route, params):
+        values = {
+            "post_id": self.post.pk,
+            "username": self.author.username,
+            "pk": self.post.pk,
+        }
+        if "comments" in route:
+            values["pk"] = self.comment.pk
+        elif "users" in route:
+            values["pk"] = self.author.pk
+        return {param: values[param] for param in params}
+
+
+class TrendingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = User.objects.create(username="John")
+        self.client.force_authenticate(user=author)
+        group = Group.objects.create(title="Group", slug="group",
+                                     description="Group")
+        self.quiet = Post.objects.create(text="Quiet", author=author)
+        self.popular = Post.objects.create(text="Popular", author=author,
+                                           group=group)
+        Comment.objects.create(post=self.popular, author=author, text="Hi")
+        trending.compute()
+
+    def test_ranking_is_served_from_table(self):
+        response = self.client.get(reverse("api_trending"))
+        self.assertEqual([(post["id"], post["rank"]) for post in response.data],
+                         [(self.popular.pk, 1), (self.quiet.pk, 2)])
+        self.assertGreater(response.data[0]["score"],
+                           response.data[1]["score"])
+
+        response = self.client.get(reverse("api_trending"), {"group": "group"})
+        self.assertEqual([post["id"] for post in response.data],
+                         [self.popular.pk])
+
+
+class ValuesListTest(TestCase):
+    """Списки через values() совпадают с выводом сериализаторов."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        reader = User.objects.create(username="Kate")
+        self.client.force_authenticate(user=self.user)
+        group = Group.objects.create(title="Group", slug="group",
+                                     description="Group")
+        self.post = Post.objects.create(text="With image", author=self.user,
+                                        group=group)
+        Post.objects.filter(pk=self.post.pk).update(
+            image="posts/picture.jpg", image_width=10, image_height=20,
+            thumbnails={"variants": []})
+        Post.objects.create(text="", author=reader)
+        Comment.objects.create(post=self.post, author=reader, text="Hi")
+        Comment.objects.create(post=self.post, author=None, text="Ghost")
+        Follow.objects.create(user=reader, author=self.user)
+        Follow.objects.create(user=self.user, author=reader)
+
+    def assertSameOutput(self, url, serializer_class, queryset):
+        response = self.client.get(url)
+        expected = serializer_class(queryset, many=True, context={
+            "request": response.wsgi_request}).data
+        self.assertEqual(response.json()["results"],
+                         json.loads(JSONRenderer().render(expected)))
+
+    def test_posts(self):
+        self.assertSameOutput(reverse("api_posts"), PostSerializer,
+                              Post.objects.order_by("-pub_date", "-pk"))
+
+    def test_comments(self):
+        self.assertSameOutput(
+            reverse("comment-list", args=[self.post.pk]), CommentSerializer,
+            Comment.objects.filter(post=self.post).order_by("-created",
+                                                            "-pk"))
+
+    def test_follows(self):
+        self.assertSameOutput("/api/v1/follow/", FollowerSerializer,
+                              Follow.objects.all())
+
+    def test_search_serializer_falls_back(self):
+        self.assertIsNone(ValuesRepresentation.build(PostSearchSerializer()))
+
+
+class UserFollowingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        for name in ("Kate", "Mike", "Nick"):
+            author = User.objects.create(username=name)
+            if name != "Mike":
+                Follow.objects.create(user=self.user, author=author)
+        self.client.force_authenticate(user=self.user)
+
+    def test_page_checks_follows_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/users/")
+        self.assertEqual(
+            {user["username"]: user["following"]
+             for user in response.data["results"]},
+            {"John": False, "Kate": True, "Mike": False, "Nick": True})
+        self.assertEqual(
+            sum("posts_follow" in query["sql"] for query in queries), 1)
+
+        response = self.client.get("/api/v1/users/Kate/")
+        self.assertTrue(response.data["results"][0]["following"])
+
+
+class ThrottlingTest(TestCase):
+    def setUp(self):
+        self.store = throttling.get_store()
+        self.store.reset()
+
+    def test_bucket_refills_over_time(self):
+        results = [self.store.consume("key", 2, 1, now=100)[0]
+                   for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(self.store.consume("key", 2, 1, now=100.5),
+                         (False, 0.5))
+        self.assertEqual(self.store.consume("key", 2, 1, now=101)[0], True)
+
+    def test_limit_is_shared_between_processes(self):
+        with multiprocessing.get_context("fork").Pool(3) as pool:
+            allowed = pool.map(_consume, ["shared"] * 12)
+        self.assertEqual(sum(allowed), 6)
+
+    def test_endpoint_scope_has_own_limit(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="John"))
+        rates = dict(throttling.ScopedRateThrottle.THROTTLE_RATES,
+                     batch="2/min")
+        with mock.patch.object(throttling.ScopedRateThrottle,
+                               "THROTTLE_RATES", rates):
+            responses = [client.post(reverse("api_batch"),
+                                     {"operations": []}, format="json")
+                         for _ in range(3)]
+        self.assertNotEqual(responses[1].status_code, 429)
+        self.assertEqual(responses[2].status_code, 429)
+        self.assertEqual(responses[2]["Retry-After"], "30")
+        self.assertEqual(client.get(reverse("api_posts")).status_code, 200)
+
+
+class PostSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        self.client.force_authenticate(user=self.user)
+        self.cats = Post.objects.create(
+            text="Коты, коты и ещё раз коты", author=self.user)
+        self.dogs = Post.objects.create(
+            text="Про собак и немного про котов", author=self.user)
+
+    def search(self, query):
+        return self.client.get(reverse("api_posts"), {"search": query})
+
+    def test_results_are_ranked_with_snippets(self):
+        response = self.search("кот")
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual([row["id"] for row in results],
+                         [self.cats.pk, self.dogs.pk])
+        self.assertIn("<mark>Коты</mark>", results[0]["snippet"])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.dogs.text = "Только собаки"
+        self.dogs.save()
+        self.cats.delete()
+
+        self.assertEqual(self.search("кот").data["results"], [])
+        self.assertEqual(len(self.search("собаки").data["results"]), 1)
+
+    def test_author_username_is_searchable(self):
+        response = self.search("John")
+        self.assertEqual(len(response.data["results"]), 2)
+
+
+class PostExportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        self.other = User.objects.create(username="Kate")
+        for i in range(5):
+            Post.objects.create(text=f"Post {i}", author=self.user)
+            Post.objects.create(text=f"Other {i}", author=self.other)
+
+    def export(self, **params):
+        response = self.client.get(reverse("api_posts_export"), params)
+        if not response.streaming:
+            return response, None
+        with CaptureQueriesContext(connection) as queries:
+            lines = b"".join(response.streaming_content).decode().splitlines()
+        return response, ([json.loads(line) for line in lines], queries)
+
+    def test_requires_authentication(self):
+        response, _ = self.export()
+        self.assertEqual(response.status_code, 401)
+
+    def test_streams_all_posts_in_one_query(self):
+        self.client.force_authenticate(user=self.user)
+        response, (rows, queries) = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([row["id"] for row in rows],
+                         sorted(row["id"] for row in rows))
+        self.assertEqual({row["author"] for row in rows}, {"John", "Kate"})
+
+    def test_date_filters(self):
+        self.client.force_authenticate(user=self.user)
+        first = Post.objects.order_by("pk")[3]
+        _, (rows, _) = self.export(date_from=first.pub_date.isoformat())
+        self.assertEqual(len(rows), 7)
+
+
+class AsgiExportTest(TransactionTestCase):
+    """Выгрузка под ASGI читает базу в потоке запроса, а не в цикле событий."""
+
+    def test_export_streams_through_asgi_handler(self):
+        user = User.objects.create(username="John")
+        for i in range(3):
+            Post.objects.create(text=f"Post {i}", author=user)
+        status, headers, body = async_to_sync(asgi_get)(
+            ASGIHandler(), reverse("api_posts_export"),
+            headers={"Authorization": f"Bearer {AccessToken.for_user(user)}"})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line)["text"]
+                          for line in body.decode().splitlines()],
+                         ["Post 0", "Post 1", "Post 2"])
+
+
+class BatchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        self.author = User.objects.create(username="Kate")
+        self.post = Post.objects.create(text="Post", author=self.author)
+        self.client.force_authenticate(user=self.user)
+
+    def batch(self, operations):
+        return self.client.post(reverse("api_batch"),
+                                {"operations": operations}, format="json")
+
+    def test_operations_are_applied_together(self):
+        response = self.batch([
+            {"type": "post", "text": "Offline post"},
+            {"type": "comment", "post": self.post.pk, "text": "Hi"},
+            {"type": "follow", "author": "Kate"},
+            {"type": "follow", "author": "Kate"},
+        ])
+        self.assertEqual(response.status_code, 201)
+        results = response.data["results"]
+        self.assertEqual([row["status"] for row in results],
+                         [201, 201, 201, 200])
+        self.assertEqual(results[0]["data"]["author"], "John")
+        self.assertEqual(results[1]["data"]["post"], self.post.pk)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+        stats = UserStats.objects.in_bulk([self.user.pk, self.author.pk])
+        self.assertEqual(stats[self.author.pk].followers_count, 1)
+        self.assertEqual(stats[self.user.pk].posts_count, 1)
+
+    def test_one_invalid_operation_rejects_the_batch(self):
+        response = self.batch([
+            {"type": "post", "text": "Offline post"},
+            {"type": "comment", "post": 999999, "text": "Hi"},
+            {"type": "follow", "author": "John"},
+            {"type": "unknown"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.data["results"]
+        self.assertEqual([row["status"] for row in results],
+                         [200, 400, 400, 400])
+        self.assertIn("post", results[1]["errors"])
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_bare_list_is_accepted(self):
+        response = self.client.post(reverse("api_batch"), [
+            {"type": "post", "text": "First"},
+            {"type": "post", "text": "Second"},
+            {"type": "comment", "post": self.post.pk, "text": "Hi"},
+        ], format="json")
+        self.assertEqual(response.status_code, 201)
+        results = response.data["results"]
+        for row in results[:2]:
+            post = Post.objects.get(pk=row["data"]["id"])
+            self.assertEqual(post.text, row["data"]["text"])
+        self.assertEqual(Comment.objects.get().pk, results[2]["data"]["id"])
+
+    def test_other_bodies_are_rejected(self):
+        for body in ("operations", 42, {"operations": "x"}, []):
+            with self.subTest(body=body):
+                response = self.client.post(reverse("api_batch"), body,
+                                            format="json")
+                self.assertEqual(response.status_code, 400)
+
+    def test_each_model_is_inserted_by_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch([
+                {"type": "post", "text": f"Post {i}"} for i in range(5)
+            ] + [{"type": "comment", "post": self.post.pk, "text": "Hi"}] * 3)
+        self.assertEqual(response.status_code, 201)
+        inserts = [query["sql"].split('"')[1]
+                   for query in queries.captured_queries
+                   if query["sql"].startswith('INSERT INTO "posts_post"')
+                   or query["sql"].startswith('INSERT INTO "posts_comment"')]
+        self.assertEqual(inserts, ["posts_post", "posts_comment"])
+        ids = [row["data"]["id"] for row in response.data["results"][:5]]
+        self.assertEqual(
+            ids, list(Post.objects.filter(text__startswith="Post ")
+                      .order_by("pk").values_list("pk", flat=True)))
+
+    def test_batch_size_is_limited(self):
+        with self.settings(API_BATCH_LIMIT=2):
+            response = self.batch([{"type": "post", "text": "x"}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Post.objects.count(), 1)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="John")
+        self.post = Post.objects.create(text="Post", author=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def assertRevalidates(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_post_detail(self):
+        def edit():
+            self.post.text = "Edited"
+            self.post.save()
+        self.assertRevalidates(
+            reverse("api_posts_detail", args=[self.post.pk]), edit)
+
+    def test_comment_list_is_paginated(self):
+        Comment.objects.bulk_create([
+            Comment(post=self.post, author=self.user, text=f"Comment {i}")
+            for i in range(15)
+        ])
+        url = f"/api/v1/posts/{self.post.pk}/comments/"
+        response = self.client.get(url)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertEqual(response.data["results"][0]["author"], "John")
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertIsNone(response.data["next"])
+
+    def test_comment_list(self):
+        comment = Comment.objects.create(post=self.post, author=self.user,
+                                         text="Hi")
+
+        def edit():
+            comment.text = "Edited"
+            comment.save()
+        self.assertRevalidates(
+            f"/api/v1/posts/{self.post.pk}/comments/", edit)
@@ -0,0 +1,124 @@
+"""Ограничение частоты запросов, общее для всех процессов сервера.
+
+Стандартные классы DRF хранят историю запросов списком в кэше, а
+кэш по умолчанию у каждого процесса свой: при N воркерах клиент
+получает N-кратный лимит. Здесь у каждого ключа (пользователь, IP,
+область) есть ведро токенов в общем файле SQLite THROTTLE_DB_PATH.
+Ведро вмещает столько токенов, сколько запросов разрешено за период,
+и равномерно пополняется; проверка - одно чтение и одна запись строки
+в короткой транзакции.
+
+Классы повторяют UserRateThrottle, AnonRateThrottle и
+ScopedRateThrottle из DRF и подключаются вместо них.
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import throttling
+
+from yatube.sqlite import SharedFile
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class BucketStore:
+    def __init__(self, path):
+        self.path = path
+        self.file = SharedFile(path, [
+            'CREATE TABLE IF NOT EXISTS buckets ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+            'updated REAL NOT NULL) WITHOUT ROWID'])
+
+    def connection(self):
+        return self.file.connection()
+
+    def consume(self, key, capacity, rate, now=None):
+        """Берёт токен из ведра key; возвращает (разрешено, остаток)."""
+        now = time.time() if now is None else now
+        with self.file.immediate() as connection:
+            row = connection.execute(
+                'SELECT tokens, updated FROM buckets WHERE key = ?',
+                (key,)).fetchone()
+            tokens = capacity
+            if row is not None:
+                tokens = min(capacity,
+                             row[0] + max(now - row[1], 0) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) '
+                'VALUES (?, ?, ?)', (key, tokens, now))
+        if random.random() < settings.THROTTLE_PRUNE_PROBABILITY:
+            self.prune(now)
+        return allowed, tokens
+
+    def prune(self, now):
+        # Ведро, не тронутое дольше суток, давно полное: строку можно
+        # удалить, при следующем запросе она появится заново
+        self.connection().execute('DELETE FROM buckets WHERE updated < ?',
+                                  (now - 24 * 60 * 60,))
+
+    def reset(self, key=None):
+        if key is None:
+            self.connection().execute('DELETE FROM buckets')
+        else:
+            self.connection().execute('DELETE FROM buckets WHERE key = ?',
+                                      (key,))
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BucketStore(settings.THROTTLE_DB_PATH or os.path.join(
+                tempfile.gettempdir(), 'yatube-throttle.sqlite3'))
+        return _store
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting == 'THROTTLE_DB_PATH':
+        _store = None
+
+
+class TokenBucketThrottle(throttling.SimpleRateThrottle):
+    """SimpleRateThrottle, который считает запросы ведром токенов.
+
+    Ведро вмещает num_requests токенов и пополняется на num_requests
+    за duration секунд, так что средний темп совпадает с заданным
+    rate, а короткий всплеск не больше num_requests запросов.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.allowed, self.tokens = get_store().consume(
+            self.key, self.num_requests, self.num_requests / self.duration)
+        return self.allowed
+
+    def wait(self):
+        return max(0.0, (1 - self.tokens) * self.duration / self.num_requests)
+
+
+class AnonRateThrottle(throttling.AnonRateThrottle, TokenBucketThrottle):
+    pass
+
+
+class UserRateThrottle(throttling.UserRateThrottle, TokenBucketThrottle):
+    pass
+
+
+class ScopedRateThrottle(throttling.ScopedRateThrottle, TokenBucketThrottle):
+    """Отдельный лимит для представлений с атрибутом throttle_scope."""
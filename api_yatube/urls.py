@@ -23,10 +23,16 @@ urlpatterns = [
     path('api/v1/posts/<int:pk>/',
          views.PostRetrieveUpdateDestroyAPIView.as_view(),
          name='api_posts_detail'),
+    path('api/v1/posts/export/',
+         views.PostExportAPIView.as_view(),
+         name='api_posts_export'),
     path('api/v1/posts/',
          views.PostListCreateAPIView.as_view(),
          name='api_posts'),
     path('api/v1/follow/', views.FollowListCreateAPIView.as_view()),
+    path('api/v1/batch/', views.BatchAPIView.as_view(), name='api_batch'),
+    path('api/v1/trending/', views.TrendingAPIView.as_view(),
+         name='api_trending'),
     path('api/v1/token/',
          TokenObtainPairView.as_view(),
          name='token_obtain_pair'),
@@ -1,60 +1,216 @@
+import json
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, quote_etag
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView, RetrieveDestroyAPIView
+from rest_framework.generics import GenericAPIView, ListAPIView, ListCreateAPIView, RetrieveUpdateDestroyAPIView, RetrieveDestroyAPIView
 from rest_framework import filters
-
-from posts.models import Group, Post, Comment, Follow
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.serializers import DateTimeField
+from rest_framework.settings import api_settings
+
+from posts.models import Group, Post, Comment, Follow, TrendingPost
+from yatube.sqlite import write
 from users.serializers import UserSerializer
-from posts.serializers import PostSerializer, CommentSerializer, FollowerSerializer, GroupSerializer
+from posts.serializers import PostSerializer, PostSearchSerializer, CommentSerializer, FollowerSerializer, GroupSerializer, TrendingPostSerializer, ValuesRepresentation
+from posts.pagination import COMMENT_ORDERING, KeysetPagination
 from .permissions import IsAuthorOrReadOnlyPermission
-from .filters import PostFilter
+from .filters import PostFilter, FullTextSearchFilter
 
 User = get_user_model()
 
 
+class ConditionalMixin:
+    """Ответ 304 по ETag, посчитанному из хранимой версии записи."""
+
+    def conditional_response(self, request, etag, build):
+        if etag is None:
+            return build()
+        etag = quote_etag(etag)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = build()
+            response['ETag'] = etag
+        return response
+
+
+class ValuesListMixin:
+    """Списки только для чтения без создания моделей.
+
+    Нужные сериализатору колонки читаются одним запросом через values(),
+    словари ответа собирает ValuesRepresentation; ответ совпадает с
+    обычным. Если сериализатор так не умеет, список строится как раньше.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.filter_queryset(self.get_queryset()))
+
+    def list_response(self, queryset):
+        representation = ValuesRepresentation.build(self.get_serializer())
+        if representation is None:
+            page = self.paginate_queryset(queryset)
+            if page is None:
+                return Response(self.get_serializer(queryset, many=True).data)
+            return self.get_paginated_response(
+                self.get_serializer(page, many=True).data)
+
+        # Ключ курсора тоже нужен в строках
+        ordering = getattr(self, 'keyset_ordering',
+                           getattr(self.paginator, 'ordering', ()))
+        rows = queryset.values(*representation.lookups,
+                               *(field.lstrip('-') for field in ordering))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response([representation(row) for row in rows])
+        return self.get_paginated_response(
+            [representation(row) for row in page])
+
+
 class UserViewSet(ModelViewSet):
     serializer_class = UserSerializer
 
     def get_queryset(self):
-        queryset = User.objects.all()
+        queryset = User.objects.select_related('stats').prefetch_related(
+            'groups', 'user_permissions')
         username = self.kwargs.get('username', None)
         if username is not None:
             queryset = queryset.filter(username=username)
         return queryset
 
 
-class PostListCreateAPIView(ListCreateAPIView):
-    queryset = Post.objects.all()
+class PostListCreateAPIView(ValuesListMixin, ListCreateAPIView):
+    queryset = Post.objects.select_related('author')
     serializer_class = PostSerializer
     permission_classes = (IsAuthorOrReadOnlyPermission, )
+    pagination_class = KeysetPagination
     filter_class = PostFilter
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter]
     search_fields = ['text', 'author__username']
 
+    def is_search(self):
+        return bool(self.request.query_params.get(
+            api_settings.SEARCH_PARAM))
+
+    @property
+    def paginator(self):
+        # Результаты поиска упорядочены по релевантности, а не по дате,
+        # поэтому листаются смещением
+        if not hasattr(self, '_paginator'):
+            if self.is_search():
+                self._paginator = LimitOffsetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_serializer_class(self):
+        if self.is_search():
+            return PostSearchSerializer
+        return self.serializer_class
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        write(serializer.save, author=self.request.user)
+
 
+class PostExportAPIView(GenericAPIView):
+    """Все записи одним потоком в формате NDJSON.
 
-class PostRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
-    queryset = Post.objects.all()
+    Строки читаются итератором через values() без создания моделей,
+    автор приходит в том же запросе, поэтому память не растёт
+    с размером выгрузки.
+    """
+    queryset = Post.objects.order_by('pk')
+    permission_classes = (IsAuthenticated, )
+    throttle_scope = 'export'
+    filter_class = PostFilter
+    filter_backends = (DjangoFilterBackend, )
+    fields = ('id', 'author__username', 'group_id', 'text', 'pub_date',
+              'image', 'image_width', 'image_height', 'thumbnails',
+              'comments_count', 'version')
+    chunk_size = 2000
+
+    def get(self, request):
+        rows = (self.filter_queryset(self.get_queryset())
+                .values_list(*self.fields)
+                .iterator(chunk_size=self.chunk_size))
+        response = StreamingHttpResponse(self.stream(rows),
+                                         content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="posts.ndjson"'
+        return response
+
+    def stream(self, rows):
+        pub_date = DateTimeField()
+        chunk = []
+        for (pk, author, group, text, date, image, width, height,
+             thumbnails, comments_count, version) in rows:
+            chunk.append(json.dumps({
+                'id': pk,
+                'author': author,
+                'group': group,
+                'text': text,
+                'pub_date': pub_date.to_representation(date),
+                'image': (self.request.build_absolute_uri(
+                    default_storage.url(image)) if image else None),
+                'image_width': width,
+                'image_height': height,
+                'thumbnails': thumbnails,
+                'comments_count': comments_count,
+                'version': version,
+            }, ensure_ascii=False))
+            if len(chunk) >= 100:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+
+
+class PostRetrieveUpdateDestroyAPIView(ConditionalMixin,
+                                       RetrieveUpdateDestroyAPIView):
+    queryset = Post.objects.select_related('author')
     serializer_class = PostSerializer
     permission_classes = (IsAuthorOrReadOnlyPermission, )
     filter_class = PostFilter
     filter_backends = (DjangoFilterBackend, )
 
+    def perform_update(self, serializer):
+        write(serializer.save)
+
+    def perform_destroy(self, instance):
+        write(instance.delete)
+
+    def retrieve(self, request, *args, **kwargs):
+        post = self.get_object()
+        return self.conditional_response(
+            request, f'post-{post.pk}-{post.version}',
+            lambda: Response(self.get_serializer(post).data))
+
 
-class CommentViewSet(ModelViewSet):
-    queryset = Comment.objects.all()
+class CommentViewSet(ConditionalMixin, ValuesListMixin, ModelViewSet):
+    queryset = Comment.objects.select_related('author')
     serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = COMMENT_ORDERING
 
     def list(self, request, post_id):
-        queryset = Comment.objects.all().filter(post=post_id)
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        # Версия записи растёт при каждом изменении её комментариев
+        version = Post.objects.filter(pk=post_id).values_list(
+            'version', flat=True).first()
+        etag = None if version is None else f'comments-{post_id}-{version}'
+
+        return self.conditional_response(
+            request, etag,
+            lambda: self.list_response(self.queryset.filter(post=post_id)))
 
     def retrieve(self, request, post_id, pk):
         comment = get_object_or_404(self.queryset, pk=pk)
@@ -69,7 +225,7 @@ class CommentViewSet(ModelViewSet):
         if not serializer.is_valid():
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
-        serializer.save(author=request.user, post=post)
+        write(serializer.save, author=request.user, post=post)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def partial_update(self, request, post_id, pk=None):
@@ -81,7 +237,7 @@ class CommentViewSet(ModelViewSet):
         if not serializer.is_valid():
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
-        serializer.save()
+        write(serializer.save)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def update(self, request, post_id, pk=None):
@@ -93,7 +249,7 @@ class CommentViewSet(ModelViewSet):
         if not serializer.is_valid():
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
-        serializer.save()
+        write(serializer.save)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def destroy(self, request, post_id, pk=None):
@@ -101,12 +257,12 @@ class CommentViewSet(ModelViewSet):
 
         if not request.user == comment.author:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        comment.delete()
+        write(comment.delete)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class FollowListCreateAPIView(ListCreateAPIView):
-    queryset = Follow.objects.all()
+class FollowListCreateAPIView(ValuesListMixin, ListCreateAPIView):
+    queryset = Follow.objects.select_related('user', 'author')
     serializer_class = FollowerSerializer
     permission_classes = (IsAuthorOrReadOnlyPermission, )
     filter_backends = [filters.SearchFilter]
@@ -115,7 +271,144 @@ class FollowListCreateAPIView(ListCreateAPIView):
     def perform_create(self, serializer):
         author_name = self.request.data.get("author", None)
         author = get_object_or_404(User, username=author_name)
-        serializer.save(user=self.request.user, author=author)
+        write(serializer.save, user=self.request.user, author=author)
+
+
+class BatchAPIView(APIView):
+    """Пачка записей, комментариев и подписок одним запросом.
+
+    Принимает {"operations": [{"type": ..., ...}, ...]} или сам список
+    операций. Все операции
+    проверяются сериализаторами; если хоть одна не прошла, ничего не
+    сохраняется. Иначе всё пишется в одной транзакции. В ответе
+    результат каждой операции в том же порядке.
+    """
+    throttle_scope = 'batch'
+    serializers = {
+        'post': PostSerializer,
+        'comment': CommentSerializer,
+        'follow': FollowerSerializer,
+    }
+
+    def post(self, request):
+        operations = request.data
+        if isinstance(operations, dict):
+            operations = operations.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({'operations': ['Ожидается непустой список.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > settings.API_BATCH_LIMIT:
+            return Response(
+                {'operations': [f'Не больше {settings.API_BATCH_LIMIT} '
+                                'операций за раз.']},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        posts, authors = self.load_references(operations)
+        follows = {follow.author_id: follow for follow in Follow.objects.filter(
+            user=request.user, author__in=authors.values())}
+
+        instances, errors = [], []
+        for operation in operations:
+            instance = error = None
+            try:
+                instance = self.build(operation, posts, authors, follows)
+            except ValidationError as invalid:
+                error = invalid.detail
+            instances.append(instance)
+            errors.append(error)
+
+        if any(errors):
+            results = [{'status': 400, 'errors': error} if error
+                       else {'status': 200} for error in errors]
+            return Response({'results': results},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Повторная подписка в пачке возвращает тот же объект
+        created, seen = [], set()
+        for instance in instances:
+            created.append(instance.pk is None and id(instance) not in seen)
+            seen.add(id(instance))
+        new = [instance for instance, flag in zip(instances, created) if flag]
+        write(self.insert_all, new)
+
+        results = []
+        for operation, instance, new in zip(operations, instances, created):
+            serializer = self.serializers[operation['type']](
+                instance, context={'request': request})
+            results.append({'status': 201 if new else 200,
+                            'data': serializer.data})
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+    def load_references(self, operations):
+        """Записи и авторы, на которые ссылается пачка, в два запроса."""
+        post_ids, usernames = set(), set()
+        for operation in operations:
+            if not isinstance(operation, dict):
+                continue
+            if operation.get('type') == 'comment':
+                post_ids.add(str(operation.get('post')))
+            elif operation.get('type') == 'follow':
+                usernames.add(str(operation.get('author')))
+        post_ids = [pk for pk in post_ids if pk.isdigit()]
+        posts = Post.objects.in_bulk(post_ids) if post_ids else {}
+        authors = (User.objects.in_bulk(usernames, field_name='username')
+                   if usernames else {})
+        return posts, authors
+
+    def build(self, operation, posts, authors, follows):
+        user = self.request.user
+        kind = operation.get('type') if isinstance(operation, dict) else None
+        if kind not in self.serializers:
+            raise ValidationError({'type': [
+                'Ожидается одно из: ' + ', '.join(self.serializers)]})
+
+        serializer = self.serializers[kind](
+            data=operation, context={'request': self.request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if kind == 'post':
+            return Post(author=user, **data)
+        if kind == 'comment':
+            post = posts.get(int(operation['post'])
+                             if str(operation.get('post')).isdigit() else None)
+            if post is None:
+                raise ValidationError({'post': ['Запись не найдена.']})
+            return Comment(author=user, post=post, **data)
+
+        author = authors.get(str(operation.get('author')))
+        if author is None:
+            raise ValidationError({'author': ['Автор не найден.']})
+        if author == user:
+            raise ValidationError({'author': ['Нельзя подписаться на себя.']})
+        # Повтор подписки из офлайн-очереди не ошибка
+        if author.pk not in follows:
+            follows[author.pk] = Follow(user=user, author=author)
+        return follows[author.pk]
+
+    @transaction.atomic
+    def insert_all(self, instances):
+        for model in (Post, Comment, Follow):
+            self.insert(model, [instance for instance in instances
+                                if isinstance(instance, model)])
+
+    def insert(self, model, objects):
+        if not objects:
+            return
+        model.objects.bulk_create(objects)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # SQLite не возвращает id из INSERT. Транзакция держит
+            # блокировку записи с первой вставки, id растут по порядку
+            # вставки, так что последние len(objects) id таблицы - наши
+            ids = (model.objects.order_by('-pk')
+                   .values_list('pk', flat=True)[:len(objects)])
+            for instance, pk in zip(objects, reversed(list(ids))):
+                instance.pk = pk
+        # bulk_create не шлёт сигналы, а на них держатся счётчики,
+        # ленты и поиск
+        for instance in objects:
+            post_save.send(sender=model, instance=instance, created=True,
+                           update_fields=None, raw=False,
+                           using=connection.alias)
 
 
 class GroupListCreateAPIView(ListCreateAPIView):
@@ -127,6 +420,30 @@ class GroupListCreateAPIView(ListCreateAPIView):
         serializer.save(title=title)
 
 
+class TrendingAPIView(ListAPIView):
+    """Популярные записи в порядке готового рейтинга.
+
+    ?group=<slug> - рейтинг внутри группы. Рейтинг короткий
+    (TRENDING_SIZE), поэтому отдаётся без пагинации.
+    """
+    serializer_class = TrendingPostSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        entries = TrendingPost.objects.select_related('post__author')
+        slug = self.request.query_params.get('group')
+        if slug:
+            entries = entries.filter(scope__slug=slug)
+        else:
+            entries = entries.filter(scope=None)
+        posts = []
+        for entry in entries:
+            entry.post.trending_rank = entry.rank
+            entry.post.trending_score = entry.score
+            posts.append(entry.post)
+        return posts
+
+
 # class PostViewSet(ModelViewSet):
 #     queryset = Post.objects.all()
 #     serializer_class = PostSerializer
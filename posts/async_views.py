@@ -0,0 +1,161 @@
+"""Async-версии ленты, профиля и страницы записи для ASGI.
+
+Независимые запросы к базе идут одновременно, каждый в своём потоке
+со своим соединением: время ответа определяет самый долгий запрос,
+а не их сумма. Подключаются вместо views при ASYNC_VIEWS = True.
+"""
+import asyncio
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections, connection
+from django.http import Http404
+from django.shortcuts import get_object_or_404, render
+
+from . import graph, page_cache, timeline
+from .forms import CommentForm
+from .loaders import get_loaders
+from .models import Comment, Post
+from .page_cache import anonymous_page_cache, conditional_page
+from .pagination import COMMENT_ORDERING, KeysetPaginator
+
+
+_parallel = ContextVar('parallel_queries', default=False)
+
+
+def query(func):
+    """Выполняет func в отдельном потоке пула.
+
+    Если запрос пришёл внутри открытой транзакции (так работают тесты),
+    её данные видны только основному соединению, и func выполняется
+    в потоке запроса.
+    """
+    @wraps(func)
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    parallel = sync_to_async(run, thread_sensitive=False)
+    serial = sync_to_async(func)
+
+    @wraps(func)
+    async def call(*args, **kwargs):
+        return await (parallel if _parallel.get() else serial)(
+            *args, **kwargs)
+    return call
+
+
+@sync_to_async
+def _prepare(request):
+    # request.user ленивый и при первом обращении читает сессию
+    user = request.user if request.user.is_authenticated else None
+    get_loaders(request, user)
+    return user, not connection.in_atomic_block
+
+
+async def viewer(request):
+    user, parallel = await _prepare(request)
+    _parallel.set(parallel)
+    return user
+
+
+@query
+def load(loader, key):
+    return loader.load(key).get()
+
+
+@query
+def suggested_users(user):
+    return graph.suggested_users(user) if user is not None else []
+
+
+@query
+def get_page(paginator, cursor):
+    return paginator.get_page(cursor)
+
+
+@query
+def get_or_404(queryset, **lookup):
+    return get_object_or_404(queryset, **lookup)
+
+
+render_async = sync_to_async(render)
+
+
+@conditional_page()
+@anonymous_page_cache
+async def index(request):
+    await viewer(request)
+    paginator = KeysetPaginator(Post.objects.with_related(), 10)
+    page = await get_page(paginator, request.GET.get('cursor'))
+    return await render_async(request, 'index.html', {
+        'page': page,
+        'paginator': paginator,
+    })
+
+
+@conditional_page(page_cache.profile_stamp)
+@anonymous_page_cache
+async def profile(request, username):
+    user = await viewer(request)
+    loaders = get_loaders(request)
+    paginator = KeysetPaginator(
+        Post.objects.with_related().filter(author__username=username), 10)
+    author, following, page, suggestions = await asyncio.gather(
+        load(loaders.users, username),
+        load(loaders.following, username),
+        get_page(paginator, request.GET.get('cursor')),
+        suggested_users(user),
+    )
+    if author is None:
+        raise Http404
+    return await render_async(request, 'profile.html', {
+        'author': author,
+        'page': page,
+        'paginator': paginator,
+        'following': following,
+        'suggestions': suggestions,
+    })
+
+
+@conditional_page()
+@anonymous_page_cache
+async def post_view(request, username, post_id):
+    user = await viewer(request)
+    post_query = (Post.objects.with_related()
+                  .select_related('author__stats'))
+    comments = KeysetPaginator(
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        settings.COMMENTS_PER_PAGE, COMMENT_ORDERING)
+    post, following, items = await asyncio.gather(
+        get_or_404(post_query, pk=post_id, author__username=username),
+        load(get_loaders(request).following, username),
+        get_page(comments, request.GET.get('cursor')),
+    )
+    return await render_async(request, 'post.html', {
+        'post': post,
+        'form': CommentForm(),
+        'items': items,
+        'following': following,
+    })
+
+
+async def follow_index(request):
+    user = await viewer(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    @query
+    def feed_page(cursor):
+        paginator = timeline.paginator(user, 10)
+        return paginator, paginator.get_page(cursor)
+
+    paginator, page = await feed_page(request.GET.get('cursor'))
+    return await render_async(request, 'follow.html', {
+        'page': page,
+        'paginator': paginator,
+    })
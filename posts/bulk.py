@@ -0,0 +1,309 @@
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Comment, Follow, Group, Post, User
+
+# Колонки выгрузки: имя в файле и путь в ORM. Внешние ключи выгружаются
+# естественными ключами - username пользователя и slug группы
+EXPORT_COLUMNS = {
+    'users': [
+        ('username', 'username'), ('email', 'email'),
+        ('first_name', 'first_name'), ('last_name', 'last_name'),
+        ('date_joined', 'date_joined'),
+    ],
+    'groups': [
+        ('title', 'title'), ('slug', 'slug'),
+        ('description', 'description'),
+    ],
+    'posts': [
+        ('id', 'id'), ('author', 'author__username'),
+        ('group', 'group__slug'), ('text', 'text'),
+        ('pub_date', 'pub_date'), ('image', 'image'),
+    ],
+    'comments': [
+        ('id', 'id'), ('post', 'post_id'), ('author', 'author__username'),
+        ('text', 'text'), ('created', 'created'),
+    ],
+    'follows': [
+        ('user', 'user__username'), ('author', 'author__username'),
+    ],
+}
+
+# Хэши паролей выгружаются только по явной просьбе (--with-passwords)
+SECRET_COLUMNS = {
+    'users': [('password', 'password')],
+}
+
+MODELS = {
+    'users': User,
+    'groups': Group,
+    'posts': Post,
+    'comments': Comment,
+    'follows': Follow,
+}
+
+# Внешние ключи, которые при загрузке ищутся по естественному ключу
+REFERENCES = {
+    'posts': {'author': (User, 'username'), 'group': (Group, 'slug')},
+    'comments': {'post': (Post, 'id'), 'author': (User, 'username')},
+    'follows': {'user': (User, 'username'), 'author': (User, 'username')},
+}
+
+
+# Поля, по совпадению которых строка с тем же id считается уже
+# загруженной. На записи по id ссылаются комментарии выгрузки
+IDENTITY = {
+    'posts': ('author_id', 'pub_date', 'text'),
+}
+
+
+class IdCollision(Exception):
+    """Явный id из выгрузки уже занят другой строкой базы."""
+
+
+class Throughput:
+    def __init__(self, report, every):
+        self.report = report
+        self.every = every
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def add(self, rows):
+        before = self.rows // self.every
+        self.rows += rows
+        if self.rows // self.every > before:
+            self.report(f'{self.rows} строк, {self.rate():.0f} строк/с')
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return (f'{self.rows} строк за {elapsed:.1f} с, '
+                f'{self.rate():.0f} строк/с')
+
+
+def export_columns(name, secrets=False):
+    return EXPORT_COLUMNS[name] + (SECRET_COLUMNS.get(name, [])
+                                   if secrets else [])
+
+
+def export_rows(name, chunk_size, secrets=False):
+    columns = export_columns(name, secrets)
+    rows = (MODELS[name].objects.order_by('pk')
+            .values_list(*[lookup for _, lookup in columns])
+            .iterator(chunk_size=chunk_size))
+    names = [column for column, _ in columns]
+    for row in rows:
+        yield dict(zip(names, row))
+
+
+def _plain(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if value is not None and not isinstance(value, (int, float, str, bool)):
+        return str(value)
+    return value
+
+
+def write_ndjson(rows, out):
+    for row in rows:
+        out.write(json.dumps({k: _plain(v) for k, v in row.items()},
+                             ensure_ascii=False) + '\n')
+        yield row
+
+
+def write_csv(rows, out, columns):
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(['' if row[c] is None else _plain(row[c])
+                         for c in columns])
+        yield row
+
+
+def read_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield {key: (value if value != '' else None)
+               for key, value in row.items()}
+
+
+class Resolver:
+    """Кэш естественный ключ -> id с ограниченным размером.
+
+    Недостающие ключи пачки подгружаются одним запросом IN; когда кэш
+    разрастается сверх max_size, он очищается, чтобы память не росла.
+    """
+
+    def __init__(self, model, field, max_size=100000):
+        self.model = model
+        self.field = field
+        self.max_size = max_size
+        self.ids = {}
+
+    def _key(self, value):
+        # В CSV все значения - строки, а id в базе - числа
+        try:
+            return self.model._meta.get_field(self.field).to_python(value)
+        except ValidationError:
+            return None
+
+    def load(self, values):
+        missing = {self._key(value) for value in values
+                   if value is not None}
+        missing = {value for value in missing
+                   if value is not None and value not in self.ids}
+        if not missing:
+            return
+        if len(self.ids) + len(missing) > self.max_size:
+            self.ids = {}
+        self.ids.update(
+            self.model.objects.filter(**{f'{self.field}__in': missing})
+            .values_list(self.field, 'pk'))
+
+    def get(self, value):
+        return self.ids.get(self._key(value))
+
+
+@contextmanager
+def preserve_timestamps(model):
+    """Отключает auto_now_add, чтобы сохранить даты из выгрузки."""
+    fields = [field for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now_add', False)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _datetime(value):
+    if not value:
+        return timezone.now()
+    parsed = parse_datetime(value) if isinstance(value, str) else value
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+
+def build(name, row, refs):
+    """Объект модели из строки выгрузки или None, если ссылка не найдена."""
+    def ref(column):
+        value = row.get(column)
+        return None if value is None else refs[column].get(value)
+
+    if name == 'users':
+        user = User(username=row['username'], email=row.get('email') or '',
+                    first_name=row.get('first_name') or '',
+                    last_name=row.get('last_name') or '',
+                    date_joined=_datetime(row.get('date_joined')))
+        if row.get('password'):
+            user.password = row['password']
+        else:
+            user.set_unusable_password()
+        return user
+    if name == 'groups':
+        return Group(title=row['title'], slug=row['slug'],
+                     description=row.get('description') or '')
+    if name == 'posts':
+        if ref('author') is None:
+            return None
+        return Post(id=row.get('id'), author_id=ref('author'),
+                    group_id=ref('group'), text=row['text'],
+                    pub_date=_datetime(row.get('pub_date')),
+                    image=row.get('image') or None)
+    if name == 'comments':
+        if ref('post') is None or ref('author') is None:
+            return None
+        return Comment(id=row.get('id'), post_id=ref('post'),
+                       author_id=ref('author'), text=row['text'],
+                       created=_datetime(row.get('created')))
+    if name == 'follows':
+        if ref('user') is None or ref('author') is None:
+            return None
+        return Follow(user_id=ref('user'), author_id=ref('author'))
+
+
+def check_collisions(name, objects):
+    """Явный id из выгрузки не должен занимать чужую строку базы.
+
+    Иначе строку пропустит --ignore-conflicts, а комментарии к ней молча
+    прицепятся к чужой записи. Строка с тем же id и теми же полями уже
+    загружена раньше, и её пропуск безопасен.
+    """
+    fields = IDENTITY.get(name)
+    model = MODELS[name]
+    objects = {model._meta.pk.to_python(obj.pk): obj for obj in objects
+               if obj.pk is not None}
+    if not fields or not objects:
+        return
+    stored = model.objects.filter(pk__in=objects).values_list('pk', *fields)
+    for pk, *values in stored:
+        obj = objects[pk]
+        if tuple(values) != tuple(getattr(obj, field) for field in fields):
+            raise IdCollision(f'id {pk} в базе занят другой строкой {name}')
+
+
+def reset_sequences(model):
+    """Сдвигает последовательность id за загруженные явные ключи."""
+    statements = connection.ops.sequence_reset_sql(no_style(), [model])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def import_rows(name, rows, batch_size, ignore_conflicts=False,
+                progress=None):
+    """Загружает строки пачками через bulk_create.
+
+    Возвращает (загружено, пропущено). Сигналы моделей не срабатывают,
+    производные данные после загрузки пересчитываются отдельно.
+    """
+    model = MODELS[name]
+    refs = {column: Resolver(*target)
+            for column, target in REFERENCES.get(name, {}).items()}
+    loaded = skipped = 0
+
+    def flush(batch):
+        for column, resolver in refs.items():
+            resolver.load(row.get(column) for row in batch)
+        objects = [build(name, row, refs) for row in batch]
+        valid = [obj for obj in objects if obj is not None]
+        check_collisions(name, valid)
+        with transaction.atomic():
+            model.objects.bulk_create(valid, batch_size=batch_size,
+                                      ignore_conflicts=ignore_conflicts)
+        if progress:
+            progress.add(len(batch))
+        return len(valid), len(objects) - len(valid)
+
+    with preserve_timestamps(model):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                done, failed = flush(batch)
+                loaded, skipped = loaded + done, skipped + failed
+                batch = []
+        if batch:
+            done, failed = flush(batch)
+            loaded, skipped = loaded + done, skipped + failed
+    reset_sequences(model)
+    return loaded, skipped
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+STATS_KEYS = {'hits': 'post_card:stats:hits', 'misses': 'post_card:stats:misses'}
+
+
+def card_key(post, owner):
+    # pub_date в ключе защищает от совпадения id после пересоздания записи
+    stamp = int(post.pub_date.timestamp() * 1000000)
+    return f'post_card:{post.pk}:{stamp}:{post.version}:{int(owner)}'
+
+
+def _count(name, value):
+    if not value:
+        return
+    key = STATS_KEYS[name]
+    if not cache.add(key, value, None):
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.set(key, value, None)
+
+
+def stats():
+    values = cache.get_many(STATS_KEYS.values())
+    hits = values.get(STATS_KEYS['hits'], 0)
+    misses = values.get(STATS_KEYS['misses'], 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+
+def render_cards(posts, user):
+    """HTML карточек записей, по возможности из кэша.
+
+    Ссылка «Редактировать» видна только автору, поэтому у каждой записи
+    две версии карточки: для автора и для всех остальных.
+    """
+    posts = list(posts)
+    keys = [card_key(post, user == post.author) for post in posts]
+    cached = cache.get_many(keys)
+    missing = {}
+    cards = []
+    for key, post in zip(keys, posts):
+        if key not in cached:
+            missing[key] = render_to_string(
+                'post_item.html', {'post': post, 'user': user})
+        cards.append(cached.get(key, missing.get(key)))
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+    _count('hits', len(cached))
+    _count('misses', len(missing))
+    return cards
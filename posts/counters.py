@@ -0,0 +1,98 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import page_cache
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def bump(model, pk, **deltas):
+    if pk is None:
+        return 0
+    return model.objects.filter(pk=pk).update(
+        **{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def bump_user(user_id, **deltas):
+    if user_id is None:
+        return
+    if bump(UserStats, user_id, **deltas):
+        return
+    # Строки статистики нет: заводим её только при увеличении счётчиков,
+    # иначе при удалении пользователя она возродилась бы каскадом
+    if all(delta > 0 for delta in deltas.values()):
+        UserStats.objects.get_or_create(user_id=user_id)
+        bump(UserStats, user_id, **deltas)
+
+
+def _count(model, field, **filters):
+    rows = (model.objects.filter(**{field: OuterRef('pk')}, **filters)
+            .order_by().values(field)
+            .annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(rows), 0)
+
+
+# Для каждого счётчика - модель, поле и выражение с настоящим значением
+COUNTERS = [
+    (Post, 'comments_count', lambda: _count(Comment, 'post')),
+    (Group, 'posts_count', lambda: _count(Post, 'group')),
+    (UserStats, 'posts_count', lambda: _count(Post, 'author')),
+    (UserStats, 'followers_count', lambda: _count(Follow, 'author')),
+    (UserStats, 'following_count', lambda: _count(Follow, 'user')),
+]
+
+
+def create_missing_stats(batch):
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in batch], ignore_conflicts=True)
+
+
+def reconcile(model, field, expression, batch_size=1000):
+    """Пересчитывает счётчик пачками по диапазонам первичного ключа.
+
+    Обновляются только строки, где сохранённое значение разошлось с
+    настоящим; возвращается число исправленных строк.
+    """
+    repaired = 0
+    pks = (model.objects.order_by('pk')
+           .values_list('pk', flat=True).iterator(chunk_size=batch_size))
+    batch = []
+    for pk in pks:
+        batch.append(pk)
+        if len(batch) >= batch_size:
+            repaired += _reconcile_batch(model, field, expression, batch)
+            batch = []
+    if batch:
+        repaired += _reconcile_batch(model, field, expression, batch)
+    return repaired
+
+
+def _reconcile_batch(model, field, expression, batch):
+    drifted = (model.objects.filter(pk__gte=batch[0], pk__lte=batch[-1])
+               .alias(actual=expression())
+               .exclude(**{field: F('actual')}))
+    updates = {field: expression()}
+    if model is Post:
+        # Иначе кэш карточек и ETag записи продолжат показывать старое
+        updates['version'] = F('version') + 1
+    return drifted.update(**updates)
+
+
+def reconcile_all(batch_size=1000):
+    users = (User.objects.filter(stats__isnull=True)
+             .values_list('pk', flat=True).iterator(chunk_size=batch_size))
+    batch = []
+    for pk in users:
+        batch.append(pk)
+        if len(batch) >= batch_size:
+            create_missing_stats(batch)
+            batch = []
+    if batch:
+        create_missing_stats(batch)
+    repaired = {
+        f'{model._meta.model_name}.{field}': reconcile(
+            model, field, expression, batch_size)
+        for model, field, expression in COUNTERS
+    }
+    if any(repaired.values()):
+        page_cache.invalidate()
+    return repaired
@@ -0,0 +1,295 @@
+"""Граф подписок в памяти процесса для рекомендаций «кого почитать».
+
+Снимок хранится в формате CSR: users - отсортированные id подписчиков,
+indptr - границы их строк в authors, authors - id авторов, на которых
+подписан каждый, по возрастанию. Подписки и отписки после снимка
+копятся в дельте и, когда их набирается FOLLOW_GRAPH_COMPACT,
+вливаются в массивы.
+
+Каждый процесс видит сигналы только своих подписок. Если задан
+FOLLOW_GRAPH_PATH, команда reload_follow_graph сохраняет туда свежий
+снимок, а процессы подхватывают его не позже чем через
+FOLLOW_GRAPH_CHECK_INTERVAL секунд и доигрывают поверх него журнал
+своих изменений. Без файла процесс раз в FOLLOW_GRAPH_MAX_AGE секунд
+перестраивает граф из базы сам. И загрузка, и сборка идут в фоновом
+потоке: запросы тем временем получают прежний снимок, а до первого -
+пустой список рекомендаций.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import Follow, User
+
+logger = logging.getLogger(__name__)
+
+_KEY_MASK = 0xFFFFFFFF
+
+
+def _keys(followers, authors):
+    # Ребро - одно число: сортировка ключей упорядочивает рёбра
+    # по подписчику, а внутри строки - по автору
+    return (np.asarray(followers, dtype=np.int64) << 32) | np.asarray(
+        authors, dtype=np.int64)
+
+
+class FollowGraph:
+    def __init__(self, users, indptr, authors, built_at):
+        self.users = users
+        self.indptr = indptr
+        self.authors = authors
+        self.built_at = built_at
+        # mtime файла, из которого загружен снимок
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._delta = defaultdict(dict)
+        self._delta_size = 0
+
+    @classmethod
+    def from_keys(cls, keys, built_at):
+        keys = np.unique(keys)
+        users, starts = np.unique(keys >> 32, return_index=True)
+        return cls(users.astype(np.int32),
+                   np.append(starts, len(keys)).astype(np.int64),
+                   (keys & _KEY_MASK).astype(np.int32), built_at)
+
+    @classmethod
+    def from_database(cls, chunk_size=10000):
+        built_at = time.time()
+        rows = Follow.objects.order_by().values_list('user_id', 'author_id')
+        flat = np.fromiter(
+            itertools.chain.from_iterable(rows.iterator(chunk_size)),
+            dtype=np.int64)
+        pairs = flat.reshape(-1, 2)
+        return cls.from_keys(_keys(pairs[:, 0], pairs[:, 1]), built_at)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['users'], data['indptr'], data['authors'],
+                       float(data['built_at']))
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as out:
+            np.savez(out, users=self.users, indptr=self.indptr,
+                     authors=self.authors, built_at=self.built_at)
+        os.replace(path + '.tmp', path)
+
+    @property
+    def edges(self):
+        return len(self.authors)
+
+    @property
+    def nbytes(self):
+        return self.users.nbytes + self.indptr.nbytes + self.authors.nbytes
+
+    def _rows(self, followers):
+        """Склеенные строки снимка для followers и владелец каждого id."""
+        if not len(self.users) or not len(followers):
+            empty = np.empty(0, dtype=np.int32)
+            return empty, empty
+        positions = np.searchsorted(self.users, followers)
+        positions = np.minimum(positions, len(self.users) - 1)
+        found = self.users[positions] == followers
+        positions = positions[found]
+        starts = self.indptr[positions]
+        lengths = self.indptr[positions + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        rows = self.authors[offsets + np.arange(lengths.sum())]
+        return rows, np.repeat(followers[found], lengths)
+
+    def _following(self, user_id):
+        row, _ = self._rows(np.array([user_id], dtype=np.int32))
+        changes = self._delta.get(user_id)
+        if not changes:
+            return row
+        added = [author for author, present in changes.items() if present]
+        removed = [author for author, present in changes.items()
+                   if not present]
+        row = row[~np.isin(row, removed)]
+        return np.union1d(row, np.array(added, dtype=np.int32))
+
+    def following(self, user_id):
+        with self._lock:
+            return self._following(user_id)
+
+    def apply(self, user_id, author_id, present):
+        with self._lock:
+            changes = self._delta[user_id]
+            if author_id not in changes:
+                self._delta_size += 1
+            changes[author_id] = present
+            if self._delta_size >= settings.FOLLOW_GRAPH_COMPACT:
+                self._compact()
+
+    def _compact(self):
+        changes = [(user_id, author_id, present)
+                   for user_id, authors in self._delta.items()
+                   for author_id, present in authors.items()]
+        followers, authors, present = (np.array(column) for column
+                                       in zip(*changes))
+        keys = _keys(np.repeat(self.users, np.diff(self.indptr)),
+                     self.authors)
+        changed = _keys(followers, authors)
+        keys = np.concatenate([keys[~np.isin(keys, changed)],
+                               changed[present]])
+        merged = FollowGraph.from_keys(keys, self.built_at)
+        self.users, self.indptr, self.authors = (
+            merged.users, merged.indptr, merged.authors)
+        self._delta.clear()
+        self._delta_size = 0
+
+    def suggestions(self, user_id, limit):
+        """(id автора, число общих подписок) по убыванию второго.
+
+        Кандидаты - те, на кого подписаны авторы из подписок user_id,
+        кроме самого пользователя и тех, на кого он уже подписан.
+        """
+        with self._lock:
+            following = self._following(user_id)
+            candidates, owners = self._rows(following)
+            changed = [author for author in following.tolist()
+                       if author in self._delta]
+            if changed:
+                keep = ~np.isin(owners, changed)
+                candidates = np.concatenate(
+                    [candidates[keep]]
+                    + [self._following(author) for author in changed])
+        candidates = candidates[~np.isin(candidates, following)
+                                & (candidates != user_id)]
+        values, counts = np.unique(candidates, return_counts=True)
+        order = np.lexsort((values, -counts))[:limit]
+        return list(zip(values[order].tolist(), counts[order].tolist()))
+
+
+_graph = None
+_checked = 0.0
+_graph_lock = threading.Lock()
+# Снимок строится в фоне; reset() меняет эпоху, и опоздавшая
+# фоновая сборка не подменит граф, построенный после сброса
+_building = False
+_epoch = 0
+# Изменения последних минут: доигрываются поверх загруженного снимка
+_journal = deque()
+_journal_lock = threading.Lock()
+
+
+def _refresh(graph):
+    path = settings.FOLLOW_GRAPH_PATH
+    if path and os.path.exists(path):
+        loaded_at = os.path.getmtime(path)
+        if graph is not None and loaded_at <= graph.loaded_at:
+            return graph
+        fresh = FollowGraph.load(path)
+        fresh.loaded_at = loaded_at
+        return fresh
+    if graph is None or (time.time() - graph.built_at
+                         >= settings.FOLLOW_GRAPH_MAX_AGE):
+        return FollowGraph.from_database()
+    return graph
+
+
+def _install(fresh, epoch):
+    global _graph
+    with _graph_lock:
+        if epoch != _epoch or fresh is _graph:
+            return _graph
+        # Журнал доигрывается под блокировкой: подписка, записанная
+        # во время сборки, не потеряется
+        with _journal_lock:
+            for moment, user_id, author_id, present in _journal:
+                if moment >= fresh.built_at:
+                    fresh.apply(user_id, author_id, present)
+        _graph = fresh
+        return _graph
+
+
+def _rebuild(graph, epoch):
+    global _building
+    try:
+        _install(_refresh(graph), epoch)
+    except Exception:
+        logger.exception('Не удалось обновить граф подписок')
+    finally:
+        connections.close_all()
+        with _graph_lock:
+            _building = False
+
+
+def get_graph(wait=False):
+    """Текущий снимок графа; None, пока первый снимок не готов.
+
+    Устаревший снимок пересобирается в фоновом потоке, а до конца
+    сборки запросы получают прежний. wait=True строит снимок в
+    текущем потоке. Так же и внутри открытой транзакции (тесты):
+    другой поток её данных не видит.
+    """
+    global _checked, _building
+    wait = wait or connections[DEFAULT_DB_ALIAS].in_atomic_block
+    with _graph_lock:
+        now = time.monotonic()
+        if (_graph is not None
+                and now - _checked < settings.FOLLOW_GRAPH_CHECK_INTERVAL):
+            return _graph
+        if not wait:
+            if not _building:
+                _checked = now
+                _building = True
+                threading.Thread(target=_rebuild, args=(_graph, _epoch),
+                                 name='follow-graph', daemon=True).start()
+            return _graph
+        _checked = now
+        graph, epoch = _graph, _epoch
+    return _install(_refresh(graph), epoch)
+
+
+def suggestions(user_id, limit):
+    graph = get_graph()
+    return graph.suggestions(user_id, limit) if graph is not None else []
+
+
+def reset():
+    global _graph, _epoch
+    with _graph_lock:
+        _graph = None
+        _epoch += 1
+    with _journal_lock:
+        _journal.clear()
+
+
+def _record(user_id, author_id, present):
+    now = time.time()
+    with _journal_lock:
+        _journal.append((now, user_id, author_id, present))
+        while (_journal
+               and _journal[0][0] < now - settings.FOLLOW_GRAPH_JOURNAL):
+            _journal.popleft()
+    graph = _graph
+    if graph is not None:
+        graph.apply(user_id, author_id, present)
+
+
+def follow_changed(follow, present):
+    transaction.on_commit(
+        lambda: _record(follow.user_id, follow.author_id, present))
+
+
+def suggested_users(user, limit=None):
+    """Пользователи для блока «кого почитать», у каждого - mutual."""
+    if not user.is_authenticated:
+        return []
+    ranked = suggestions(user.pk, limit or settings.FOLLOW_SUGGESTIONS)
+    users = User.objects.in_bulk([author for author, _ in ranked])
+    found = []
+    for author, mutual in ranked:
+        if author in users:
+            users[author].mutual = mutual
+            found.append(users[author])
+    return found
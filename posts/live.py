@@ -0,0 +1,109 @@
+"""Живая лента: новые записи приходят клиенту по Server-Sent Events.
+
+Новая запись после коммита публикуется в канал posts брокера. При
+переподключении браузер присылает Last-Event-ID (а при первом
+подключении страница передаёт last_id своей верхней записи), и
+пропущенные записи досылаются из базы.
+
+Под ASGI соединение долгое: astream ждёт брокер в цикле событий, не
+занимая поток, забирает накопившиеся id пачкой и читает записи одним
+запросом в пуле потоков. Под WSGI каждое открытое соединение держало
+бы поток воркера, а частые переподключения стоили бы больше, чем
+обновление страницы. Поэтому там страницы не подключают живую ленту,
+а poll для зашедших клиентов отдаёт пропущенное, закрывает ответ и
+просит переподключиться не раньше чем через LIVE_POLL_RETRY_MS.
+"""
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .cards import render_cards
+from .models import Post
+from .pubsub import POSTS_CHANNEL, get_broker
+
+
+def publish_post(post):
+    message = {'id': post.pk, 'author_id': post.author_id}
+    transaction.on_commit(
+        lambda: get_broker().publish(POSTS_CHANNEL, message))
+
+
+def event(post, card):
+    data = json.dumps({'id': post.pk, 'html': card}, ensure_ascii=False)
+    return f'id: {post.pk}\nevent: post\ndata: {data}\n\n'
+
+
+def render_events(ids, user, authors):
+    posts = Post.objects.with_related().filter(pk__in=ids).order_by('pk')
+    if authors is not None:
+        posts = posts.filter(author_id__in=authors)
+    posts = list(posts)
+    return [event(post, card)
+            for post, card in zip(posts, render_cards(posts, user))]
+
+
+def catch_up(last_id, user, authors):
+    posts = Post.objects.filter(pk__gt=last_id)
+    if authors is not None:
+        posts = posts.filter(author_id__in=authors)
+    # Если пропущено слишком много, досылаются самые свежие
+    ids = posts.order_by('-pk').values_list('pk', flat=True)
+    return render_events(list(ids[:settings.LIVE_CATCH_UP_LIMIT]), user,
+                         authors)
+
+
+def _in_pool(func):
+    # Соединение потока пула закрывается сразу: поток не привязан
+    # к запросу, и request_finished его не закроет
+    def run(*args):
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def astream(user, authors=None, last_id=None):
+    """События для одного клиента; authors - id авторов или None для всех.
+
+    Поток закрывается через LIVE_STREAM_TIMEOUT секунд; браузер сам
+    переподключится с Last-Event-ID.
+    """
+    deadline = time.monotonic() + settings.LIVE_STREAM_TIMEOUT
+    subscription = get_broker().subscribe_async(POSTS_CHANNEL)
+    try:
+        yield f'retry: {settings.LIVE_RETRY_MS}\n\n'
+        if last_id is not None:
+            for item in await _in_pool(catch_up)(last_id, user, authors):
+                yield item
+        while time.monotonic() < deadline:
+            messages = await subscription.get(timeout=settings.LIVE_KEEPALIVE)
+            if authors is not None:
+                messages = [message for message in messages
+                            if message['author_id'] in authors]
+            if messages:
+                for item in await _in_pool(render_events)(
+                        [message['id'] for message in messages], user,
+                        authors):
+                    yield item
+            else:
+                # Комментарий SSE не даёт прокси закрыть тихое соединение
+                yield ': keepalive\n\n'
+    finally:
+        subscription.close()
+
+
+def poll(user, authors=None, last_id=None):
+    """Пропущенные с last_id события одним коротким ответом (для WSGI)."""
+    yield f'retry: {settings.LIVE_POLL_RETRY_MS}\n\n'
+    if last_id is None:
+        last_id = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+    events = catch_up(last_id, user, authors)
+    yield from events
+    if not events:
+        # Событие без данных только запоминает Last-Event-ID
+        yield f'id: {last_id}\n\n'
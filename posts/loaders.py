@@ -0,0 +1,103 @@
+"""Пакетная загрузка связанных данных в рамках одного запроса.
+
+Как DataLoader: load(key) только запоминает ключ и возвращает
+отложенное значение. Когда кто-то впервые читает любое из них,
+все накопленные ключи загружаются одним запросом с IN, а результат
+запоминается до конца запроса. Представление может раздать
+отложенные значения в шаблон или сериализатор, и страница с
+десятком кнопок «Подписаться» обойдётся одним запросом к Follow.
+"""
+import threading
+
+from .models import Follow, User
+
+
+class Deferred:
+    __slots__ = ('loader', 'key')
+
+    def __init__(self, loader, key):
+        self.loader = loader
+        self.key = key
+
+    def get(self):
+        return self.loader.resolve(self.key)
+
+    def __bool__(self):
+        # {% if following %} в шаблоне читает значение здесь
+        return bool(self.get())
+
+
+class Loader:
+    """batch_load(keys) возвращает словарь ключ -> значение.
+
+    Ключей, которых нет в словаре, соответствует default.
+    """
+
+    def __init__(self, batch_load, default=None):
+        self.batch_load = batch_load
+        self.default = default
+        self._cache = {}
+        self._queue = {}
+        # Async-представления читают из нескольких потоков сразу
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            if key not in self._cache:
+                self._queue[key] = None
+        return Deferred(self, key)
+
+    def load_many(self, keys):
+        return [self.load(key) for key in keys]
+
+    def prime(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._queue.pop(key, None)
+
+    def resolve(self, key):
+        with self._lock:
+            if key not in self._cache:
+                self._queue[key] = None
+                keys = list(self._queue)
+                self._queue.clear()
+                results = self.batch_load(keys)
+                for pending in keys:
+                    self._cache[pending] = results.get(pending,
+                                                       self.default)
+            return self._cache[key]
+
+
+class RequestLoaders:
+    def __init__(self, user):
+        self.user = user
+        # Пользователь по username, вместе со счётчиками
+        self.users = Loader(self.load_users)
+        # Подписан ли зритель на автора с таким username
+        self.following = Loader(self.load_following, default=False)
+
+    def load_users(self, usernames):
+        users = User.objects.select_related('stats').filter(
+            username__in=usernames)
+        return {user.username: user for user in users}
+
+    def load_following(self, usernames):
+        if self.user is None or not self.user.is_authenticated:
+            return {}
+        followed = Follow.objects.filter(
+            user=self.user, author__username__in=usernames,
+        ).values_list('author__username', flat=True)
+        return dict.fromkeys(followed, True)
+
+
+def get_loaders(request, user=None):
+    """Загрузчики запроса; создаются при первом обращении.
+
+    user передают async-представления, у которых request.user нельзя
+    читать вне потока запроса.
+    """
+    loaders = getattr(request, '_loaders', None)
+    if loaders is None:
+        loaders = RequestLoaders(user or request.user)
+        request._loaders = loaders
+    return loaders
@@ -0,0 +1,166 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api_yatube import urls as api_urls
+from api_yatube.throttling import get_store
+from posts import urls as posts_urls
+from posts.models import Comment, Group, Post, User
+from posts.testing import ROUTE_PARAM, iter_routes
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет все HTML- и API-маршруты и сравнивает задержки '
+            'и число запросов с сохранённым базовым замером')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Запросов на маршрут')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument('--baseline', help='JSON базового замера')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимый рост p95, доля')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Рост p95 меньше этого считается шумом')
+        parser.add_argument('--anonymous', action='store_true',
+                            help='Запросы без входа на сайт')
+
+    def handle(self, *args, **options):
+        values = self.route_values()
+        client = APIClient()
+        user = None
+        if not options['anonymous']:
+            user = (User.objects.annotate(n=Count('follower'))
+                    .order_by('-n').first())
+            client.force_login(user)
+            client.force_authenticate(user=user)
+
+        results = {}
+        for urlpatterns in (posts_urls.urlpatterns, api_urls.urlpatterns):
+            for route, name in iter_routes(urlpatterns):
+                if '(?P<format>' in route:
+                    continue
+                url = self.url(route, name, values)
+                results[route] = self.measure(client, url, user, options)
+                self.report(route, results[route])
+
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                json.dump(results, out, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as source:
+                baseline = json.load(source)
+            regressions = self.compare(results, baseline,
+                                       options['tolerance'],
+                                       options['min_delta_ms'])
+            for line in regressions:
+                self.stderr.write(line)
+            if regressions:
+                raise CommandError(
+                    f'Регрессий производительности: {len(regressions)}')
+
+    def route_values(self):
+        """Самые нагруженные объекты: на них видны худшие случаи."""
+        post = (Post.objects.select_related('author')
+                .order_by('-comments_count', '-pk').first())
+        comment = Comment.objects.filter(post=post).first()
+        group = Group.objects.order_by('-posts_count').first()
+        if not (post and comment and group):
+            raise CommandError('Нет данных: сначала выполните generate_data')
+        return {
+            'username': post.author.username,
+            'post_id': post.pk,
+            'slug': group.slug,
+            'comment_pk': comment.pk,
+            'user_pk': post.author_id,
+            'post_pk': post.pk,
+        }
+
+    def url(self, route, name, values):
+        params = [a or b for a, b in ROUTE_PARAM.findall(route)]
+        if name is None and not params:
+            return '/' + route
+        kwargs = {}
+        for param in params:
+            if param == 'pk':
+                kind = ('comment' if 'comments' in route
+                        else 'user' if 'users' in route else 'post')
+                kwargs[param] = values[f'{kind}_pk']
+            else:
+                kwargs[param] = values[param]
+        return reverse(name, kwargs=kwargs)
+
+    def request(self, client, url, user):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # Ограничение частоты запросов исказило бы замер
+        get_store().reset()
+        started = time.perf_counter()
+        # Маршруты вроде подписки пишут в базу: откатываем изменения,
+        # чтобы каждый прогон видел одни и те же данные
+        try:
+            with transaction.atomic(), \
+                    connection.execute_wrapper(count):
+                response = client.get(url)
+                raise Rollback
+        except Rollback:
+            pass
+        return time.perf_counter() - started, queries, response.status_code
+
+    def measure(self, client, url, user, options):
+        for _ in range(options['warmup']):
+            self.request(client, url, user)
+        timings, queries, statuses = [], [], set()
+        for _ in range(options['requests']):
+            elapsed, count, status = self.request(client, url, user)
+            timings.append(elapsed * 1000)
+            queries.append(count)
+            statuses.add(status)
+        p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+        return {
+            'url': url,
+            'status': sorted(statuses),
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+            'queries': max(queries),
+        }
+
+    def report(self, route, result):
+        self.stdout.write(
+            f"{route:60} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} "
+            f"{result['p99_ms']:9.2f} мс  запросов: {result['queries']}")
+
+    def compare(self, results, baseline, tolerance, min_delta):
+        regressions = []
+        for route, result in results.items():
+            base = baseline.get(route)
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                regressions.append(
+                    f"{route}: запросов {result['queries']}, "
+                    f"было {base['queries']}")
+            limit = max(base['p95_ms'] * (1 + tolerance),
+                        base['p95_ms'] + min_delta)
+            if result['p95_ms'] > limit:
+                regressions.append(
+                    f"{route}: p95 {result['p95_ms']} мс, "
+                    f"было {base['p95_ms']} мс")
+        return regressions
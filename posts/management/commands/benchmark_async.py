@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import RequestFactory
+
+from posts import async_views, views
+from posts.models import Post, User
+
+VIEWS = ('index', 'profile', 'post_view', 'follow_index')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает синхронные и async-версии ленты, профиля и '
+            'страницы записи')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--delay-ms', type=float, default=0,
+                            help='Добавить задержку к каждому SQL-запросу, '
+                                 'как у базы по сети')
+
+    def handle(self, *args, **options):
+        user = (User.objects.annotate(n=Count('follower'))
+                .order_by('-n').first())
+        post = Post.objects.order_by('-comments_count', '-pk').first()
+        if user is None or post is None:
+            raise CommandError('Нет данных: сначала выполните generate_data')
+        arguments = {
+            'index': {},
+            'profile': {'username': post.author.username},
+            'post_view': {'username': post.author.username,
+                          'post_id': post.pk},
+            'follow_index': {},
+        }
+
+        delay = options['delay_ms'] / 1000
+
+        def slow(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow)
+
+        if delay:
+            connection.execute_wrappers.append(slow)
+            connection_created.connect(add_delay)
+        try:
+            for name in VIEWS:
+                sync = self.measure(getattr(views, name), user,
+                                    arguments[name], options['requests'])
+                parallel = self.measure(
+                    async_to_sync(getattr(async_views, name)), user,
+                    arguments[name], options['requests'])
+                self.stdout.write(
+                    f'{name:14} sync p50 {sync[0]:8.2f} p95 {sync[1]:8.2f}  '
+                    f'async p50 {parallel[0]:8.2f} p95 {parallel[1]:8.2f} мс')
+        finally:
+            if delay:
+                connection_created.disconnect(add_delay)
+                connection.execute_wrappers.remove(slow)
+
+    def measure(self, view, user, kwargs, requests):
+        factory = RequestFactory()
+        timings = []
+        for _ in range(requests):
+            request = factory.get('/')
+            request.user = user
+            started = time.perf_counter()
+            response = view(request, **kwargs)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(
+                    f'{view.__name__}: ответ {response.status_code}')
+        return np.percentile(timings, [50, 95])
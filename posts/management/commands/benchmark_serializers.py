@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from posts.models import Comment, Follow, Post
+from posts.serializers import (CommentSerializer, FollowerSerializer,
+                               PostSerializer, ValuesRepresentation)
+
+LISTS = (
+    ('posts', PostSerializer, lambda: Post.objects.select_related('author')),
+    ('comments', CommentSerializer,
+     lambda: Comment.objects.select_related('author')),
+    ('follows', FollowerSerializer,
+     lambda: Follow.objects.select_related('user', 'author')),
+)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость сериализаторов и представления через '
+            'values() на списках записей, комментариев и подписок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        request = Request(RequestFactory().get('/'))
+        rows, repeat = options['rows'], options['repeat']
+        for name, serializer_class, queryset in LISTS:
+            context = {'request': request}
+
+            def serialize():
+                return serializer_class(queryset()[:rows], many=True,
+                                        context=context).data
+
+            def values():
+                representation = ValuesRepresentation.build(
+                    serializer_class(context=context))
+                return [representation(row) for row in
+                        queryset().values(*representation.lookups)[:rows]]
+
+            slow, count = self.measure(serialize, repeat)
+            fast, _ = self.measure(values, repeat)
+            if not count:
+                raise CommandError('Нет данных: сначала выполните '
+                                   'generate_data')
+            self.stdout.write(
+                f'{name:10} строк: {count:6}  сериализатор: '
+                f'{count / slow:9.0f} строк/с  values(): '
+                f'{count / fast:9.0f} строк/с  ускорение: {slow / fast:.1f}x')
+
+    def measure(self, build, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            count = len(build())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, count
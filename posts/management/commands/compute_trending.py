@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинг популярных записей и групп; '
+            'запускается периодически, например из cron')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = trending.compute(batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Записей в окне: {result['posts']}, мест в рейтингах: "
+            f"{result['entries']}, групп: {result['groups']}, "
+            f"за {time.perf_counter() - started:.2f} с")
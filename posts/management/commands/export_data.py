@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает данные в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(bulk.MODELS))
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            default='ndjson')
+        parser.add_argument('--output', default='-',
+                            help='Файл для выгрузки, "-" - stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--progress-every', type=int, default=100000)
+        parser.add_argument('--with-passwords', action='store_true',
+                            help='Выгрузить и хэши паролей пользователей')
+
+    def handle(self, *args, **options):
+        name = options['model']
+        if options['output'] == '-':
+            self._export(name, self.stdout, options)
+        else:
+            with open(options['output'], 'w', encoding='utf-8',
+                      newline='') as out:
+                self._export(name, out, options)
+
+    def _export(self, name, out, options):
+        progress = bulk.Throughput(self.stderr.write,
+                                   options['progress_every'])
+        secrets = options['with_passwords']
+        rows = bulk.export_rows(name, options['chunk_size'], secrets)
+        if options['format'] == 'csv':
+            columns = [column for column, _
+                       in bulk.export_columns(name, secrets)]
+            written = bulk.write_csv(rows, out, columns)
+        else:
+            written = bulk.write_ndjson(rows, out)
+        for _ in written:
+            progress.add(1)
+        self.stderr.write(f'Выгружено {name}: {progress.summary()}')
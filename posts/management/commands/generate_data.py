@@ -0,0 +1,196 @@
+import datetime as dt
+from io import BytesIO
+
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from posts import page_cache
+from posts.bulk import preserve_timestamps, reset_sequences
+from posts.models import Comment, Follow, Group, Post, User
+
+WORDS = (
+    'кот собака город море лес утро вечер новости погода книга фильм '
+    'музыка работа отпуск дорога дом друзья кофе чай поезд горы река '
+    'проект код релиз тест баг идея план встреча лето зима'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими данными заданного размера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts-per-user', type=float, default=20,
+                            help='Среднее число записей на автора')
+        parser.add_argument('--follows-per-user', type=float, default=30,
+                            help='Среднее число подписок на пользователя')
+        parser.add_argument('--comments-per-post', type=float, default=3)
+        parser.add_argument('--images', type=float, default=0.1,
+                            help='Доля записей с картинкой')
+        parser.add_argument('--alpha', type=float, default=1.2,
+                            help='Показатель степенного закона популярности')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--prefix', default='user')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--skip-rebuild', action='store_true',
+                            help='Не пересчитывать счётчики, поиск и ленты')
+
+    def handle(self, *args, **options):
+        self.rng = np.random.default_rng(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        users = self.make_users(options['users'], options['prefix'])
+        groups = self.make_groups(options['groups'], options['prefix'])
+        # Популярность пользователя по степенному закону: немногие авторы
+        # собирают большую часть подписчиков, записей и комментариев
+        popularity = self.power_law(len(users), options['alpha'])
+
+        follows = self.make_follows(users, popularity,
+                                    options['follows_per_user'])
+        posts = self.make_posts(users, groups, popularity, options)
+        comments = self.make_comments(users, posts, popularity,
+                                      options['comments_per_post'])
+        self.stdout.write(
+            f'Пользователей: {len(users)}, групп: {len(groups)}, '
+            f'подписок: {follows}, записей: {len(posts)}, '
+            f'комментариев: {comments}')
+
+        if not options['skip_rebuild']:
+            for command in ('reconcile_counters', 'rebuild_search_index',
+                            'rebuild_timelines'):
+                call_command(command, stdout=self.stdout, stderr=self.stderr)
+        page_cache.invalidate()
+
+    def power_law(self, size, alpha):
+        weights = np.arange(1, size + 1, dtype=float) ** -alpha
+        self.rng.shuffle(weights)
+        return weights / weights.sum()
+
+    def text(self, words):
+        return ' '.join(self.rng.choice(WORDS, size=max(1, words))).capitalize()
+
+    def make_users(self, count, prefix):
+        start = User.objects.filter(username__startswith=prefix).count()
+        User.objects.bulk_create(
+            [User(username=f'{prefix}{start + i}', password='!')
+             for i in range(count)],
+            batch_size=self.batch_size)
+        names = [f'{prefix}{start + i}' for i in range(count)]
+        ids = dict(User.objects.filter(username__in=names)
+                   .values_list('username', 'pk'))
+        return np.array([ids[name] for name in names])
+
+    def make_groups(self, count, prefix):
+        start = Group.objects.count()
+        Group.objects.bulk_create([
+            Group(title=f'Группа {start + i}', slug=f'{prefix}-group-{start + i}',
+                  description=self.text(12))
+            for i in range(count)
+        ])
+        return np.array(Group.objects.order_by('-pk')
+                        .values_list('pk', flat=True)[:count])
+
+    def make_follows(self, users, popularity, mean):
+        size = len(users)
+        if size < 2 or not mean:
+            return 0
+        following = np.minimum(self.rng.poisson(mean, size), size - 1)
+        readers = np.repeat(np.arange(size), following)
+        authors = self.rng.choice(size, size=len(readers), p=popularity)
+        pairs = np.unique(np.stack([readers, authors], axis=1), axis=0)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        self.insert(Follow, (Follow(user_id=int(users[a]),
+                                    author_id=int(users[b]))
+                             for a, b in pairs), ignore_conflicts=True)
+        return len(pairs)
+
+    def post_dates(self, count, days):
+        """Записи автора идут всплесками вокруг нескольких моментов."""
+        bursts = self.rng.uniform(0, days * 86400,
+                                  size=max(1, count // 10 + 1))
+        centers = self.rng.choice(bursts, size=count)
+        offsets = self.rng.exponential(3600, size=count)
+        seconds = np.clip(centers + offsets, 0, days * 86400)
+        return [self.now - dt.timedelta(seconds=float(s)) for s in seconds]
+
+    def images(self, count):
+        names = []
+        for i in range(count):
+            image = BytesIO()
+            color = tuple(int(c) for c in self.rng.integers(0, 256, 3))
+            Image.new('RGB', (1200, 800), color).save(image, 'JPEG')
+            names.append(default_storage.save(f'posts/generated-{i}.jpg',
+                                              ContentFile(image.getvalue())))
+        return names
+
+    def make_posts(self, users, groups, popularity, options):
+        counts = self.rng.poisson(
+            popularity * len(users) * options['posts_per_user'])
+        images = self.images(min(8, int(counts.sum() * options['images'])))
+
+        def rows():
+            for author, count in zip(users, counts):
+                for date in self.post_dates(int(count), options['days']):
+                    group = None
+                    if len(groups) and self.rng.random() < 0.5:
+                        group = int(self.rng.choice(groups))
+                    image = None
+                    if images and self.rng.random() < options['images']:
+                        image = images[int(self.rng.integers(len(images)))]
+                    yield Post(author_id=int(author), group_id=group,
+                               pub_date=date, image=image,
+                               text=self.text(int(self.rng.integers(5, 60))))
+        before = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        self.insert(Post, rows())
+        return list(Post.objects.filter(pk__gt=before)
+                    .values_list('pk', 'pub_date'))
+
+    def make_comments(self, users, posts, popularity, mean):
+        if not len(posts) or not mean:
+            return 0
+        # Обсуждения тоже по степенному закону: несколько записей
+        # собирают тысячи комментариев, большинство - единицы
+        weights = self.power_law(len(posts), 1.1)
+        counts = self.rng.poisson(weights * len(posts) * mean)
+
+        def rows():
+            for (post, pub_date), count in zip(posts, counts):
+                authors = self.rng.choice(users, size=int(count),
+                                          p=popularity)
+                # Обсуждение затухает за сутки-другие после публикации
+                delays = self.rng.exponential(86400, size=int(count))
+                for author, delay in zip(authors, delays):
+                    created = min(self.now, pub_date + dt.timedelta(
+                        seconds=float(delay)))
+                    yield Comment(post_id=post, author_id=int(author),
+                                  text=self.text(int(self.rng.integers(3, 25))),
+                                  created=created)
+        self.insert(Comment, rows())
+        return int(counts.sum())
+
+    def insert(self, model, objects, ignore_conflicts=False):
+        with preserve_timestamps(model):
+            batch = []
+            for obj in objects:
+                batch.append(obj)
+                if len(batch) >= self.batch_size:
+                    self.flush(model, batch, ignore_conflicts)
+                    batch = []
+            self.flush(model, batch, ignore_conflicts)
+        reset_sequences(model)
+
+    def flush(self, model, batch, ignore_conflicts):
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch,
+                                          ignore_conflicts=ignore_conflicts)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Нарезает миниатюры для записей, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересоздать миниатюры у всех записей')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            posts = posts.filter(thumbnails={})
+        count = 0
+        for post in posts.iterator(chunk_size=500):
+            thumbnails.generate(post)
+            count += 1
+        thumbnails.shutdown()
+        self.stdout.write(f'Нарезано миниатюр для записей: {count}')
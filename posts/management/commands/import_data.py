@@ -0,0 +1,62 @@
+import sys
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import bulk, page_cache
+
+# Что пересчитать после загрузки: bulk_create не вызывает сигналы
+REBUILD = {
+    'users': ['reconcile_counters'],
+    'groups': [],
+    'posts': ['reconcile_counters', 'rebuild_search_index',
+              'rebuild_timelines'],
+    'comments': ['reconcile_counters'],
+    'follows': ['reconcile_counters', 'rebuild_timelines'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Потоково загружает данные из NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(bulk.MODELS))
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            default='ndjson')
+        parser.add_argument('--input', default='-',
+                            help='Файл с данными, "-" - stdin')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--progress-every', type=int, default=100000)
+        parser.add_argument('--ignore-conflicts', action='store_true',
+                            help='Пропускать строки, которые уже есть')
+        parser.add_argument('--skip-rebuild', action='store_true',
+                            help='Не пересчитывать счётчики, поиск и ленты')
+
+    def handle(self, *args, **options):
+        name = options['model']
+        if options['input'] == '-':
+            self._import(name, sys.stdin, options)
+        else:
+            with open(options['input'], encoding='utf-8',
+                      newline='') as stream:
+                self._import(name, stream, options)
+
+        if not options['skip_rebuild']:
+            for command in REBUILD[name]:
+                call_command(command, stdout=self.stdout, stderr=self.stderr)
+        page_cache.invalidate()
+
+    def _import(self, name, stream, options):
+        read = bulk.read_csv if options['format'] == 'csv' else bulk.read_ndjson
+        progress = bulk.Throughput(self.stderr.write,
+                                   options['progress_every'])
+        try:
+            loaded, skipped = bulk.import_rows(
+                name, read(stream), options['batch_size'],
+                ignore_conflicts=options['ignore_conflicts'],
+                progress=progress)
+        except bulk.IdCollision as error:
+            raise CommandError(error)
+        self.stderr.write(f'Загружено {name}: {progress.summary()}')
+        self.stdout.write(f'Загружено строк: {loaded}, '
+                          f'пропущено без ссылок: {skipped}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Заново строит полнотекстовый индекс записей'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            self.stderr.write('Полнотекстовый индекс есть только для SQLite')
+            return
+        search.rebuild()
+        self.stdout.write('Индекс перестроен')
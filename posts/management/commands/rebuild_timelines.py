@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+from posts.models import Follow, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Заново раскладывает записи по лентам подписчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить существующие ленты перед сборкой')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            TimelineEntry.objects.all().delete()
+        count = 0
+        for follow in Follow.objects.all().iterator(chunk_size=1000):
+            timeline.backfill(follow)
+            count += 1
+        self.stdout.write(f'Обработано подписок: {count}')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает хранимые счётчики записей, комментариев и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = counters.reconcile_all(options['batch_size'])
+        for counter, rows in repaired.items():
+            self.stdout.write(f'{counter}: исправлено строк {rows}')
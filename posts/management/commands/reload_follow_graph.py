@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.graph import FollowGraph
+
+
+class Command(BaseCommand):
+    help = ('Строит снимок графа подписок из базы и сохраняет его '
+            'для процессов сайта')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.FOLLOW_GRAPH_PATH,
+                            help='Файл снимка, по умолчанию '
+                                 'FOLLOW_GRAPH_PATH')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        graph = FollowGraph.from_database()
+        elapsed = time.perf_counter() - started
+        per_million = graph.nbytes / max(graph.edges, 1) * 1e6 / 2 ** 20
+        self.stdout.write(
+            f'Подписок: {graph.edges}, подписчиков: {len(graph.users)}, '
+            f'построено за {elapsed:.2f} с')
+        self.stdout.write(
+            f'Память: {graph.nbytes / 2 ** 20:.2f} МБ, '
+            f'{per_million:.2f} МБ на миллион подписок')
+        if options['output']:
+            graph.save(options['output'])
+            self.stdout.write(f"Снимок сохранён в {options['output']}")
+        else:
+            self.stdout.write('FOLLOW_GRAPH_PATH не задан: процессы '
+                              'строят граф из базы сами')
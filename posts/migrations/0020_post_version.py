@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='version',
+            field=models.IntegerField(default=1, editable=False),
+        ),
+    ]
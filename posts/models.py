@@ -4,23 +4,77 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 
-class Group(models.Model):
+class DerivedFieldsMixin:
+    """Не даёт save() перезаписать производные поля значениями из памяти.
+
+    Поля из derived_fields (счётчики, версия, миниатюры) меняются только
+    отдельными UPDATE, поэтому при сохранении существующей строки они не
+    записываются.
+    """
+    derived_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.derived_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(DerivedFieldsMixin, models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    posts_count = models.IntegerField(default=0, editable=False)
+
+    derived_fields = ('posts_count',)
+
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class PostQuerySet(models.QuerySet):
+    def with_related(self):
+        # Автор и группа приходят одним JOIN, число комментариев хранится
+        # в самой записи
+        return self.select_related('author', 'group')
+
+
+class Post(DerivedFieldsMixin, models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField('date published', auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     group = models.ForeignKey(Group, blank=True, null=True, on_delete=models.SET_NULL, related_name='posts')
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True,
+                                              editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True,
+                                               editable=False)
+    # Готовые миниатюры для srcset: {'source': имя картинки,
+    # 'variants': [{'width', 'height', 'jpeg', 'webp'}, ...]}
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+    comments_count = models.IntegerField(default=0, editable=False)
+    # Меняется при любом изменении, от которого зависит карточка записи
+    version = models.IntegerField(default=1, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    derived_fields = ('comments_count', 'version', 'image_width',
+                      'image_height', 'thumbnails')
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='post_feed_idx'),
+            # Профиль и страница группы листают записи по ключу
+            # (pub_date, id) внутри автора или группы
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_feed_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_feed_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -30,6 +84,11 @@ class Comment(models.Model):
     created = models.DateTimeField('date published', auto_now_add=True)
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # Комментарии записи листаются по ключу (created, id)
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_thread_idx'),
+        ]
 
 
 class Follow(models.Model):
@@ -37,4 +96,61 @@ class Follow(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
 
     class Meta:
-        unique_together = ('user', 'author')
\ No newline at end of file
+        unique_together = ('user', 'author')
+        indexes = [
+            # Подписчики автора: раздача записей по лентам и счётчики
+            models.Index(fields=['author', 'user'], name='follow_author_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='stats')
+    posts_count = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_feed_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_author_idx'),
+        ]
+
+
+class TrendingPost(models.Model):
+    """Место записи в рейтинге; scope=None - рейтинг по всему сайту.
+
+    Таблицу целиком пересчитывает команда compute_trending.
+    """
+    scope = models.ForeignKey(Group, on_delete=models.CASCADE, null=True,
+                              blank=True, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='trending')
+    rank = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['rank']
+        indexes = [
+            models.Index(fields=['scope', 'rank'], name='trending_rank_idx'),
+        ]
+
+
+class TrendingGroup(models.Model):
+    group = models.OneToOneField(Group, on_delete=models.CASCADE,
+                                 primary_key=True, related_name='trending')
+    rank = models.PositiveIntegerField(db_index=True)
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['rank']
@@ -0,0 +1,160 @@
+import asyncio
+import datetime as dt
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.http import condition
+
+from . import graph
+
+GENERATION_KEY = 'page_cache:generation'
+
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # Стартуем со времени, а не с нуля: если счётчик вытеснят из кэша,
+        # старые страницы не совпадут с новым поколением
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        value = cache.get(GENERATION_KEY, 0)
+    return value
+
+
+def _bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def invalidate():
+    """Помечает все закэшированные страницы устаревшими.
+
+    Поколение меняется сразу и ещё раз после коммита: так страница,
+    пересобранная до коммита по старым данным, тоже не проживёт долго.
+    """
+    _bump_generation()
+    transaction.on_commit(_bump_generation)
+
+
+def page_key(request):
+    # Год из контекстного процессора year попадает в подвал страницы
+    raw = '{}?{}:{}'.format(
+        request.path,
+        '&'.join(sorted(request.GET.urlencode().split('&'))),
+        dt.datetime.now().year,
+    )
+    return 'page_cache:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def profile_stamp(request, username):
+    # Рекомендации берутся из графа в памяти процесса и меняются без
+    # смены поколения, когда граф достраивается в фоне
+    if not request.user.is_authenticated:
+        return None
+    return graph.suggestions(request.user.pk, settings.FOLLOW_SUGGESTIONS)
+
+
+def _page_etag(stamp):
+    def etag(request, *args, **kwargs):
+        # Всё, что видно на странице, при изменении меняет поколение
+        # страниц, а оно лежит в общем кэше: ETag одинаков на любом
+        # воркере и не требует запросов к базе. Год из контекстного
+        # процессора year попадает в подвал страницы
+        parts = [generation(), request.user.pk, dt.datetime.now().year]
+        if stamp is not None:
+            parts.append(stamp(request, *args, **kwargs))
+        if request.user.is_authenticated:
+            # В форму комментария зашит CSRF-токен: после нового входа
+            # старая копия страницы отправила бы устаревший
+            parts.append(request.COOKIES.get(settings.CSRF_COOKIE_NAME))
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+    return etag
+
+
+def _for_async(decorator, view):
+    """Применяет синхронный декоратор к async-представлению.
+
+    Декоратор работает в потоке, а само представление возвращается
+    в цикл событий через async_to_sync.
+    """
+    decorated = decorator(async_to_sync(view))
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(decorated)(request, *args, **kwargs)
+    return wrapper
+
+
+def conditional_page(stamp=None):
+    """Отдаёт 304 раньше, чем страница будет взята из кэша или собрана.
+
+    ETag строится из поколения страниц, зрителя и его CSRF-куки.
+    stamp(request, *args, **kwargs) добавляет к нему то, что видно на
+    странице, но не меняет поколение.
+    """
+    decorator = condition(etag_func=_page_etag(stamp))
+
+    def apply(view):
+        if asyncio.iscoroutinefunction(view):
+            return _for_async(decorator, view)
+        return decorator(view)
+    return apply
+
+
+def _store(key, response, current):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return
+    entry = {
+        'generation': current,
+        'expires': time.time() + settings.PAGE_CACHE_TIMEOUT,
+        'response': response,
+    }
+    cache.set(key, entry,
+              settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_STALE_TIMEOUT)
+
+
+def anonymous_page_cache(view):
+    """Кэширует страницу целиком для незалогиненных посетителей.
+
+    Когда страница устарела, пересобирает её только один запрос - тот,
+    что взял блокировку; остальные в это время получают старую версию.
+    """
+    if asyncio.iscoroutinefunction(view):
+        return _for_async(anonymous_page_cache, view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated):
+            return view(request, *args, **kwargs)
+
+        key = page_key(request)
+        current = generation()
+        entry = cache.get(key)
+        if entry is not None:
+            fresh = (entry['generation'] == current
+                     and entry['expires'] > time.time())
+            if fresh:
+                entry['response']['X-Page-Cache'] = 'HIT'
+                return entry['response']
+
+        lock = key + ':lock'
+        if not cache.add(lock, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+            if entry is not None:
+                entry['response']['X-Page-Cache'] = 'STALE'
+                return entry['response']
+            return view(request, *args, **kwargs)
+        try:
+            response = view(request, *args, **kwargs)
+            _store(key, response, current)
+        finally:
+            cache.delete(lock)
+        response['X-Page-Cache'] = 'MISS'
+        return response
+    return wrapper
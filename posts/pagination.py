@@ -1,5 +1,14 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPagination(pagination.PageNumberPagination):
@@ -7,4 +16,197 @@ class CustomPagination(pagination.PageNumberPagination):
         return Response({
             'count': self.page.paginator.count,
             'Response': data
-        })
\ No newline at end of file
+        })
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps({'v': values, 'r': int(reverse)}, default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return list(payload['v']), bool(payload['r'])
+    except (TypeError, ValueError, KeyError):
+        raise ValueError('Invalid cursor')
+
+
+class KeysetPage:
+    """Страница ленты без COUNT(*) и OFFSET.
+
+    Повторяет ту часть интерфейса django.core.paginator.Page,
+    которой пользуются шаблоны.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+# Порядок комментариев к записи: новые сверху, как в Comment.Meta
+COMMENT_ORDERING = ('-created', '-pk')
+
+
+class KeysetPaginator:
+    """Постраничный вывод по ключу (pub_date, id).
+
+    Курсор хранит ключ последней (или первой) записи страницы, поэтому
+    любая страница читается одним диапазонным запросом по индексу.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-pk')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = [
+            (field.lstrip('-'), field.startswith('-')) for field in ordering
+        ]
+
+    def _seek(self, values, reverse):
+        condition = Q()
+        for i, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for (prev_field, _), value in zip(self.ordering[:i], values):
+                step &= Q(**{prev_field: value})
+            condition |= step
+        return condition
+
+    def _order_by(self, reverse):
+        return [
+            field if descending == reverse else f'-{field}'
+            for field, descending in self.ordering
+        ]
+
+    def _key(self, obj):
+        # Строки values() приходят словарями
+        if isinstance(obj, dict):
+            return [obj[field] for field, _ in self.ordering]
+        return [getattr(obj, field) for field, _ in self.ordering]
+
+    def _fetch(self, queryset, values, reverse):
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse))
+        return list(queryset.order_by(*self._order_by(reverse))
+                    [:self.per_page + 1])
+
+    def _rows(self, values, reverse):
+        return self._fetch(self.object_list, values, reverse)
+
+    def page(self, cursor):
+        values, reverse = decode_cursor(cursor) if cursor else (None, False)
+        if values is not None and len(values) != len(self.ordering):
+            raise ValueError('Invalid cursor')
+
+        try:
+            rows = self._rows(values, reverse)
+        except (ValidationError, TypeError):
+            if values is None:
+                raise
+            # Подделанный курсор: значение не подходит к полю ключа
+            raise ValueError('Invalid cursor')
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or reverse:
+                next_cursor = encode_cursor(self._key(rows[-1]))
+            if values is not None and (has_more or not reverse):
+                previous_cursor = encode_cursor(self._key(rows[0]), True)
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+    def get_page(self, cursor):
+        try:
+            return self.page(cursor)
+        except ValueError:
+            return self.page(None)
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """Постраничный вывод по ключу из нескольких querysets сразу.
+
+    Каждый источник читается своим диапазонным запросом по индексу
+    с тем же условием по ключу и LIMIT per_page + 1, а страница
+    собирается слиянием строк в Python. Источники не должны
+    пересекаться, и все поля ordering должны идти в одну сторону.
+    """
+
+    def __init__(self, sources, per_page, ordering=('-pub_date', '-pk')):
+        super().__init__(None, per_page, ordering)
+        self.sources = list(sources)
+        directions = {descending for _, descending in self.ordering}
+        if len(directions) != 1:
+            raise ValueError('Mixed ordering directions are not supported')
+        self.descending = directions.pop()
+
+    def _rows(self, values, reverse):
+        rows = [row for source in self.sources
+                for row in self._fetch(source, values, reverse)]
+        rows.sort(key=self._key, reverse=self.descending != reverse)
+        return rows[:self.per_page + 1]
+
+
+class KeysetPagination(pagination.BasePagination):
+    cursor_query_param = 'cursor'
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE')
+    ordering = ('-pub_date', '-pk')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        paginator = KeysetPaginator(queryset, self.page_size, ordering)
+        try:
+            self.page = paginator.page(
+                request.query_params.get(self.cursor_query_param))
+        except ValueError:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self._link(self.page.next_cursor)),
+            ('previous', self._link(self.page.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
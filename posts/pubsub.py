@@ -0,0 +1,154 @@
+"""Рассылка событий подписчикам каналов для живой ленты.
+
+Брокер выбирается настройкой PUBSUB_BROKER. LocalBroker работает внутри
+одного процесса: при нескольких процессах сервера подписчики одного
+процесса не увидят публикаций другого, и нужен брокер с тем же
+интерфейсом поверх общего сервиса (например, Redis PUBLISH/SUBSCRIBE).
+Сообщения - словари, которые можно сериализовать в JSON.
+"""
+import asyncio
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+POSTS_CHANNEL = 'posts'
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+class Broker:
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, *channels):
+        """Возвращает подписку с методами get(timeout) и close()."""
+        raise NotImplementedError
+
+    def subscribe_async(self, *channels):
+        """То же для цикла событий: get(timeout) - корутина.
+
+        Вызывается из работающего цикла, ожидание не занимает поток.
+        """
+        raise NotImplementedError
+
+
+class LocalSubscription:
+    def __init__(self, broker, channels, max_queue):
+        self.broker = broker
+        self.channels = channels
+        self.messages = queue.Queue(max_queue)
+
+    def put(self, message):
+        try:
+            self.messages.put_nowait(message)
+        except queue.Full:
+            # Медленный клиент не должен копить память без предела:
+            # пропущенное он догонит по Last-Event-ID при переподключении
+            pass
+
+    def get(self, timeout=None):
+        """Все накопившиеся сообщения; пустой список по истечении timeout."""
+        try:
+            messages = [self.messages.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalAsyncSubscription(LocalSubscription):
+    def __init__(self, broker, channels, max_queue):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.messages = asyncio.Queue(max_queue)
+
+    def put(self, message):
+        # Публикуют из потоков запросов, а очередь принадлежит циклу
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Цикл уже закрыт, подписка вот-вот отпишется
+            pass
+
+    def _put(self, message):
+        try:
+            self.messages.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout=None):
+        try:
+            messages = [await asyncio.wait_for(self.messages.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.messages.empty():
+            messages.append(self.messages.get_nowait())
+        return messages
+
+
+class LocalBroker(Broker):
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers[channel])
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def subscribe(self, *channels):
+        return self._add(LocalSubscription(self, channels, self.max_queue))
+
+    def subscribe_async(self, *channels):
+        return self._add(
+            LocalAsyncSubscription(self, channels, self.max_queue))
+
+    def _add(self, subscription):
+        channels = subscription.channels
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers[channel].discard(subscription)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.PUBSUB_BROKER)()
+        return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'PUBSUB_BROKER':
+        _broker = None
@@ -0,0 +1,98 @@
+from django.db import connection
+from django.db.models import FloatField, TextField
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+
+# Границы подсветки в snippet(): управляющие символы не встречаются в
+# тексте записей, поэтому их можно безопасно заменить после экранирования
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Превращает пользовательский ввод в запрос FTS5.
+
+    Каждое слово берётся в кавычки, чтобы операторы FTS5 в запросе не
+    ломали синтаксис; последнее слово ищется по префиксу.
+    """
+    words = ['"{}"'.format(word.replace('"', '""')) for word in query.split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def highlight(snippet):
+    if snippet is None:
+        return None
+    return (escape(snippet)
+            .replace(MARK_START, '<mark>')
+            .replace(MARK_END, '</mark>'))
+
+
+def search(queryset, query):
+    """Записи queryset, найденные по query, от самых подходящих.
+
+    Поиск - подзапрос pk__in к таблице FTS, а ранг и фрагмент текста -
+    связанные подзапросы по rowid, так что queryset остаётся обычным
+    и его можно дальше фильтровать, считать и объединять.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    matches = f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    row = f'{matches} AND rowid = {Post._meta.db_table}.id'
+    return queryset.filter(
+        pk__in=RawSQL(f'SELECT rowid {matches}', [expression]),
+    ).annotate(
+        search_rank=RawSQL(f'SELECT bm25({FTS_TABLE}) {row}', [expression],
+                           output_field=FloatField()),
+        search_snippet=RawSQL(
+            f"SELECT snippet({FTS_TABLE}, 0, char(2), char(3), '…', 16) "
+            f'{row}', [expression], output_field=TextField()),
+    ).order_by('search_rank')
+
+
+def index_post(post):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text, username) '
+            f'VALUES (%s, %s, %s)',
+            [post.pk, post.text, post.author.username])
+
+
+def remove_post(post_id):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rename_author(user):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {FTS_TABLE} SET username = %s WHERE rowid IN '
+            f'(SELECT id FROM {Post._meta.db_table} WHERE author_id = %s)',
+            [user.username, user.pk])
+
+
+def rebuild():
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text, username) '
+            f'SELECT p.id, p.text, u.username FROM {Post._meta.db_table} p '
+            f'JOIN auth_user u ON u.id = p.author_id')
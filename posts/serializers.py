@@ -1,9 +1,80 @@
 from rest_framework.decorators import permission_classes
+from . import search
 from .models import Follow, Post, Comment, Group
 from users.serializers import UserSerializer
 
 from rest_framework import serializers
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.settings import api_settings
+
+
+class ValuesRepresentation:
+    """Представление строк values() в том же виде, что у сериализатора.
+
+    Для списков не нужно создавать модели и ходить по атрибутам: каждое
+    поле сериализатора превращается в колонку запроса (имя автора -
+    author__username через JOIN) и функцию форматирования значения.
+    Поддерживаются простые поля модели, SlugRelatedField,
+    PrimaryKeyRelatedField и файлы; для остальных build() возвращает
+    None, и список строится обычным путём.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.lookups = list(dict.fromkeys(lookup for _, lookup, _ in columns))
+
+    @classmethod
+    def build(cls, serializer):
+        columns = []
+        for field in serializer._readable_fields:
+            column = cls.column(serializer, field)
+            if column is None:
+                return None
+            columns.append((field.field_name, *column))
+        return cls(columns)
+
+    @classmethod
+    def column(cls, serializer, field):
+        if field.source == '*':
+            return None
+        lookup = '__'.join(field.source_attrs)
+        if isinstance(field, serializers.SlugRelatedField):
+            return f'{lookup}__{field.slug_field}', None
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            convert = field.pk_field and field.pk_field.to_representation
+            return lookup, convert
+        if isinstance(field, (serializers.RelatedField,
+                              serializers.ManyRelatedField,
+                              serializers.BaseSerializer,
+                              serializers.SerializerMethodField)):
+            return None
+        if isinstance(field, serializers.FileField):
+            model_field = serializer.Meta.model._meta.get_field(lookup)
+            return lookup, cls.file_url(field, model_field.storage,
+                                        serializer.context.get('request'))
+        return lookup, field.to_representation
+
+    @staticmethod
+    def file_url(field, storage, request):
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+        def convert(name):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request else url
+        return convert
+
+    def __call__(self, row):
+        data = {}
+        for name, lookup, convert in self.columns:
+            value = row[lookup]
+            # Как и сериализатор, None отдаём без форматирования
+            data[name] = (value if value is None or convert is None
+                          else convert(value))
+        return data
 
 
 class PostSerializer(serializers.ModelSerializer):
@@ -14,7 +85,20 @@ class PostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
         fields = '__all__'
-        read_only_fields = ['author']
+        read_only_fields = ['author', 'comments_count', 'version']
+
+
+class PostSearchSerializer(PostSerializer):
+    rank = serializers.FloatField(source='search_rank', read_only=True)
+    snippet = serializers.SerializerMethodField()
+
+    def get_snippet(self, obj):
+        return search.highlight(getattr(obj, 'search_snippet', None))
+
+
+class TrendingPostSerializer(PostSerializer):
+    rank = serializers.IntegerField(source='trending_rank', read_only=True)
+    score = serializers.FloatField(source='trending_score', read_only=True)
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -42,4 +126,5 @@ class FollowerSerializer(serializers.ModelSerializer):
 class GroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = Group
-        fields = ['title']
+        fields = ['title', 'posts_count']
+        read_only_fields = ['posts_count']
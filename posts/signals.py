@@ -0,0 +1,118 @@
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from . import (counters, graph, live, page_cache, search, thumbnails,
+               timeline)
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def _author_name(user):
+    # Отложенные поля не читаем: post_init не должен ходить в базу
+    return tuple(user.__dict__.get(field)
+                 for field in ('username', 'first_name', 'last_name'))
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    instance._saved_name = _author_name(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    elif instance._saved_name != _author_name(instance):
+        # Записи переписываются только при смене имени, которое видно
+        # на страницах; пароль или last_login их не трогают
+        page_cache.invalidate()
+        search.rename_author(instance)
+        bump_versions(Post.objects.filter(author=instance))
+        # Имя автора видно и в списке комментариев к чужим записям
+        bump_versions(Post.objects.filter(comments__author=instance))
+    instance._saved_name = _author_name(instance)
+
+
+def bump_versions(posts):
+    posts.update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    page_cache.invalidate()
+    if not created:
+        bump_versions(instance.posts.all())
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    page_cache.invalidate()
+    bump_versions(instance.posts.all())
+
+
+@receiver(post_init, sender=Post)
+def post_loaded(sender, instance, **kwargs):
+    instance._saved_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    page_cache.invalidate()
+    if created:
+        counters.bump_user(instance.author_id, posts_count=1)
+        timeline.fan_out(instance)
+        live.publish_post(instance)
+    else:
+        bump_versions(Post.objects.filter(pk=instance.pk))
+    if created or instance._saved_group_id != instance.group_id:
+        if not created:
+            counters.bump(Group, instance._saved_group_id, posts_count=-1)
+        counters.bump(Group, instance.group_id, posts_count=1)
+    instance._saved_group_id = instance.group_id
+    search.index_post(instance)
+    thumbnails.schedule(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    page_cache.invalidate()
+    counters.bump_user(instance.author_id, posts_count=-1)
+    counters.bump(Group, instance.group_id, posts_count=-1)
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    page_cache.invalidate()
+    if created:
+        counters.bump(Post, instance.post_id, comments_count=1, version=1)
+    else:
+        counters.bump(Post, instance.post_id, version=1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    page_cache.invalidate()
+    counters.bump(Post, instance.post_id, comments_count=-1, version=1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    page_cache.invalidate()
+    if created:
+        counters.bump_user(instance.author_id, followers_count=1)
+        counters.bump_user(instance.user_id, following_count=1)
+        timeline.backfill(instance)
+        graph.follow_changed(instance, True)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    page_cache.invalidate()
+    counters.bump_user(instance.author_id, followers_count=-1)
+    counters.bump_user(instance.user_id, following_count=-1)
+    timeline.prune(instance)
+    graph.follow_changed(instance, False)
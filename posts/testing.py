@@ -0,0 +1,163 @@
+import asyncio
+import re
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, reverse
+
+ROUTE_PARAM = re.compile(r'<(?:\w+:)?(\w+)>|\(\?P<(\w+)>')
+
+
+def iter_routes(urlpatterns, prefix=''):
+    """Плоский список (маршрут, имя) для всех URL из urlpatterns."""
+    for pattern in urlpatterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from iter_routes(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern):
+            yield route, pattern.name
+
+
+async def asgi_get(application, path, query_string='', headers=None,
+                   on_body=None):
+    """GET-запрос прямо к ASGI-приложению: (статус, заголовки, тело).
+
+    on_body(тело) вызывается после каждой части ответа; если он вернёт
+    True, клиент отключается.
+    """
+    start = {}
+    body = []
+    requested = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b''}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            start.update(message)
+            return
+        body.append(message.get('body', b''))
+        if on_body is not None and on_body(b''.join(body).decode()):
+            disconnected.set()
+
+    await application({
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver')] + [
+            (name.lower().encode(), value.encode())
+            for name, value in (headers or {}).items()
+        ],
+        'client': ('127.0.0.1', 40000),
+        'server': ('testserver', 80),
+    }, receive, send)
+    response_headers = {name.decode().lower(): value.decode()
+                        for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(body)
+
+
+# Полный проход по таблице или сортировка во временном B-дереве
+BAD_PLAN = re.compile(r'^SCAN \S+$|USE TEMP B-TREE')
+
+
+def explain(sql):
+    """Строки EXPLAIN QUERY PLAN для запроса SQLite."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class RouteMixin:
+    urlpatterns = ()
+    route_kwargs = {}
+
+    def get_route_kwargs(self, route, params):
+        return {param: self.route_kwargs[param] for param in params}
+
+    def get_route_url(self, route, name):
+        params = [a or b for a, b in ROUTE_PARAM.findall(route)]
+        if name is None and not params:
+            return '/' + route
+        return reverse(name, kwargs=self.get_route_kwargs(route, params))
+
+    def routes(self):
+        return [
+            (route, name) for route, name in iter_routes(self.urlpatterns)
+            if '(?P<format>' not in route
+        ]
+
+
+class QueryBudgetMixin(RouteMixin):
+    """Проверка, что страница укладывается в заданное число SQL-запросов.
+
+    query_budgets сопоставляет каждому маршруту из urlpatterns
+    наибольшее допустимое число запросов. Маршрут без бюджета считается
+    ошибкой, чтобы новые страницы не появлялись без проверки.
+    """
+    query_budgets = {}
+
+    def assertQueryBudget(self, url, budget, client=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url}: {len(queries)} queries, budget {budget}\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+
+    def test_every_route_has_budget(self):
+        missing = [route for route, _ in self.routes()
+                   if route not in self.query_budgets]
+        self.assertEqual(missing, [])
+
+    def test_routes_fit_query_budget(self):
+        for route, name in self.routes():
+            with self.subTest(route=route):
+                self.assertQueryBudget(self.get_route_url(route, name),
+                                       self.query_budgets[route])
+
+
+class QueryPlanMixin(RouteMixin):
+    """Проверка планов всех SELECT, которые выполняет каждый маршрут.
+
+    План не должен содержать полного прохода по таблице или сортировки
+    во временном B-дереве. plan_exceptions перечисляет для маршрута
+    таблицы, запросы к которым не проверяются: короткие справочники
+    вроде списка групп и чтение без сортировки с LIMIT.
+    """
+    plan_exceptions = {}
+
+    def query_plans(self, url, client=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if sql.lstrip().upper().startswith('SELECT'):
+                yield sql, explain(sql)
+
+    def test_routes_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        for route, name in self.routes():
+            allowed = self.plan_exceptions.get(route, ())
+            url = self.get_route_url(route, name)
+            for sql, plan in self.query_plans(url):
+                if any(f'"{table}"' in sql for table in allowed):
+                    continue
+                bad = [line for line in plan if BAD_PLAN.search(line)]
+                with self.subTest(route=route, sql=sql):
+                    self.assertEqual(bad, [], '\n'.join(plan))
@@ -1,8 +1,35 @@
-from django.http import response
-from django.test import TestCase, Client
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db.models import F
+from django.http import Http404, response
+from django.test import (TestCase, TransactionTestCase, Client,
+                         RequestFactory, override_settings)
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from yatube.handlers import ASGIHandler
 
-from .models import User, Post, Follow
+from . import (async_views, cards, graph, live, loaders, page_cache, pubsub,
+               timeline, trending, urls)
+from .models import (User, Post, Follow, TimelineEntry, Group, Comment,
+                     TrendingGroup, TrendingPost, UserStats)
+from .pagination import KeysetPaginator, encode_cursor
+from .testing import (BAD_PLAN, QueryBudgetMixin, QueryPlanMixin,
+                      asgi_get)
 
 
 class ProfileTest(TestCase):
@@ -140,3 +167,1033 @@ class ProfileTest(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertNotContains(response, "test_text_unlog")
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create(username="John")
+        self.reader = User.objects.create(username="Kate")
+        self.old_post = Post.objects.create(text="Old post", author=self.author)
+
+    def feed(self, cursor=None, per_page=10):
+        return timeline.paginator(self.reader, per_page).page(cursor)
+
+    def test_follow_backfills_and_new_posts_fan_out(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(text="New post", author=self.author)
+
+        self.assertEqual(list(self.feed()), [new_post, self.old_post])
+
+    def test_unfollow_prunes_timeline(self):
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        follow.delete()
+
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(list(self.feed()), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_authors_are_pulled_on_read(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(text="New post", author=self.author)
+
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(list(self.feed()), [new_post, self.old_post])
+
+    def test_pushed_and_pulled_posts_are_merged_by_page(self):
+        star = User.objects.create(username="Star")
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=star)
+        pushed = Post.objects.create(text="Pushed", author=self.author)
+        star_posts = [Post.objects.create(text=f"Star {i}", author=star)
+                      for i in range(3)]
+        order = star_posts[::-1] + [pushed, self.old_post]
+        with override_settings(TIMELINE_FANOUT_LIMIT=1):
+            # Второй подписчик делает автора популярным: его записи,
+            # уже разложенные по лентам, не должны задвоиться
+            Follow.objects.create(
+                user=User.objects.create(username="Fan"), author=star)
+            self.assertEqual(len(timeline.feed(self.reader)), 2)
+
+            first = self.feed(per_page=2)
+            second = self.feed(first.next_cursor, per_page=2)
+            third = self.feed(second.next_cursor, per_page=2)
+            back = self.feed(third.previous_cursor, per_page=2)
+
+        self.assertEqual(list(first), order[:2])
+        self.assertEqual(list(second), order[2:4])
+        self.assertEqual(list(third), order[4:])
+        self.assertFalse(third.has_next())
+        self.assertEqual(list(back), order[2:4])
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create(username="John")
+        Post.objects.bulk_create([
+            Post(text=f"Post number {i}", author=self.user) for i in range(25)
+        ])
+
+    def test_pages_follow_cursors_both_ways(self):
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        paginator = KeysetPaginator(Post.objects.all(), 10)
+
+        first = paginator.get_page(None)
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        self.assertEqual(list(first) + list(second) + list(third), expected)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+
+        back = paginator.get_page(third.previous_cursor)
+        self.assertEqual(list(back), list(second))
+        self.assertEqual(list(paginator.get_page(back.previous_cursor)),
+                         list(first))
+
+    def test_index_renders_cursor_links(self):
+        response = self.client.get(reverse("index"))
+        page = response.context["page"]
+        self.assertContains(response, f"?cursor={page.next_cursor}")
+
+        response = self.client.get(reverse("index"),
+                                   {"cursor": page.next_cursor})
+        self.assertEqual(len(response.context["page"]), 10)
+        self.assertTrue(response.context["page"].has_previous())
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse("index"), {"cursor": "broken"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context["page"].has_previous())
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        post = Post.objects.first()
+        urls = [
+            reverse("index"),
+            reverse("profile", args=["John"]),
+            reverse("post", args=["John", post.pk]),
+        ]
+        for values in (["garbage", 1], [1, "x"], [[1], {"a": 1}]):
+            cursor = encode_cursor(values)
+            for url in urls:
+                with self.subTest(url=url, values=values):
+                    response = self.client.get(url, {"cursor": cursor})
+                    self.assertEqual(response.status_code, 200)
+
+
+class PostsQueryBudgetTest(QueryBudgetMixin, QueryPlanMixin, TestCase):
+    urlpatterns = urls.urlpatterns
+    query_budgets = {
+        '': 3,
+        'group/<slug>/': 4,
+        'group/<slug>/trending/': 4,
+        'trending/': 4,
+        'new_post/': 3,
+        'follow/': 4,
+        'live/': 2,
+        'follow/live/': 3,
+        '<str:username>/follow': 4,
+        '<str:username>/unfollow': 8,
+        '<str:username>/<int:post_id>/': 5,
+        '<str:username>/<int:post_id>/edit/': 4,
+        '404/': 2,
+        '500/': 2,
+        '<username>/<int:post_id>/comment': 3,
+        '<str:username>/': 6,
+    }
+    plan_exceptions = {
+        # Выбор группы в форме - короткий справочник
+        'new_post/': ('posts_group',),
+    }
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username="John")
+        self.author = User.objects.create(username="Kate")
+        group = Group.objects.create(title="Group", slug="group",
+                                     description="Group")
+        for i in range(5):
+            post = Post.objects.create(text=f"Post {i}", author=self.author,
+                                       group=group)
+            Comment.objects.create(post=post, author=self.user, text="Hi")
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.force_login(self.user)
+        self.route_kwargs = {
+            "slug": group.slug,
+            "username": self.author.username,
+            "post_id": post.pk,
+        }
+
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_pulled_feed_uses_indexes(self):
+        # Ни сортировки во временном B-дереве, ни OR по нескольким
+        # индексам: каждый источник ленты - диапазон с LIMIT
+        plans = list(self.query_plans(reverse("follow_index")))
+        self.assertTrue(any('"posts_post"."author_id" = ' in sql
+                            for sql, _ in plans))
+        for sql, plan in plans:
+            bad = [line for line in plan
+                   if BAD_PLAN.search(line) or 'MULTI-INDEX OR' in line]
+            with self.subTest(sql=sql):
+                self.assertEqual(bad, [], '\n'.join(plan))
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username="John")
+        self.reader = User.objects.create(username="Kate")
+        self.group = Group.objects.create(title="Group", slug="group",
+                                          description="Group")
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_creates_and_deletes(self):
+        post = Post.objects.create(text="Post", author=self.author,
+                                   group=self.group)
+        comment = Comment.objects.create(post=post, author=self.reader,
+                                         text="Hi")
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+
+        post.delete()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+
+    def test_saving_stale_instance_keeps_counters(self):
+        # Правка записи или группы, прочитанной до нового комментария
+        # или записи, не возвращает старое значение счётчика
+        post = Post.objects.create(text="Post", author=self.author,
+                                   group=self.group)
+        stale_post = Post.objects.get(pk=post.pk)
+        stale_group = Group.objects.get(pk=self.group.pk)
+        Comment.objects.create(post=post, author=self.reader, text="Hi")
+        Post.objects.create(text="Other", author=self.author,
+                            group=self.group)
+
+        stale_post.text = "Edited"
+        stale_post.save()
+        stale_group.title = "Renamed"
+        stale_group.save()
+
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(post.text, "Edited")
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.group.title, "Renamed")
+        self.assertEqual(self.group.posts_count, 2)
+
+    def test_moving_post_between_groups(self):
+        other = Group.objects.create(title="Other", slug="other",
+                                     description="Other")
+        post = Post.objects.create(text="Post", author=self.author,
+                                   group=self.group)
+        post.group = other
+        post.save()
+
+        self.group.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(other.posts_count, 1)
+
+    def test_reconcile_repairs_drift(self):
+        post = Post.objects.create(text="Post", author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text="Hi")
+        Post.objects.update(comments_count=42)
+        UserStats.objects.filter(user=self.reader).delete()
+        post.refresh_from_db()
+        version = post.version
+        generation = page_cache.generation()
+
+        call_command("reconcile_counters", batch_size=1, stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        # Карточки и ETag записи должны увидеть исправленный счётчик
+        self.assertEqual(post.version, version + 1)
+        self.assertNotEqual(page_cache.generation(), generation)
+        self.assertEqual(self.stats(self.reader).posts_count, 0)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+
+
+class PostCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create(username="John")
+        self.reader = User.objects.create(username="Kate")
+        self.post = Post.objects.create(text="Cached text", author=self.author)
+        self.edit_url = reverse(
+            "post_edit",
+            kwargs={"username": self.author.username, "post_id": self.post.pk})
+
+    def test_second_render_is_a_hit(self):
+        self.client.force_login(self.reader)
+        self.client.get(reverse("index"))
+        self.client.get(reverse("index"))
+        self.assertEqual(cards.stats()["misses"], 1)
+        self.assertEqual(cards.stats()["hits"], 1)
+
+    def test_edit_link_is_per_viewer(self):
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(reverse("index")), self.edit_url)
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(reverse("index")), self.edit_url)
+
+    def test_comment_and_edit_invalidate_card(self):
+        self.client.get(reverse("index"))
+        Comment.objects.create(post=self.post, author=self.reader, text="Hi")
+        self.assertContains(self.client.get(reverse("index")),
+                            "1 комментариев")
+
+        self.post.refresh_from_db()
+        self.post.text = "Edited text"
+        self.post.save()
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "Edited text")
+        self.assertContains(response, "1 комментариев")
+
+    def test_renaming_author_invalidates_card(self):
+        self.client.get(reverse("index"))
+        self.author.username = "Johnny"
+        self.author.save()
+        self.assertContains(self.client.get(reverse("index")), "@Johnny")
+
+    def test_other_user_changes_keep_versions(self):
+        Comment.objects.create(post=self.post, author=self.reader, text="Hi")
+        self.post.refresh_from_db()
+        version = self.post.version
+        generation = page_cache.generation()
+
+        self.author.set_password("secret")
+        self.author.is_active = False
+        self.author.save()
+        self.reader.email = "kate@example.com"
+        self.reader.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, version)
+        self.assertEqual(page_cache.generation(), generation)
+
+        self.reader.first_name = "Katherine"
+        self.reader.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, version + 1)
+
+
+class AnonymousPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create(username="John")
+        Post.objects.create(text="First post", author=self.user)
+
+    def test_anonymous_pages_are_cached(self):
+        self.assertEqual(self.client.get(reverse("index"))["X-Page-Cache"],
+                         "MISS")
+        self.assertEqual(self.client.get(reverse("index"))["X-Page-Cache"],
+                         "HIT")
+        response = self.client.get(reverse("index"), {"cursor": "x"})
+        self.assertEqual(response["X-Page-Cache"], "MISS")
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse("index"))
+        self.assertFalse(self.client.get(reverse("index")).has_header(
+            "X-Page-Cache"))
+
+    def test_new_post_invalidates_pages(self):
+        self.client.get(reverse("index"))
+        Post.objects.create(text="Second post", author=self.user)
+        response = self.client.get(reverse("index"))
+        self.assertEqual(response["X-Page-Cache"], "MISS")
+        self.assertContains(response, "Second post")
+
+    def test_stale_page_is_served_while_rebuilding(self):
+        self.client.get(reverse("index"))
+        Post.objects.create(text="Second post", author=self.user)
+        cache.add(page_cache.page_key(RequestFactory().get(reverse("index")))
+                  + ":lock", 1)
+
+        response = self.client.get(reverse("index"))
+        self.assertEqual(response["X-Page-Cache"], "STALE")
+        self.assertNotContains(response, "Second post")
+
+
+class CommentPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create(username="John")
+        self.post = Post.objects.create(text="Post", author=self.author)
+        for i in range(25):
+            Comment.objects.create(post=self.post, author=self.author,
+                                   text=f"Comment {i}")
+
+    @override_settings(COMMENTS_PER_PAGE=20)
+    def test_comments_load_by_cursor(self):
+        url = reverse("post", args=["John", self.post.pk])
+        response = self.client.get(url)
+        page = response.context["items"]
+        self.assertEqual(len(page), 20)
+        self.assertEqual(page[0].text, "Comment 24")
+        self.assertContains(response, "Комментарии: 25")
+        self.assertContains(response, f"?cursor={page.next_cursor}")
+
+        response = self.client.get(url, {"cursor": page.next_cursor})
+        page = response.context["items"]
+        self.assertEqual([c.text for c in page],
+                         [f"Comment {i}" for i in range(4, -1, -1)])
+        self.assertNotContains(response, "Ещё комментарии")
+
+
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        graph.reset()
+        self.addCleanup(graph.reset)
+        self.client = Client()
+        self.users = {
+            name: User.objects.create(username=name)
+            for name in ("Ann", "Bob", "Cid", "Dan", "Eve")
+        }
+        for user, author in (("Ann", "Bob"), ("Ann", "Cid"), ("Bob", "Ann"),
+                             ("Bob", "Dan"), ("Cid", "Dan"), ("Cid", "Eve")):
+            self.follow(user, author)
+
+    def follow(self, user, author):
+        return Follow.objects.create(user=self.users[user],
+                                     author=self.users[author])
+
+    def pk(self, name):
+        return self.users[name].pk
+
+    def test_friends_of_friends_ranked_by_mutual_follows(self):
+        follow_graph = graph.FollowGraph.from_database()
+        self.assertEqual(follow_graph.edges, 6)
+        self.assertEqual(follow_graph.suggestions(self.pk("Ann"), 5),
+                         [(self.pk("Dan"), 2), (self.pk("Eve"), 1)])
+
+    def test_incremental_updates_match_rebuild(self):
+        for compact in (2, 100):
+            graph.reset()
+            with self.subTest(compact=compact), \
+                    override_settings(FOLLOW_GRAPH_COMPACT=compact):
+                live_graph = graph.get_graph()
+                with self.captureOnCommitCallbacks(execute=True):
+                    new = self.follow("Ann", "Dan")
+                    self.follow("Dan", "Eve")
+                    Follow.objects.get(user=self.users["Cid"],
+                                       author=self.users["Eve"]).delete()
+                rebuilt = graph.FollowGraph.from_database()
+                for user in self.users.values():
+                    self.assertEqual(
+                        live_graph.following(user.pk).tolist(),
+                        rebuilt.following(user.pk).tolist())
+                    self.assertEqual(live_graph.suggestions(user.pk, 5),
+                                     rebuilt.suggestions(user.pk, 5))
+                new.delete()
+                Follow.objects.filter(user=self.users["Dan"]).delete()
+                self.follow("Cid", "Eve")
+
+    def test_reload_command_saves_snapshot(self):
+        path = os.path.join(tempfile.mkdtemp(), "graph.npz")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        stdout = StringIO()
+        with override_settings(FOLLOW_GRAPH_PATH=path):
+            call_command("reload_follow_graph", stdout=stdout)
+            graph.reset()
+            loaded = graph.get_graph()
+        self.assertIn("на миллион подписок", stdout.getvalue())
+        self.assertGreater(loaded.loaded_at, 0)
+        self.assertEqual(loaded.suggestions(self.pk("Ann"), 1),
+                         [(self.pk("Dan"), 2)])
+
+    def test_profile_shows_suggestions(self):
+        self.client.force_login(self.users["Ann"])
+        response = self.client.get(reverse("profile", args=["Bob"]))
+        self.assertContains(response, "Кого почитать")
+        self.assertEqual([user.username for user in response.context[
+            "suggestions"]], ["Dan", "Eve"])
+
+
+class FollowGraphRebuildTest(TransactionTestCase):
+    """Вне транзакции граф строится в фоновом потоке."""
+
+    def setUp(self):
+        graph.reset()
+        self.addCleanup(graph.reset)
+        self.ann, self.bob, self.cid = [
+            User.objects.create(username=name) for name in ("Ann", "Bob",
+                                                             "Cid")]
+        Follow.objects.create(user=self.ann, author=self.bob)
+        Follow.objects.create(user=self.bob, author=self.cid)
+
+    def test_requests_do_not_wait_for_rebuild(self):
+        started, release = threading.Event(), threading.Event()
+        build = graph.FollowGraph.from_database
+
+        def slow_build():
+            started.set()
+            release.wait(5)
+            return build()
+
+        with mock.patch.object(graph.FollowGraph, "from_database",
+                               side_effect=slow_build):
+            self.assertIsNone(graph.get_graph())
+            self.assertTrue(started.wait(5))
+            # Пока снимок строится, рекомендаций просто нет
+            self.assertEqual(graph.suggestions(self.ann.pk, 5), [])
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == "follow-graph":
+                    thread.join(5)
+
+        self.assertEqual(graph.get_graph().suggestions(self.ann.pk, 5),
+                         [(self.cid.pk, 1)])
+
+
+class LoaderTest(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create(username="Ann")
+        self.authors = [User.objects.create(username=name)
+                        for name in ("Bob", "Cid", "Dan")]
+        Follow.objects.create(user=self.viewer, author=self.authors[0])
+        Follow.objects.create(user=self.viewer, author=self.authors[2])
+
+    def test_pending_keys_resolve_in_one_query(self):
+        request = RequestFactory().get("/")
+        request.user = self.viewer
+        following = loaders.get_loaders(request).following
+        deferred = following.load_many(["Bob", "Cid", "Dan", "Nobody"])
+        with self.assertNumQueries(1):
+            self.assertEqual([value.get() for value in deferred],
+                             [True, False, True, False])
+        with self.assertNumQueries(0):
+            self.assertTrue(following.load("Bob"))
+            self.assertIs(loaders.get_loaders(request).following, following)
+
+    def test_users_loader_and_anonymous_viewer(self):
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        request_loaders = loaders.get_loaders(request)
+        with self.assertNumQueries(1):
+            users = request_loaders.users.load_many(["Bob", "Nobody"])
+            self.assertEqual(users[0].get(), self.authors[0])
+            self.assertIsNone(users[1].get())
+            self.assertEqual(users[0].get().stats.posts_count, 0)
+        with self.assertNumQueries(0):
+            self.assertFalse(request_loaders.following.load("Bob"))
+
+    def test_views_read_following_through_loader(self):
+        client = Client()
+        client.force_login(self.viewer)
+        response = client.get(reverse("profile", args=["Bob"]))
+        self.assertTrue(response.context["following"])
+        post = Post.objects.create(text="Post", author=self.authors[1])
+        response = client.get(reverse("post", args=["Cid", post.pk]))
+        self.assertFalse(response.context["following"])
+        self.assertEqual(
+            client.get(reverse("profile", args=["Nobody"])).status_code, 404)
+
+
+class TrendingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.now = timezone.now()
+        self.author = User.objects.create(username="John")
+        self.reader = User.objects.create(username="Kate")
+        self.group = Group.objects.create(title="Group", slug="group",
+                                          description="Group")
+        self.other = Group.objects.create(title="Other", slug="other",
+                                          description="Other")
+        self.fresh = self.post("Fresh", hours=1, group=self.group)
+        self.discussed = self.post("Discussed", hours=6, group=self.other)
+        self.stale = self.post("Stale", hours=30, group=self.group)
+        self.expired = self.post("Expired", hours=100)
+        for hours in (1, 1, 2):
+            self.comment(self.discussed, hours)
+        # Старое обсуждение почти ничего не добавляет
+        for _ in range(3):
+            self.comment(self.stale, 28)
+
+    def post(self, text, hours, group=None):
+        post = Post.objects.create(text=text, author=self.author, group=group)
+        Post.objects.filter(pk=post.pk).update(
+            pub_date=self.now - timedelta(hours=hours))
+        return post
+
+    def comment(self, post, hours):
+        comment = Comment.objects.create(post=post, author=self.reader,
+                                         text="Hi")
+        Comment.objects.filter(pk=comment.pk).update(
+            created=self.now - timedelta(hours=hours))
+
+    def ranking(self, scope=None):
+        return list(TrendingPost.objects.filter(scope=scope)
+                    .values_list("post__text", flat=True))
+
+    def test_scores_decay_with_age(self):
+        result = trending.compute(now=self.now)
+        self.assertEqual(result["posts"], 3)
+        self.assertEqual(self.ranking(), ["Discussed", "Fresh", "Stale"])
+        self.assertEqual(self.ranking(self.group), ["Fresh", "Stale"])
+        self.assertEqual(list(TrendingGroup.objects.values_list(
+            "group__slug", flat=True)), ["other", "group"])
+
+    def test_pages_read_precomputed_ranking(self):
+        trending.compute(now=self.now)
+        response = self.client.get(reverse("trending"))
+        self.assertEqual([post.text for post in response.context["posts"]],
+                         ["Discussed", "Fresh", "Stale"])
+        self.assertContains(response, reverse("group_trending",
+                                               args=["other"]))
+        response = self.client.get(reverse("group_trending",
+                                           args=["group"]))
+        self.assertEqual([post.text for post in response.context["posts"]],
+                         ["Fresh", "Stale"])
+
+    def test_command_replaces_ranking(self):
+        trending.compute(now=self.now)
+        self.discussed.delete()
+        call_command("compute_trending", stdout=StringIO())
+        self.assertEqual(self.ranking(), ["Fresh", "Stale"])
+
+
+class SyntheticDataTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_generate_and_benchmark_against_baseline(self):
+        with self.settings(MEDIA_ROOT=self.tmp):
+            call_command("generate_data", users=30, groups=3,
+                         posts_per_user=4, follows_per_user=5,
+                         comments_per_post=2, images=0.2,
+                         stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(User.objects.count(), 30)
+        self.assertTrue(Post.objects.exists())
+        self.assertTrue(Comment.objects.exists())
+        self.assertTrue(Follow.objects.exists())
+        self.assertTrue(TimelineEntry.objects.exists())
+        # Популярные авторы получают непропорционально много подписчиков
+        top = UserStats.objects.order_by("-followers_count").first()
+        self.assertGreater(top.followers_count, 5)
+
+        baseline = os.path.join(self.tmp, "baseline.json")
+        call_command("benchmark", requests=2, warmup=0, output=baseline,
+                     stdout=StringIO())
+        with open(baseline) as source:
+            results = json.load(source)
+        self.assertIn("", results)
+        self.assertIn("api/v1/posts/", results)
+        self.assertEqual(results["api/v1/posts/"]["status"], [200])
+
+        for result in results.values():
+            result["queries"] -= 1
+        with open(baseline, "w") as out:
+            json.dump(results, out)
+        with self.assertRaises(CommandError):
+            call_command("benchmark", requests=2, warmup=0,
+                         baseline=baseline, stdout=StringIO(),
+                         stderr=StringIO())
+
+
+class ConditionalPageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create(username="John")
+        self.post = Post.objects.create(text="Post", author=self.author)
+
+    def test_unchanged_pages_answer_304(self):
+        urls = [
+            reverse("index"),
+            reverse("profile", args=["John"]),
+            reverse("post", args=["John", self.post.pk]),
+        ]
+        etags = {}
+        for url in urls:
+            response = self.client.get(url)
+            etags[url] = response["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+
+        Comment.objects.create(post=self.post, author=self.author, text="Hi")
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_viewer(self):
+        url = reverse("index")
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_follows_page_generation(self):
+        # Поколение лежит в общем кэше: ETag одинаков на любом воркере,
+        # не читает базу и меняется при любой инвалидации страниц
+        url = reverse("post", args=["John", self.post.pk])
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        page_cache.invalidate()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_with_csrf_cookie(self):
+        # Страница с формой комментария после нового входа должна
+        # прийти с новым CSRF-токеном, а не из кэша браузера
+        url = reverse("post", args=["John", self.post.pk])
+        self.client.force_login(self.author)
+        # Первый ответ ставит CSRF-куку
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        self.assertIn(settings.CSRF_COOKIE_NAME, self.client.cookies)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = "a" * 64
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncViewsTest(TransactionTestCase):
+    """Вне транзакции запросы async-представлений идут в пуле потоков."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username="John")
+        self.reader = User.objects.create(username="Kate")
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post = Post.objects.create(text="Async post", author=self.author)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text="Async comment")
+
+    def get(self, name, *args, user=None):
+        request = RequestFactory().get("/")
+        request.user = user or AnonymousUser()
+        return async_to_sync(getattr(async_views, name))(request, *args)
+
+    def test_pages_render(self):
+        for name, args, text in (
+            ("index", (), "Async post"),
+            ("profile", ("John",), "Отписаться"),
+            ("post_view", ("John", self.post.pk), "Async comment"),
+            ("follow_index", (), "Async post"),
+        ):
+            with self.subTest(name=name):
+                response = self.get(name, *args, user=self.reader)
+                self.assertContains(response, text)
+
+    def test_missing_author_is_404(self):
+        with self.assertRaises(Http404):
+            self.get("profile", "Nobody")
+
+    def test_follow_index_requires_login(self):
+        response = self.get("follow_index")
+        self.assertEqual(response.status_code, 302)
+
+
+class LocalBrokerTest(TestCase):
+    def test_subscribers_get_pending_messages(self):
+        broker = pubsub.LocalBroker(max_queue=2)
+        subscription = broker.subscribe("posts")
+        other = broker.subscribe("other")
+        for i in range(3):
+            broker.publish("posts", {"id": i})
+        self.assertEqual(subscription.get(timeout=0), [{"id": 0}, {"id": 1}])
+        self.assertEqual(other.get(timeout=0), [])
+
+        subscription.close()
+        broker.publish("posts", {"id": 3})
+        self.assertEqual(subscription.get(timeout=0), [])
+
+    def test_async_subscription_is_woken_from_other_threads(self):
+        broker = pubsub.LocalBroker()
+
+        async def wait():
+            with broker.subscribe_async("posts") as subscription:
+                self.assertEqual(await subscription.get(timeout=0.01), [])
+                await sync_to_async(broker.publish, thread_sensitive=False)(
+                    "posts", {"id": 1})
+                return await subscription.get(timeout=1)
+
+        self.assertEqual(async_to_sync(wait)(), [{"id": 1}])
+        self.assertFalse(broker._subscribers)
+
+
+class LiveFeedTest(TestCase):
+    """Под WSGI ответ отдаёт пропущенное и закрывается."""
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create(username="John")
+        self.stranger = User.objects.create(username="Bob")
+        self.reader = User.objects.create(username="Kate")
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.first = Post.objects.create(text="Seen", author=self.author)
+
+    def poll(self, url, data=None, **headers):
+        response = self.client.get(url, data, **headers)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = b"".join(response.streaming_content).decode()
+        self.assertTrue(events.startswith("retry: 60000\n\n"))
+        self.assertFalse(pubsub.get_broker()._subscribers)
+        return events
+
+    def test_reconnect_catches_up(self):
+        missed = Post.objects.create(text="Missed", author=self.author)
+        events = self.poll(reverse("live_index"),
+                           HTTP_LAST_EVENT_ID=str(self.first.pk))
+        self.assertIn(f"id: {missed.pk}\nevent: post\n", events)
+        self.assertIn("Missed", events)
+        self.assertNotIn("Seen", events)
+
+    def test_quiet_poll_keeps_last_event_id(self):
+        events = self.poll(reverse("live_index"))
+        self.assertEqual(events,
+                         f"retry: 60000\n\nid: {self.first.pk}\n\n")
+
+    def test_pages_do_not_subscribe_under_wsgi(self):
+        response = self.client.get(reverse("index"))
+        self.assertNotContains(response, "EventSource")
+
+    def test_follow_poll_skips_other_authors(self):
+        self.client.force_login(self.reader)
+        Post.objects.create(text="Stranger post", author=self.stranger)
+        Post.objects.create(text="Followed post", author=self.author)
+        events = self.poll(reverse("live_follow"),
+                           {"last_id": self.first.pk})
+        self.assertIn("Followed post", events)
+        self.assertNotIn("Stranger post", events)
+
+
+@override_settings(LIVE_KEEPALIVE=0.01, LIVE_STREAM_TIMEOUT=5)
+class LiveAsgiTest(TransactionTestCase):
+    """Под ASGI поток ждёт брокер в цикле событий."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username="John")
+        self.stranger = User.objects.create(username="Bob")
+        self.reader = User.objects.create(username="Kate")
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def stream(self, url, posts, headers=None):
+        """Публикует posts после первого keepalive, ждёт последнюю."""
+        published = []
+
+        def on_body(body):
+            if not published and ": keepalive" in body:
+                published.append(True)
+                for post in posts:
+                    live.get_broker().publish(pubsub.POSTS_CHANNEL, {
+                        "id": post.pk, "author_id": post.author_id})
+            return f"id: {posts[-1].pk}\n" in body
+
+        status, response_headers, body = async_to_sync(asgi_get)(
+            ASGIHandler(), url, headers=headers, on_body=on_body)
+        self.assertEqual(status, 200)
+        self.assertEqual(response_headers["content-type"],
+                         "text/event-stream")
+        # Отключение клиента закрывает подписку
+        self.assertFalse(pubsub.get_broker()._subscribers)
+        return body.decode()
+
+    def test_new_posts_are_pushed(self):
+        post = Post.objects.create(text="Live post", author=self.author)
+        events = self.stream(reverse("live_index"), [post])
+        self.assertTrue(events.startswith("retry: 3000\n\n: keepalive"))
+        self.assertIn(f"id: {post.pk}\nevent: post\n", events)
+        self.assertIn("Live post", events)
+
+    def test_pages_subscribe_under_asgi(self):
+        status, _, body = async_to_sync(asgi_get)(ASGIHandler(),
+                                                  reverse("index"))
+        self.assertEqual(status, 200)
+        self.assertIn(b"new EventSource", body)
+
+    def test_follow_stream_skips_other_authors(self):
+        client = Client()
+        client.force_login(self.reader)
+        cookie = f"sessionid={client.cookies['sessionid'].value}"
+        posts = [Post.objects.create(text="Stranger post",
+                                     author=self.stranger),
+                 Post.objects.create(text="Followed post", author=self.author)]
+        events = self.stream(reverse("live_follow"), posts,
+                             headers={"Cookie": cookie})
+        self.assertIn("Followed post", events)
+        self.assertNotIn("Stranger post", events)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), THUMBNAIL_WORKERS=0)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create(username="John")
+        self.client.force_login(self.user)
+
+    def upload(self):
+        image = BytesIO()
+        Image.new("RGB", (1200, 800), "red").save(image, "PNG")
+        return SimpleUploadedFile("red.png", image.getvalue(),
+                                  content_type="image/png")
+
+    def test_thumbnails_are_generated_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("new_post"),
+                             {"text": "With image", "image": self.upload()})
+
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (1200, 800))
+        variants = post.thumbnails["variants"]
+        self.assertEqual([v["width"] for v in variants],
+                         list(settings.THUMBNAIL_WIDTHS))
+        for variant in variants:
+            path = variant["webp"][len(settings.MEDIA_URL):]
+            self.assertTrue(os.path.exists(
+                os.path.join(settings.MEDIA_ROOT, path)))
+
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f'{variants[0]["jpeg"]} 320w')
+
+
+class BulkImportExportTest(TestCase):
+    models = ["users", "groups", "posts", "comments", "follows"]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        author = User.objects.create(username="John")
+        reader = User.objects.create(username="Kate")
+        group = Group.objects.create(title="Group", slug="group",
+                                     description="Group")
+        post = Post.objects.create(text="Пост, с \"кавычками\"\nи строкой",
+                                   author=author, group=group)
+        Post.objects.create(text="Без группы", author=author)
+        Comment.objects.create(post=post, author=reader, text="Hi")
+        Follow.objects.create(user=reader, author=author)
+        self.pub_dates = list(Post.objects.values_list("pk", "pub_date"))
+
+    def export(self, fmt):
+        for name in self.models:
+            call_command("export_data", name, format=fmt,
+                         output=os.path.join(self.tmp, f"{name}.{fmt}"),
+                         stderr=StringIO())
+
+    def load(self, fmt):
+        for name in self.models:
+            call_command("import_data", name, format=fmt, batch_size=1,
+                         input=os.path.join(self.tmp, f"{name}.{fmt}"),
+                         stdout=StringIO(), stderr=StringIO())
+
+    def assertRoundTrip(self, fmt):
+        self.export(fmt)
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.load(fmt)
+
+        author = User.objects.get(username="John")
+        reader = User.objects.get(username="Kate")
+        self.assertEqual(list(Post.objects.values_list("pk", "pub_date")),
+                         self.pub_dates)
+        post = Post.objects.get(group__slug="group")
+        self.assertEqual(post.text, "Пост, с \"кавычками\"\nи строкой")
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(post.comments.get().author, reader)
+        self.assertEqual(author.stats.posts_count, 2)
+        self.assertEqual(author.stats.followers_count, 1)
+        self.assertEqual(TimelineEntry.objects.filter(user=reader).count(), 2)
+        self.assertEqual(Group.objects.get().posts_count, 1)
+
+    def test_ndjson_round_trip(self):
+        self.assertRoundTrip("ndjson")
+
+    def test_csv_round_trip(self):
+        self.assertRoundTrip("csv")
+
+    def test_rows_with_unknown_references_are_skipped(self):
+        path = os.path.join(self.tmp, "follows.ndjson")
+        with open(path, "w") as out:
+            out.write('{"user": "Kate", "author": "Nobody"}\n')
+        stdout = StringIO()
+        call_command("import_data", "follows", input=path, skip_rebuild=True,
+                     stdout=stdout, stderr=StringIO())
+        self.assertIn("пропущено без ссылок: 1", stdout.getvalue())
+
+    def test_comments_to_missing_posts_are_skipped(self):
+        post = Post.objects.get(group__slug="group")
+        path = os.path.join(self.tmp, "comments.csv")
+        with open(path, "w") as out:
+            out.write("post,author,text\n"
+                      f"{post.pk},Kate,Found\n"
+                      "999999,Kate,Lost\n"
+                      "abc,Kate,Broken\n")
+        stdout = StringIO()
+        call_command("import_data", "comments", format="csv", input=path,
+                     skip_rebuild=True, stdout=stdout, stderr=StringIO())
+        self.assertIn("пропущено без ссылок: 2", stdout.getvalue())
+        self.assertEqual(
+            list(post.comments.order_by("pk").values_list("text", flat=True)),
+            ["Hi", "Found"])
+
+    def test_passwords_are_exported_only_on_request(self):
+        User.objects.filter(username="John").update(password="hash")
+        path = os.path.join(self.tmp, "users.ndjson")
+        call_command("export_data", "users", output=path, stderr=StringIO())
+        with open(path) as rows:
+            self.assertNotIn("password", json.loads(rows.readline()))
+        call_command("export_data", "users", output=path, with_passwords=True,
+                     stderr=StringIO())
+        with open(path) as rows:
+            self.assertEqual(json.loads(rows.readline())["password"], "hash")
+
+    def test_post_id_collision_is_refused(self):
+        self.export("ndjson")
+        call_command("import_data", "posts", ignore_conflicts=True,
+                     input=os.path.join(self.tmp, "posts.ndjson"),
+                     skip_rebuild=True, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+
+        Post.objects.all().delete()
+        other = Post.objects.create(text="Чужой",
+                                    author=User.objects.get(username="Kate"))
+        path = os.path.join(self.tmp, "posts.ndjson")
+        with open(path, "w") as out:
+            out.write(json.dumps({"id": other.pk, "author": "John",
+                                  "text": "Свой",
+                                  "pub_date": other.pub_date.isoformat()}))
+        with self.assertRaisesMessage(CommandError, f"id {other.pk}"):
+            call_command("import_data", "posts", input=path,
+                         ignore_conflicts=True, skip_rebuild=True,
+                         stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Post.objects.get().text, "Чужой")
@@ -0,0 +1,135 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from . import page_cache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def render_variants(source, target_dir, stem, widths, ratio, crop):
+    """Нарезает миниатюры картинки; выполняется в отдельном процессе.
+
+    Для каждой ширины кадр обрезается до пропорции ratio со сдвигом crop
+    (как crop="38%" у sorl) и сохраняется в JPEG и WebP.
+    Функция не трогает Django, поэтому годится для пула процессов.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    width, height = image.size
+
+    crop_height = min(height, round(width * ratio))
+    crop_width = min(width, round(crop_height / ratio))
+    left = round((width - crop_width) * crop)
+    top = round((height - crop_height) * crop)
+    frame = image.crop((left, top, left + crop_width, top + crop_height))
+
+    variants = []
+    for target_width in widths:
+        target_height = round(target_width * ratio)
+        resized = frame.resize((target_width, target_height), Image.LANCZOS)
+        files = {}
+        for kind, fmt, options in (('jpeg', 'JPEG', {'quality': 85,
+                                                    'progressive': True}),
+                                   ('webp', 'WEBP', {'quality': 80})):
+            name = f'{stem}-{target_width}.{kind}'
+            resized.save(os.path.join(target_dir, name), fmt, **options)
+            files[kind] = name
+        variants.append({'width': target_width, 'height': target_height,
+                         **files})
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(settings.THUMBNAIL_WORKERS)
+    return _executor
+
+
+def shutdown():
+    """Дожидается всех запущенных нарезок."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _job(post):
+    name = os.path.splitext(os.path.basename(post.image.name))[0]
+    stem = f'{post.pk}-{name}'
+    return (
+        default_storage.path(post.image.name),
+        default_storage.path(settings.THUMBNAIL_DIR),
+        stem,
+        settings.THUMBNAIL_WIDTHS,
+        settings.THUMBNAIL_RATIO,
+        settings.THUMBNAIL_CROP,
+    )
+
+
+def _save(post_id, source_name, result):
+    for variant in result['variants']:
+        for kind in ('jpeg', 'webp'):
+            variant[kind] = default_storage.url(
+                f'{settings.THUMBNAIL_DIR}/{variant[kind]}')
+    thumbnails = {'source': source_name, 'variants': result['variants']}
+    # Картинку могли заменить, пока шла нарезка: тогда результат не нужен
+    updated = Post.objects.filter(pk=post_id, image=source_name).update(
+        thumbnails=thumbnails,
+        image_width=result['width'],
+        image_height=result['height'],
+        version=F('version') + 1,
+    )
+    if updated:
+        page_cache.invalidate()
+
+
+def _done(post_id, source_name, future):
+    try:
+        _save(post_id, source_name, future.result())
+    except Exception:
+        logger.exception('Не удалось нарезать миниатюры записи %s', post_id)
+    finally:
+        connection.close()
+
+
+def generate(post):
+    """Запускает нарезку миниатюр для записи с картинкой.
+
+    При THUMBNAIL_WORKERS = 0 миниатюры делаются сразу в этом процессе.
+    """
+    post_id, source_name = post.pk, post.image.name
+    job = _job(post)
+    if not settings.THUMBNAIL_WORKERS:
+        try:
+            _save(post_id, source_name, render_variants(*job))
+        except Exception:
+            logger.exception('Не удалось нарезать миниатюры записи %s',
+                             post_id)
+        return
+    future = _get_executor().submit(render_variants, *job)
+    future.add_done_callback(
+        lambda future: _done(post_id, source_name, future))
+
+
+def schedule(post):
+    if not post.image:
+        if post.thumbnails or post.image_width:
+            Post.objects.filter(pk=post.pk).update(
+                thumbnails={}, image_width=None, image_height=None)
+        return
+    if post.thumbnails.get('source') == post.image.name:
+        return
+    # Файл и строка записи должны быть видны до начала нарезки
+    transaction.on_commit(lambda: generate(post))
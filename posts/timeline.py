@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.db.models import F
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .pagination import MergedKeysetPaginator
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)
+
+
+def _batch_size():
+    return getattr(settings, 'TIMELINE_BATCH_SIZE', 1000)
+
+
+def is_pull_author(author_id):
+    # Авторы с огромным числом подписчиков не раскладываются по лентам,
+    # их записи подтягиваются при чтении
+    return UserStats.objects.filter(
+        user_id=author_id, followers_count__gt=fanout_limit()).exists()
+
+
+def pull_authors(user):
+    return list(
+        Follow.objects.filter(
+            user=user, author__stats__followers_count__gt=fanout_limit())
+        .values_list('author', flat=True)
+    )
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def fan_out(post):
+    if is_pull_author(post.author_id):
+        return
+    followers = (Follow.objects.filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True)
+                 .iterator(chunk_size=_batch_size()))
+    entries = []
+    for user_id in followers:
+        entries.append(TimelineEntry(user_id=user_id, post_id=post.pk,
+                                     author_id=post.author_id,
+                                     pub_date=post.pub_date))
+        if len(entries) >= _batch_size():
+            _bulk_insert(entries)
+            entries = []
+    if entries:
+        _bulk_insert(entries)
+
+
+def backfill(follow):
+    if is_pull_author(follow.author_id):
+        return
+    size = getattr(settings, 'TIMELINE_BACKFILL_SIZE', 200)
+    posts = (Post.objects.filter(author_id=follow.author_id)
+             .order_by('-pub_date')
+             .values_list('pk', 'pub_date')[:size])
+    _bulk_insert([
+        TimelineEntry(user_id=follow.user_id, post_id=post_id,
+                      author_id=follow.author_id, pub_date=pub_date)
+        for post_id, pub_date in posts
+    ])
+
+
+def prune(follow):
+    TimelineEntry.objects.filter(user_id=follow.user_id,
+                                 author_id=follow.author_id).delete()
+
+
+# Порядок ленты: записи отдаются с аннотациями feed_date/feed_id,
+# по которым работает постраничный вывод по ключу
+FEED_ORDERING = ('-feed_date', '-feed_id')
+
+
+def feed(user):
+    """Непересекающиеся источники ленты user.
+
+    Записи из раздачи читаются по timeline_feed_idx, записи каждого
+    автора, подтягиваемого при чтении, - по post_author_feed_idx.
+    Так страница стоит LIMIT per_page + 1 на источник, сколько бы
+    записей ни было у популярных авторов.
+    """
+    pulled = pull_authors(user)
+    pushed = Post.objects.filter(timeline__user=user).annotate(
+        feed_date=F('timeline__pub_date'),
+        feed_id=F('timeline__post_id'))
+    if pulled:
+        # Записи, разложенные до того, как автор стал популярным
+        pushed = pushed.exclude(author_id__in=pulled)
+    return [pushed] + [
+        Post.objects.filter(author_id=author_id).annotate(
+            feed_date=F('pub_date'), feed_id=F('pk'))
+        for author_id in pulled
+    ]
+
+
+def paginator(user, per_page):
+    return MergedKeysetPaginator(
+        [source.with_related() for source in feed(user)], per_page,
+        FEED_ORDERING)
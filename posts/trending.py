@@ -0,0 +1,138 @@
+"""Рейтинг популярных записей и групп с затуханием по времени.
+
+Вес записи - (1 + вес комментариев + вес аудитории автора), умноженный
+на затухание по её возрасту. Каждый комментарий тоже затухает со своим
+периодом полураспада, так что свежее обсуждение поднимает запись выше
+старого. Записи и комментарии за окно TRENDING_WINDOW_HOURS читаются
+пачками в массивы NumPy, результат целиком заменяет таблицы
+TrendingPost и TrendingGroup, и страницы читают уже готовый порядок.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import page_cache
+from .models import Comment, Post, TrendingGroup, TrendingPost
+
+
+def _decay(age_seconds, half_life_hours):
+    return np.exp2(-np.maximum(age_seconds, 0) / (half_life_hours * 3600))
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load_posts(since, now, batch_size):
+    rows = (Post.objects.filter(pub_date__gte=since).order_by('pk')
+            .values_list('pk', 'group_id', 'pub_date',
+                         'author__stats__followers_count')
+            .iterator(batch_size))
+    columns = [[], [], [], []]
+    for batch in _batches(rows, batch_size):
+        pks, groups, dates, followers = zip(*batch)
+        columns[0].append(np.array(pks, dtype=np.int64))
+        columns[1].append(np.array([group or 0 for group in groups],
+                                   dtype=np.int64))
+        columns[2].append(np.array([(now - date).total_seconds()
+                                    for date in dates]))
+        columns[3].append(np.array([count or 0 for count in followers],
+                                   dtype=np.float64))
+    if not columns[0]:
+        return None
+    return [np.concatenate(column) for column in columns]
+
+
+def _comment_weights(pks, since, now, batch_size):
+    """Сумма затухающих весов комментариев к каждой записи из pks."""
+    weights = np.zeros(len(pks))
+    rows = (Comment.objects.filter(created__gte=since)
+            .order_by().values_list('post_id', 'created')
+            .iterator(batch_size))
+    half_life = settings.TRENDING_COMMENT_HALF_LIFE_HOURS
+    for batch in _batches(rows, batch_size):
+        post_ids = np.array([post or 0 for post, _ in batch], dtype=np.int64)
+        ages = np.array([(now - created).total_seconds()
+                         for _, created in batch])
+        # Комментарии к записям старше окна в рейтинг не входят
+        positions = np.minimum(np.searchsorted(pks, post_ids), len(pks) - 1)
+        found = pks[positions] == post_ids
+        weights += np.bincount(positions[found],
+                               weights=_decay(ages[found], half_life),
+                               minlength=len(pks))
+    return weights
+
+
+def score(ages, followers, comments):
+    engagement = (1 + settings.TRENDING_COMMENT_WEIGHT * comments
+                  + settings.TRENDING_FOLLOWER_WEIGHT * np.log1p(followers))
+    return engagement * _decay(ages, settings.TRENDING_HALF_LIFE_HOURS)
+
+
+def rank(pks, groups, scores, size):
+    """Лучшие записи сайта и каждой группы: (группа или 0, место, индекс)."""
+    top = np.lexsort((pks, -scores))[:size]
+    entries = [(0, place, index) for place, index in enumerate(top, 1)]
+
+    grouped = np.flatnonzero(groups)
+    order = grouped[np.lexsort((pks[grouped], -scores[grouped],
+                                groups[grouped]))]
+    _, starts, counts = np.unique(groups[order], return_index=True,
+                                  return_counts=True)
+    places = np.arange(len(order)) - np.repeat(starts, counts) + 1
+    keep = places <= size
+    entries += zip(groups[order][keep].tolist(), places[keep].tolist(),
+                   order[keep].tolist())
+    return entries
+
+
+def rank_groups(groups, scores, size):
+    grouped = groups > 0
+    ids, inverse = np.unique(groups[grouped], return_inverse=True)
+    totals = np.bincount(inverse, weights=scores[grouped])
+    top = np.lexsort((ids, -totals))[:size]
+    return [(int(ids[index]), place, float(totals[index]))
+            for place, index in enumerate(top, 1)]
+
+
+def compute(now=None, batch_size=10000):
+    now = now or timezone.now()
+    since = now - timedelta(hours=settings.TRENDING_WINDOW_HOURS)
+    posts = _load_posts(since, now, batch_size)
+    entries, group_entries = [], []
+    if posts is not None:
+        pks, groups, ages, followers = posts
+        comments = _comment_weights(pks, since, now, batch_size)
+        scores = score(ages, followers, comments)
+        entries = [
+            TrendingPost(scope_id=group or None, post_id=int(pks[index]),
+                         rank=place, score=float(scores[index]))
+            for group, place, index in rank(pks, groups, scores,
+                                            settings.TRENDING_SIZE)
+        ]
+        group_entries = [
+            TrendingGroup(group_id=group, rank=place, score=total)
+            for group, place, total in rank_groups(
+                groups, scores, settings.TRENDING_GROUPS)
+        ]
+    with transaction.atomic():
+        TrendingPost.objects.all().delete()
+        TrendingGroup.objects.all().delete()
+        TrendingPost.objects.bulk_create(entries, batch_size=1000)
+        TrendingGroup.objects.bulk_create(group_entries)
+    page_cache.invalidate()
+    return {
+        'posts': 0 if posts is None else len(posts[0]),
+        'entries': len(entries),
+        'groups': len(group_entries),
+    }
@@ -1,17 +1,26 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+# Под ASGI лента, профиль и запись обслуживаются async-представлениями
+pages = async_views if settings.ASYNC_VIEWS else views
 
 
 urlpatterns = [
-    path('', views.index, name='index'),
+    path('', pages.index, name='index'),
     path('group/<slug>/', views.group_posts, name='group_posts'),
+    path('group/<slug>/trending/', views.group_trending,
+         name='group_trending'),
+    path('trending/', views.trending, name='trending'),
     path('new_post/', views.new_post, name='new_post'),
-    path("follow/", views.follow_index, name="follow_index"),
+    path("follow/", pages.follow_index, name="follow_index"),
+    path('live/', views.live_index, name='live_index'),
+    path('follow/live/', views.live_follow, name='live_follow'),
     path("<str:username>/follow", views.profile_follow, name='profile_follow'),
     path("<str:username>/unfollow",
          views.profile_unfollow, name='profile_unfollow'),
-    path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    path('<str:username>/<int:post_id>/', pages.post_view, name='post'),
     path(
         '<str:username>/<int:post_id>/edit/',
         views.post_edit,
@@ -21,5 +30,5 @@ urlpatterns = [
     path('500/', views.server_error, name='500'),
     path("<username>/<int:post_id>/comment",
          views.add_comment, name="add_comment"),
-    path('<str:username>/', views.profile, name='profile'),
+    path('<str:username>/', pages.profile, name='profile'),
 ]
@@ -1,16 +1,27 @@
-from django.core.paginator import Paginator
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import AnonymousUser
 
-from .models import Post, Group, User, Follow
+from yatube.handlers import AsyncStreamingHttpResponse
+from yatube.sqlite import write
+
+from .models import Post, Group, User, Follow, TrendingGroup, TrendingPost
 from .forms import PostForm, CommentForm
+from .loaders import get_loaders
+from .page_cache import anonymous_page_cache, conditional_page
+from .pagination import COMMENT_ORDERING, KeysetPaginator
+from . import graph, live, page_cache, timeline
 
 
+@conditional_page()
+@anonymous_page_cache
 def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.with_related()
+    paginator = KeysetPaginator(post_list, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
 
     return render(request, "index.html", {
         "page": page,
@@ -18,27 +29,54 @@ def index(request):
     })
 
 
+@conditional_page()
+@anonymous_page_cache
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()[:12]
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = group.posts.with_related()
+    paginator = KeysetPaginator(posts, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
     return render(request, 'group.html', {
         "page": page,
         "paginator": paginator
     })
 
 
+def _trending_posts(scope):
+    entries = (TrendingPost.objects.filter(scope=scope)
+               .select_related('post__author', 'post__group'))
+    return [entry.post for entry in entries]
+
+
+@conditional_page()
+@anonymous_page_cache
+def trending(request):
+    return render(request, 'trending.html', {
+        "posts": _trending_posts(None),
+        "groups": [entry.group for entry
+                   in TrendingGroup.objects.select_related('group')],
+    })
+
+
+@conditional_page()
+@anonymous_page_cache
+def group_trending(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return render(request, 'trending.html', {
+        "group": group,
+        "posts": _trending_posts(group),
+    })
+
+
 @login_required()
 def new_post(request):
     if request.method == 'POST':
-        form = PostForm(request.POST)
+        form = PostForm(request.POST, files=request.FILES or None)
 
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
-            post.save()
+            write(post.save)
             return redirect('index')
         return render(request, 'new_post.html', {'form': form})
 
@@ -46,45 +84,44 @@ def new_post(request):
     return render(request, 'new_post.html', {'form': form})
 
 
+@conditional_page(page_cache.profile_stamp)
+@anonymous_page_cache
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    auth_user = None
-    following = False
-    if request.user.is_authenticated:
-        auth_user = get_object_or_404(User, username=request.user)
-        if auth_user.follower.filter(author=author):
-            following = True
-
-    posts = author.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    loaders = get_loaders(request)
+    author = loaders.users.load(username).get()
+    if author is None:
+        raise Http404
+
+    posts = author.posts.with_related()
+    paginator = KeysetPaginator(posts, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
     context = {
         "author": author,
         "page": page,
         "paginator": paginator,
-        "following": following
+        "following": loaders.following.load(username),
+        "suggestions": graph.suggested_users(request.user),
     }
     return render(request, 'profile.html', context)
 
 
+@conditional_page()
+@anonymous_page_cache
 def post_view(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = author.posts.get(pk=post_id)
+    post = get_object_or_404(
+        Post.objects.with_related().select_related('author__stats'),
+        pk=post_id, author__username=username)
     form = CommentForm()
-    items = post.comments.all()
-
-    following = False
-    if request.user.is_authenticated:
-        current_user = get_object_or_404(User, username=request.user)
-        if Follow.objects.filter(user=current_user, author=author):
-            following = True
+    items = KeysetPaginator(post.comments.select_related('author'),
+                            settings.COMMENTS_PER_PAGE,
+                            COMMENT_ORDERING).get_page(
+                                request.GET.get('cursor'))
 
     context = {
         "post": post,
         "form": form,
         "items": items,
-        "following": following
+        "following": get_loaders(request).following.load(username),
     }
     return render(request, 'post.html', context)
 
@@ -102,7 +139,7 @@ def post_edit(request, username, post_id):
 
     if request.method == 'POST':
         if form.is_valid():
-            form.save()
+            write(form.save)
             return redirect("post",
                             username=request.user.username,
                             post_id=post_id)
@@ -117,7 +154,7 @@ def post_edit(request, username, post_id):
     )
 
 
-def page_not_found(request, exception):
+def page_not_found(request, exception=None):
     # Переменная exception содержит отладочную информацию,
     # выводить её в шаблон пользователской страницы 404 мы не станем
     return render(request, "misc/404.html", {"path": request.path}, status=404)
@@ -132,31 +169,18 @@ def add_comment(request, username, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
 
-    if request.method == 'POST':
-        if form.is_valid:
-            comment = form.save()
-            comment.post = post
-            comment.author = request.user
-            comment.save()
-            return redirect('post', username=username, post_id=post_id)
-
-    return render(request, 'comments.html', {
-        "form": form,
-        'items': post,
-        'profile': profile
-    })
+    if form.is_valid():
+        comment = form.save(commit=False)
+        comment.post = post
+        comment.author = request.user
+        write(comment.save)
+    return redirect('post', username=username, post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    current_user = get_object_or_404(User, username=request.user)
-    subscribes = current_user.follower.values_list('author')
-    post_list = Post.objects.filter(
-        author__in=subscribes).order_by('-pub_date')
-
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator = timeline.paginator(request.user, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
 
     return render(request, "follow.html", {
         "page": page,
@@ -166,20 +190,54 @@ def follow_index(request):
 
 @login_required
 def profile_follow(request, username):
-    auth_user = get_object_or_404(User, username=request.user)
+    auth_user = request.user
     user_to_follow = get_object_or_404(User, username=username)
 
-    Follow.objects.create(user=auth_user, author=user_to_follow)
+    if auth_user != user_to_follow:
+        write(Follow.objects.get_or_create, user=auth_user,
+              author=user_to_follow)
 
     return redirect('profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    auth_user = get_object_or_404(User, username=request.user)
+    auth_user = request.user
     user_to_unfollow = get_object_or_404(User, username=username)
 
     follow = get_object_or_404(Follow, user=auth_user, author=user_to_unfollow)
-    follow.delete()
+    write(follow.delete)
 
     return redirect('profile', username=username)
+
+
+def _live_response(request, authors=None):
+    last_id = (request.headers.get('Last-Event-ID')
+               or request.GET.get('last_id', ''))
+    last_id = int(last_id) if last_id.isdigit() else None
+    # request.user ленивый: сессия читается здесь, в потоке запроса
+    user = (request.user if request.user.is_authenticated
+            else AnonymousUser())
+    if isinstance(request, ASGIRequest):
+        response = AsyncStreamingHttpResponse(
+            live.astream(user, authors, last_id),
+            content_type='text/event-stream')
+    else:
+        response = StreamingHttpResponse(
+            live.poll(user, authors, last_id),
+            content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен копить события в буфере
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def live_index(request):
+    return _live_response(request)
+
+
+@login_required
+def live_follow(request):
+    authors = set(Follow.objects.filter(user=request.user)
+                  .values_list('author_id', flat=True))
+    return _live_response(request, authors)
@@ -2,12 +2,42 @@ from rest_framework import serializers
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import get_user_model
 
+from posts.loaders import get_loaders
+
 
 User = get_user_model()
 
+
+class UserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Ключи всей страницы попадают в одну пачку, и подписки
+        # проверяются одним запросом вместо запроса на пользователя
+        users = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        if request is not None:
+            get_loaders(request).following.load_many(
+                user.username for user in users)
+        return super().to_representation(users)
+
+
 class UserSerializer(serializers.ModelSerializer):
     permission_classes = (IsAuthenticated, )
+    posts_count = serializers.IntegerField(source='stats.posts_count',
+                                           read_only=True)
+    followers_count = serializers.IntegerField(
+        source='stats.followers_count', read_only=True)
+    following_count = serializers.IntegerField(
+        source='stats.following_count', read_only=True)
+    following = serializers.SerializerMethodField()
+
     class Meta:
         model = User
         exclude = ('password', )
         read_only_fields = ['username']
+        list_serializer_class = UserListSerializer
+
+    def get_following(self, user):
+        request = self.context.get('request')
+        if request is None:
+            return False
+        return get_loaders(request).following.load(user.username).get()
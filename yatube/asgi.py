@@ -0,0 +1,14 @@
+"""Точка входа ASGI (uvicorn yatube.asgi:application).
+
+Включает async-версии ленты, профиля и записи. Обработчик из
+yatube.handlers отдаёт потоковые ответы (выгрузку записей) из потока
+запроса: стандартный обработчик Django 3.2 под ASGI их не выдерживает.
+"""
+import os
+
+from yatube.handlers import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+os.environ.setdefault('YATUBE_ASYNC_VIEWS', '1')
+
+application = get_asgi_application()
@@ -0,0 +1,164 @@
+"""Кэш Django в общем для всех процессов файле SQLite.
+
+LocMemCache у каждого процесса свой: поколение страниц, блокировка
+пересборки страницы и закрепление клиентов за основной базой не видны
+другим воркерам. Этот кэш хранит записи в одном файле (WAL) на все
+процессы машины. add() и incr() атомарны: проверка и запись идут
+в одной транзакции BEGIN IMMEDIATE.
+
+Целые числа хранятся как есть, чтобы incr() складывал их в SQL,
+остальные значения - через pickle.
+"""
+import os
+import pickle
+import random
+import tempfile
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .sqlite import SharedFile
+
+# Доля записей, после которых чистятся просроченные строки
+CULL_PROBABILITY = 0.01
+
+
+def _encode(value):
+    if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode(raw):
+    return raw if isinstance(raw, int) else pickle.loads(raw)
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location or os.path.join(tempfile.gettempdir(),
+                                             'yatube-cache.sqlite3')
+        self.file = SharedFile(self.path, [
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL) '
+            'WITHOUT ROWID',
+            'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)'])
+
+    def connection(self):
+        return self.file.connection()
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _transaction(self):
+        return self.file.immediate()
+
+    def get(self, key, default=None, version=None):
+        row = self.connection().execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self._key(key, version), time.time())).fetchone()
+        return default if row is None else _decode(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        found = {}
+        names = list(keys)
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            rows = self.connection().execute(
+                'SELECT key, value FROM cache WHERE key IN ({}) '
+                'AND (expires IS NULL OR expires > ?)'.format(
+                    ', '.join('?' * len(chunk))),
+                (*chunk, time.time()))
+            for name, raw in rows:
+                found[keys[name]] = _decode(raw)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [(self._key(key, version), _encode(value), expires)
+                for key, value in data.items()]
+        with self._transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)', rows)
+        if random.random() < CULL_PROBABILITY:
+            self._cull()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._transaction() as connection:
+            if connection.execute(
+                    'SELECT 1 FROM cache WHERE key = ? '
+                    'AND (expires IS NULL OR expires > ?)',
+                    (key, now)).fetchone():
+                return False
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                (key, _encode(value), self.get_backend_timeout(timeout)))
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        name = self._key(key, version)
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (name, time.time())).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = _decode(row[0]) + delta
+            connection.execute('UPDATE cache SET value = ? WHERE key = ?',
+                               (_encode(value), name))
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self.connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), self._key(key, version),
+             time.time()))
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        return self.connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self._key(key, version), time.time())).fetchone() is not None
+
+    def delete(self, key, version=None):
+        cursor = self.connection().execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),))
+        return cursor.rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        with self._transaction() as connection:
+            connection.executemany(
+                'DELETE FROM cache WHERE key = ?',
+                [(self._key(key, version),) for key in keys])
+
+    def clear(self):
+        self.connection().execute('DELETE FROM cache')
+
+    def _cull(self):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM cache WHERE expires <= ?',
+                               (time.time(),))
+            count = connection.execute(
+                'SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count > self._max_entries:
+                # Первыми уходят записи, которые раньше всех истекут
+                connection.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                    'ORDER BY expires IS NULL, expires LIMIT ?)',
+                    (count // self._cull_frequency,))
+
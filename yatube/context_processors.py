@@ -1,5 +1,13 @@
 import datetime as dt
 
+from django.core.handlers.asgi import ASGIRequest
+
+
 def year(request):
     year = dt.datetime.now().year
     return {'year':year}
+
+
+def live_updates(request):
+    # Живая лента держит соединение открытым, а это по силам только ASGI
+    return {'live_updates': isinstance(request, ASGIRequest)}
@@ -0,0 +1,149 @@
+"""Чтение с реплик, запись на основную базу.
+
+Внутри HTTP-запроса чтение уходит на случайную реплику из
+DATABASE_REPLICAS. Запрос закрепляется за основной базой, если это
+не GET/HEAD/OPTIONS, если он уже что-то записал, или если клиент
+недавно писал сам: тогда он сразу видит свою запись, не дожидаясь
+репликации. Вне запросов (команды, миграции) всё идёт на основную базу.
+
+Браузер носит отметку о записи в cookie. API-клиенты с заголовком
+Authorization cookie не хранят, и их отметка лежит в кэше
+DATABASE_PIN_CACHE. Следующий запрос клиента может попасть в другой
+воркер, поэтому кэш обязан быть общим для процессов.
+"""
+import asyncio
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'db_primary'
+
+# Кэши, которые у каждого процесса свои
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_request_state = ContextVar('db_router_state', default=None)
+
+
+def _pin_key(request):
+    # API-клиенты без cookie закрепляются по своему токену
+    header = request.META.get('HTTP_AUTHORIZATION')
+    if not header:
+        return None
+    return 'db_pin:' + hashlib.md5(header.encode()).hexdigest()
+
+
+def _pinned_by_request(request):
+    return (request.method not in ('GET', 'HEAD', 'OPTIONS')
+            or bool(request.COOKIES.get(PIN_COOKIE)))
+
+
+def is_pinned(request):
+    if _pinned_by_request(request):
+        return True
+    key = _pin_key(request)
+    return key is not None and _pins().get(key) is not None
+
+
+def _pins():
+    return caches[settings.DATABASE_PIN_CACHE]
+
+
+@checks.register(checks.Tags.caches)
+def check_pin_cache(app_configs, **kwargs):
+    if not settings.DATABASE_REPLICAS:
+        return []
+    backend = settings.CACHES[settings.DATABASE_PIN_CACHE]['BACKEND']
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [checks.Error(
+        f'DATABASE_PIN_CACHE использует {backend}: другие воркеры не '
+        f'увидят закрепление API-клиента и отдадут ему чтение с реплики.',
+        hint='Укажите кэш, общий для всех процессов сервера.',
+        id='yatube.E001',
+    )]
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        replicas = settings.DATABASE_REPLICAS
+        if state is None or state['pinned'] or not replicas:
+            return DEFAULT_DB_ALIAS
+        return state.setdefault('replica', random.choice(replicas))
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['pinned'] = state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinMiddleware:
+    """Закрепляет клиента за основной базой после записи.
+
+    Закрепление держится DATABASE_PIN_SECONDS: браузеру ставится cookie,
+    а для запросов с заголовком Authorization отметка кладётся в общий
+    кэш DATABASE_PIN_CACHE.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = {'pinned': is_pinned(request), 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state['wrote']:
+            self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        # В кэш закреплений ходят только запросы с Authorization
+        pinned = _pinned_by_request(request)
+        if not pinned and _pin_key(request) is not None:
+            pinned = await sync_to_async(is_pinned)(request)
+        state = {'pinned': pinned, 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state['wrote']:
+            await sync_to_async(self.pin)(request, response)
+        return response
+
+    @staticmethod
+    def pin(request, response):
+        seconds = settings.DATABASE_PIN_SECONDS
+        response.set_cookie(PIN_COOKIE, '1', max_age=seconds,
+                            httponly=True, samesite='Lax')
+        key = _pin_key(request)
+        if key is not None:
+            _pins().set(key, 1, seconds)
@@ -0,0 +1,142 @@
+"""ASGI-обработчик, который умеет отдавать потоковые ответы.
+
+Обработчик Django 3.2 перебирает StreamingHttpResponse прямо в цикле
+событий, и генератор, который читает базу (выгрузка записей), падает
+с SynchronousOnlyOperation. Здесь каждая часть ответа берётся из
+итератора в потоке запроса, как под WSGI. Синхронный код каждого
+запроса выполняется в своём потоке (ThreadSensitiveContext), а не в
+одном потоке на весь процесс, так что долгая выгрузка не задерживает
+другие запросы и не делит с ними соединение с базой.
+
+Долгие потоки событий отдаются через AsyncStreamingHttpResponse из
+асинхронного генератора. Такой ответ после заголовков отпускает поток
+запроса и дальше живёт только в цикле событий, пока генератор не
+кончится или клиент не отключится.
+"""
+import asyncio
+from contextlib import suppress
+from contextvars import ContextVar
+
+import django
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.handlers import asgi
+from django.http import StreamingHttpResponse
+
+_END = object()
+# Асинхронные потоковые ответы, чьё тело отдаётся после выхода из
+# ThreadSensitiveContext
+_deferred = ContextVar('deferred_responses')
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """Потоковый ответ из асинхронного итератора.
+
+    Отдать его может только ASGIHandler отсюда; под WSGI представление
+    должно вернуть обычный StreamingHttpResponse.
+    """
+
+    def _set_streaming_content(self, value):
+        self._iterator = value
+
+    def __iter__(self):
+        raise TypeError('AsyncStreamingHttpResponse отдаётся только '
+                        'через yatube.handlers.ASGIHandler')
+
+    async def __aiter__(self):
+        async for part in self._iterator:
+            yield self.make_bytes(part)
+
+    async def aclose(self):
+        if hasattr(self._iterator, 'aclose'):
+            await self._iterator.aclose()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    async def __call__(self, scope, receive, send):
+        deferred = []
+        token = _deferred.set(deferred)
+        try:
+            async with ThreadSensitiveContext():
+                await super().__call__(scope, receive, send)
+        finally:
+            _deferred.reset(token)
+        # Поток запроса уже завершён, тело события отдаёт цикл событий
+        for response in deferred:
+            await self.send_async_body(response, send, receive)
+
+    async def send_response(self, response, send):
+        if isinstance(response, AsyncStreamingHttpResponse):
+            await self.send_start(response, send)
+            # request_finished закрывает соединения потока запроса; тело
+            # уйдёт после выхода из ThreadSensitiveContext
+            await sync_to_async(response.close, thread_sensitive=True)()
+            _deferred.get().append(response)
+            return
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        await self.send_start(response, send)
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await next_part(parts, _END)
+            if part is _END:
+                break
+            await self.send_part(part, send)
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    async def send_async_body(self, response, send, receive):
+        # Тело запроса уже прочитано: следующее сообщение - отключение
+        disconnect = asyncio.ensure_future(receive())
+        parts = response.__aiter__()
+        try:
+            while True:
+                part = asyncio.ensure_future(parts.__anext__())
+                await asyncio.wait({part, disconnect},
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not part.done():
+                    part.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await part
+                    return
+                try:
+                    await self.send_part(part.result(), send)
+                except StopAsyncIteration:
+                    break
+            await send({'type': 'http.response.body'})
+        finally:
+            disconnect.cancel()
+            await parts.aclose()
+            await response.aclose()
+
+    async def send_start(self, response, send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.response_headers(response),
+        })
+
+    async def send_part(self, part, send):
+        for chunk, _ in self.chunk_bytes(part):
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': True,
+            })
+
+    @staticmethod
+    def response_headers(response):
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ]
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(
+                header='').encode('ascii').strip()))
+        return headers
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,287 @@
+"""Метрики запросов по представлениям в текстовом формате Prometheus.
+
+Каждый процесс копит счётчики в памяти и раз в METRICS_FLUSH_INTERVAL
+секунд сбрасывает их в свой файл в METRICS_DIR. Страница /metrics
+складывает файлы всех процессов, поэтому за балансировщиком видна
+сумма по всем воркерам.
+"""
+import asyncio
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.template.backends.django import Template
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+# Поля накопителя по одному представлению и методу
+TOTALS = ('count', 'duration', 'queries', 'query_time', 'template_time',
+          'response_bytes')
+
+_lock = threading.Lock()
+_totals = {}
+_last_flush = 0.0
+# Счётчики текущего запроса. Контекст копируется в потоки sync_to_async
+# и в поток-писатель, поэтому запросы async-представлений из пула
+# потоков попадают в счётчики своего запроса
+_current = ContextVar('metrics_request', default=None)
+_local = threading.local()
+_instrumented = False
+
+
+def _directory():
+    return getattr(settings, 'METRICS_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'yatube-metrics')
+
+
+def _empty():
+    return dict({field: 0 for field in TOTALS},
+                buckets=[0] * (len(LATENCY_BUCKETS) + 1))
+
+
+def record(view, method, duration, queries, query_time, template_time,
+           response_bytes):
+    with _lock:
+        entry = _totals.setdefault(f'{view}\t{method}', _empty())
+        entry['count'] += 1
+        entry['duration'] += duration
+        entry['queries'] += queries
+        entry['query_time'] += query_time
+        entry['template_time'] += template_time
+        entry['response_bytes'] += response_bytes
+        entry['buckets'][bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+
+def _flush_due():
+    return (time.monotonic() - _last_flush
+            >= settings.METRICS_FLUSH_INTERVAL)
+
+
+def flush(force=False):
+    """Сбрасывает счётчики процесса в его файл, не чаще раза в интервал."""
+    global _last_flush
+    if not force and not _flush_due():
+        return
+    with _lock:
+        _last_flush = time.monotonic()
+        data = json.dumps(_totals)
+    directory = _directory()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as out:
+        out.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def collect():
+    """Сумма счётчиков всех процессов."""
+    flush(force=True)
+    merged = {}
+    directory = _directory()
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as source:
+                totals = json.load(source)
+        except (OSError, ValueError):
+            continue
+        for key, entry in totals.items():
+            target = merged.setdefault(key, _empty())
+            for field in TOTALS:
+                target[field] += entry[field]
+            target['buckets'] = [a + b for a, b in
+                                 zip(target['buckets'], entry['buckets'])]
+    return merged
+
+
+def _labels(key, **extra):
+    view, method = key.split('\t')
+    labels = dict(view=view, method=method, **extra)
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"'))
+        for name, value in labels.items()) + '}'
+
+
+def render(merged):
+    lines = [
+        '# HELP yatube_request_duration_seconds Время ответа представления.',
+        '# TYPE yatube_request_duration_seconds histogram',
+    ]
+    for key, entry in sorted(merged.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',),
+                                entry['buckets']):
+            cumulative += count
+            lines.append('yatube_request_duration_seconds_bucket{} {}'.format(
+                _labels(key, le=bound), cumulative))
+        lines.append('yatube_request_duration_seconds_sum{} {}'.format(
+            _labels(key), entry['duration']))
+        lines.append('yatube_request_duration_seconds_count{} {}'.format(
+            _labels(key), entry['count']))
+
+    for name, field, help_text in (
+            ('yatube_db_queries_total', 'queries', 'Число SQL-запросов.'),
+            ('yatube_db_query_seconds_total', 'query_time',
+             'Время SQL-запросов.'),
+            ('yatube_template_render_seconds_total', 'template_time',
+             'Время отрисовки шаблонов.'),
+            ('yatube_response_bytes_total', 'response_bytes',
+             'Размер тела ответов.')):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for key, entry in sorted(merged.items()):
+            lines.append(f'{name}{_labels(key)} {entry[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized(request):
+    # За прокси REMOTE_ADDR - адрес прокси, поэтому доступ только по токену
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(header.encode(),
+                                               f'Bearer {token}'.encode())
+
+
+def metrics_view(request):
+    if not _authorized(request):
+        raise PermissionDenied
+    return HttpResponse(render(collect()),
+                        content_type='text/plain; version=0.0.4')
+
+
+class _RequestTotals:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+
+    def add_query(self, duration):
+        with self.lock:
+            self.queries += 1
+            self.query_time += duration
+
+    def add_template(self, duration):
+        with self.lock:
+            self.template_time += duration
+
+
+def _count_query(execute, sql, params, many, context):
+    totals = _current.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals.add_query(time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def _instrument_templates():
+    """Засекает время отрисовки шаблонов.
+
+    Считается только внешний вызов: вложенные render_to_string (например,
+    карточки записей внутри страницы) уже входят в его время.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    _instrumented = True
+    original = Template.render
+
+    def timed_render(self, *args, **kwargs):
+        totals = _current.get()
+        if totals is None or getattr(_local, 'depth', 0):
+            return original(self, *args, **kwargs)
+        _local.depth = 1
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            _local.depth = 0
+            totals.add_template(time.perf_counter() - started)
+
+    Template.render = timed_render
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if settings.METRICS_ENABLED:
+            _instrument_templates()
+        if asyncio.iscoroutinefunction(get_response):
+            # Под ASGI цепочка не тратит на middleware отдельный поток
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        # Соединения, открытые до подключения сигнала
+        for connection in connections.all():
+            _instrument_connection(None, connection)
+        totals = _RequestTotals()
+        token = _current.set(totals)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, totals, started)
+        flush()
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        # Синхронный код запроса работает в новом потоке, и его
+        # соединения подключаются сигналом connection_created
+        totals = _RequestTotals()
+        token = _current.set(totals)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, totals, started)
+        if _flush_due():
+            await sync_to_async(flush, thread_sensitive=False)()
+        return response
+
+    @staticmethod
+    def observe(request, response, totals, started):
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = 'unmatched'
+        if match is not None:
+            view = match.url_name or match.route
+        size = 0 if response.streaming else len(response.content)
+        record(view, request.method, duration, totals.queries,
+               totals.query_time, totals.template_time, size)
@@ -36,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.db_router.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -61,7 +63,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'yatube.context_processors.year'
+                'yatube.context_processors.year',
+                'yatube.context_processors.live_updates',
             ],
         },
     },
@@ -73,9 +76,58 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Сколько секунд ждать занятую базу, прежде чем сдаться
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# Прагмы на каждом соединении SQLite; WAL даёт читать во время записи
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+# Запись из представлений идёт через один поток-писатель на процесс,
+# который объединяет до SQLITE_WRITE_BATCH заданий в одну транзакцию
+SQLITE_WRITE_QUEUE = True
+SQLITE_WRITE_BATCH = 50
+SQLITE_WRITE_RETRIES = 5
+
+# Реплики только для чтения: YATUBE_DB_REPLICAS - пути к файлам SQLite
+# через запятую. Клиент, который что-то записал, ещё
+# DATABASE_PIN_SECONDS читает с основной базы
+DATABASE_REPLICAS = []
+for number, path in enumerate(
+        filter(None, os.environ.get('YATUBE_DB_REPLICAS', '').split(',')), 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['yatube.db_router.PrimaryReplicaRouter']
+DATABASE_PIN_SECONDS = 10
+# Кэш с закреплениями API-клиентов; должен быть общим для процессов
+DATABASE_PIN_CACHE = 'default'
+
+# Кэш общий для всех процессов сервера: поколение страниц, блокировки
+# их пересборки и закрепление клиентов за основной базой должны видеть
+# все воркеры. YATUBE_CACHE_PATH - файл SQLite (по умолчанию во
+# временном каталоге)
+CACHES = {
+    'default': {
+        'BACKEND': 'yatube.cache.SQLiteCache',
+        'LOCATION': os.environ.get('YATUBE_CACHE_PATH', ''),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Тесты работают со своим файлом кэша
+TEST_RUNNER = 'yatube.test_runner.TestRunner'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME':
@@ -134,12 +186,16 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS':
     ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.UserRateThrottle',
-        'rest_framework.throttling.AnonRateThrottle',
+        'api_yatube.throttling.UserRateThrottle',
+        'api_yatube.throttling.AnonRateThrottle',
+        'api_yatube.throttling.ScopedRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'user': '100/min',
         'anon': '10/min',
+        # Отдельные лимиты тяжёлых эндпоинтов (throttle_scope)
+        'export': '10/hour',
+        'batch': '30/min',
     },
     'DEFAULT_PAGINATION_CLASS':
     'rest_framework.pagination.LimitOffsetPagination',
@@ -147,6 +203,87 @@ REST_FRAMEWORK = {
     10,
 }
 
+# Лента подписок: авторы, у которых подписчиков больше лимита,
+# не раскладываются по лентам при публикации, а подтягиваются при чтении
+TIMELINE_FANOUT_LIMIT = 10000
+TIMELINE_BACKFILL_SIZE = 200
+TIMELINE_BATCH_SIZE = 1000
+
+# Срок жизни закэшированных карточек записей; ключ меняется вместе с
+# версией записи, так что устаревшие карточки просто вытесняются
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Кэш страниц для незалогиненных: страница свежа PAGE_CACHE_TIMEOUT
+# секунд, после этого ещё PAGE_CACHE_STALE_TIMEOUT секунд отдаётся
+# старая версия, пока один запрос пересобирает новую
+PAGE_CACHE_TIMEOUT = 30
+PAGE_CACHE_STALE_TIMEOUT = 300
+PAGE_CACHE_LOCK_TIMEOUT = 10
+
+# Миниатюры картинок записей нарезаются при загрузке в пуле из
+# THUMBNAIL_WORKERS процессов (0 - прямо в процессе запроса)
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_DIR = 'posts/thumbs'
+THUMBNAIL_WIDTHS = (320, 640, 960)
+THUMBNAIL_RATIO = 339 / 960
+THUMBNAIL_CROP = 0.38
+
+# Комментариев на странице записи; дальше - по ссылке «Ещё»
+COMMENTS_PER_PAGE = 20
+
+# Async-версии ленты, профиля и записи; yatube/asgi.py включает их
+ASYNC_VIEWS = os.environ.get('YATUBE_ASYNC_VIEWS') == '1'
+
+# Живая лента по SSE работает только под ASGI (yatube/asgi.py):
+# соединение держится до LIVE_STREAM_TIMEOUT секунд и не занимает
+# поток. Под WSGI страницы не подключают её скрипт, а сам адрес ленты
+# отдаёт пропущенное и просит переподключиться через
+# LIVE_POLL_RETRY_MS мс. LocalBroker рассылает события только внутри
+# процесса
+PUBSUB_BROKER = 'posts.pubsub.LocalBroker'
+LIVE_KEEPALIVE = 15
+LIVE_RETRY_MS = 3000
+LIVE_POLL_RETRY_MS = 60000
+LIVE_STREAM_TIMEOUT = 300
+LIVE_CATCH_UP_LIMIT = 50
+
+# Граф подписок в памяти для блока «кого почитать». Снимок от
+# reload_follow_graph кладётся в FOLLOW_GRAPH_PATH (None - каждый
+# процесс строит граф из базы раз в FOLLOW_GRAPH_MAX_AGE секунд)
+FOLLOW_GRAPH_PATH = None
+FOLLOW_GRAPH_CHECK_INTERVAL = 30
+FOLLOW_GRAPH_MAX_AGE = 600
+FOLLOW_GRAPH_JOURNAL = 600
+FOLLOW_GRAPH_COMPACT = 10000
+FOLLOW_SUGGESTIONS = 5
+
+# Популярное: compute_trending пересчитывает рейтинг по записям за
+# последние TRENDING_WINDOW_HOURS часов. Вес записи и каждого
+# комментария убывает вдвое за свой период полураспада
+TRENDING_WINDOW_HOURS = 72
+TRENDING_HALF_LIFE_HOURS = 12
+TRENDING_COMMENT_HALF_LIFE_HOURS = 6
+TRENDING_COMMENT_WEIGHT = 1.0
+TRENDING_FOLLOWER_WEIGHT = 0.5
+TRENDING_SIZE = 50
+TRENDING_GROUPS = 10
+
+# Ведра токенов для ограничения частоты API общие для всех процессов
+# и лежат в файле SQLite (None - во временном каталоге)
+THROTTLE_DB_PATH = None
+THROTTLE_PRUNE_PROBABILITY = 0.001
+
+# Наибольшее число операций в одном запросе к /api/v1/batch/
+API_BATCH_LIMIT = 500
+
+# Метрики представлений: процессы сбрасывают счётчики в METRICS_DIR
+# (None - временный каталог), /metrics отдаёт их сумму по заголовку
+# "Authorization: Bearer <METRICS_TOKEN>". Без токена страница закрыта
+METRICS_ENABLED = True
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN')
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
 
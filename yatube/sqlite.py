@@ -0,0 +1,189 @@
+"""Профиль SQLite для продакшена.
+
+На каждом соединении включаются прагмы из SQLITE_PRAGMAS (WAL,
+synchronous=NORMAL, mmap, размер кэша). Запись из представлений идёт
+через write(): один поток-писатель на процесс забирает задания из
+очереди и выполняет пачку в общей транзакции, каждое в своей точке
+сохранения. Так писатели не дерутся за блокировку базы, а при
+«database is locked» захват блокировки повторяется с паузой.
+
+SharedFile - служебный файл SQLite вне Django, общий для процессов
+машины: на нём живут кэш и вёдра ограничения частоты запросов.
+"""
+import contextvars
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_jobs = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def _is_locked(error):
+    return isinstance(error, OperationalError) and 'locked' in str(error)
+
+
+class _Job:
+    def __init__(self, func, args, kwargs):
+        # Контекст вызывающего потока нужен, например, роутеру баз
+        self.context = contextvars.copy_context()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+    def run(self):
+        return self.context.run(self.func, *self.args, **self.kwargs)
+
+
+def _lock_for_write(connection):
+    # Пустой UPDATE сразу берёт блокировку записи, как BEGIN IMMEDIATE
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE django_migrations SET id = id WHERE 0')
+
+
+def _run_batch(batch):
+    """Выполняет пачку в одной транзакции.
+
+    Повторяется только захват блокировки записи: до него ни одно задание
+    не выполнялось. Задание нельзя запустить второй раз - после отката
+    объекты, которые оно сохраняло, уже с pk и _state.adding = False,
+    и повторный save() сделал бы UPDATE несуществующей строки.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    retries = settings.SQLITE_WRITE_RETRIES
+    results = []
+    try:
+        with transaction.atomic():
+            for attempt in range(retries + 1):
+                try:
+                    _lock_for_write(connection)
+                    break
+                except OperationalError as error:
+                    if not _is_locked(error) or attempt == retries:
+                        raise
+                time.sleep(0.01 * 2 ** attempt)
+            for job in batch:
+                try:
+                    with transaction.atomic():
+                        results.append((True, job.run()))
+                except Exception as error:
+                    results.append((False, error))
+    except Exception as error:
+        for job in batch:
+            job.future.set_exception(error)
+        return
+    for job, (ok, value) in zip(batch, results):
+        if ok:
+            job.future.set_result(value)
+        else:
+            job.future.set_exception(value)
+
+
+def _work():
+    while True:
+        batch = [_jobs.get()]
+        while len(batch) < settings.SQLITE_WRITE_BATCH:
+            try:
+                batch.append(_jobs.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _run_batch(batch)
+        except Exception:
+            logger.exception('Сбой пачки записи')
+        finally:
+            connections[DEFAULT_DB_ALIAS].close_if_unusable_or_obsolete()
+
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_work, name='sqlite-writer',
+                                       daemon=True)
+            _writer.start()
+
+
+def write(func, *args, **kwargs):
+    """Выполняет func в потоке-писателе и возвращает её результат.
+
+    Без очереди (SQLITE_WRITE_QUEUE = False), на других СУБД и внутри
+    уже открытой транзакции func выполняется сразу: запись должна
+    остаться частью этой транзакции.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if (not settings.SQLITE_WRITE_QUEUE or connection.vendor != 'sqlite'
+            or connection.in_atomic_block):
+        return func(*args, **kwargs)
+    job = _Job(func, args, kwargs)
+    _ensure_writer()
+    _jobs.put(job)
+    return job.future.result()
+
+
+class SharedFile:
+    """Файл SQLite с соединением на поток в режиме WAL.
+
+    Соединение работает в автокоммите и без fsync: данные кэша и
+    ведер не страшно потерять при сбое питания. schema - запросы
+    CREATE ... IF NOT EXISTS, которые выполняются при подключении.
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def connection(self):
+        # После fork соединение родителя использовать нельзя
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')
+            for statement in self.schema:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def immediate(self):
+        """Транзакция, которая сразу берёт блокировку записи.
+
+        Проверка и запись внутри неё атомарны для всех процессов.
+        """
+        return _Immediate(self.connection())
+
+
+class _Immediate:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, *exc_info):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Запускает тесты со своим файлом кэша.
+
+    Тестовая база каждый раз создаётся заново, а кэш в файле живёт
+    между запусками: карточки и страницы из прошлого прогона или из
+    сервера разработки совпали бы по ключу с новыми записями.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.mkdtemp()
+        self.cache_settings = override_settings(CACHES={'default': {
+            'BACKEND': 'yatube.cache.SQLiteCache',
+            'LOCATION': os.path.join(self.cache_directory, 'cache.sqlite3'),
+        }})
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_directory)
+        super().teardown_test_environment(**kwargs)
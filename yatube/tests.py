@@ -0,0 +1,293 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+
+from posts import page_cache
+from posts.models import Post, User, UserStats
+
+from . import db_router, metrics, sqlite
+
+
+def _take_lock(key):
+    return cache.add(key, os.getpid(), 60)
+
+
+def _invalidate_pages(_):
+    page_cache.invalidate()
+
+
+def _write_as_api_client(header):
+    def view(request):
+        db_router.PrimaryReplicaRouter().db_for_write(Post)
+        return HttpResponse()
+    db_router.PrimaryPinMiddleware(view)(
+        RequestFactory().post("/", HTTP_AUTHORIZATION=header))
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = override_settings(METRICS_DIR=self.directory,
+                                     METRICS_TOKEN="secret")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = Client()
+        user = User.objects.create(username="John")
+        Post.objects.create(text="Post", author=user)
+
+    def test_views_are_measured(self):
+        self.client.get(reverse("index"))
+        response = self.client.get(reverse("metrics"),
+                                   HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('yatube_request_duration_seconds_count'
+                      '{view="index",method="GET"}', text)
+        self.assertIn('le="+Inf"', text)
+        line = next(row for row in text.splitlines() if row.startswith(
+            'yatube_db_queries_total{view="index"'))
+        self.assertGreater(float(line.split()[-1]), 0)
+        line = next(row for row in text.splitlines() if row.startswith(
+            'yatube_template_render_seconds_total{view="index"'))
+        self.assertGreater(float(line.split()[-1]), 0)
+
+    def test_queries_from_worker_threads_are_counted(self):
+        # Так async-представления выполняют запросы в пуле потоков
+        @sync_to_async(thread_sensitive=False)
+        def ping():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        async def gather():
+            await asyncio.gather(ping(), ping(), ping())
+
+        def view(request):
+            async_to_sync(gather)()
+            return HttpResponse()
+
+        def queries():
+            return metrics._totals.get("unmatched\tGET", {}).get("queries", 0)
+
+        before = queries()
+        metrics.MetricsMiddleware(view)(RequestFactory().get("/"))
+        self.assertEqual(queries() - before, 3)
+
+    def test_async_chain_is_measured(self):
+        async def view(request):
+            await sync_to_async(ping)()
+            return HttpResponse("ok")
+
+        def ping():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        before = metrics._totals.get("unmatched\tGET", {}).get("queries", 0)
+        response = async_to_sync(middleware)(RequestFactory().get("/"))
+        self.assertEqual(response.content, b"ok")
+        self.assertEqual(metrics._totals["unmatched\tGET"]["queries"] - before,
+                         1)
+
+    def test_other_processes_are_merged(self):
+        self.client.get(reverse("index"))
+        with open(os.path.join(self.directory, "1.json"), "w") as out:
+            out.write('{"index\\tGET": {"count": 1000, "duration": 1, '
+                      '"queries": 0, "query_time": 0, "template_time": 0, '
+                      '"response_bytes": 0, "buckets": [1000'
+                      + ', 0' * len(metrics.LATENCY_BUCKETS) + ']}}')
+        merged = metrics.collect()
+        self.assertGreater(merged["index\tGET"]["count"], 1000)
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"),
+                                   HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get(reverse("metrics"),
+                                       HTTP_AUTHORIZATION="Bearer None")
+        self.assertEqual(response.status_code, 403)
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_semantics(self):
+        cache.set("card", {"html": "<p>"}, 60)
+        cache.set("gone", 1, 0)
+        self.assertEqual(cache.get("card"), {"html": "<p>"})
+        self.assertIsNone(cache.get("gone"))
+        self.assertEqual(cache.get_many(["card", "gone", "missing"]),
+                         {"card": {"html": "<p>"}})
+
+        self.assertFalse(cache.add("card", "other"))
+        self.assertTrue(cache.add("gone", 5))
+        self.assertEqual(cache.incr("gone", 2), 7)
+        with self.assertRaises(ValueError):
+            cache.incr("missing")
+
+        self.assertTrue(cache.touch("card", 0))
+        self.assertFalse(cache.has_key("card"))
+        self.assertTrue(cache.delete("gone"))
+        self.assertFalse(cache.delete("gone"))
+
+    def test_state_is_shared_between_processes(self):
+        before = page_cache.generation()
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            locks = pool.map(_take_lock, ["page:lock"] * 8)
+            pool.map(_invalidate_pages, range(3))
+        # Блокировку пересборки получает только один процесс
+        self.assertEqual(locks.count(True), 1)
+        self.assertEqual(page_cache.generation(), before + 3)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class PrimaryReplicaRouterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.router = db_router.PrimaryReplicaRouter()
+
+    def run_view(self, request, write=False):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Post))
+            if write:
+                self.router.db_for_write(Post)
+                reads.append(self.router.db_for_read(Post))
+            return HttpResponse()
+        response = db_router.PrimaryPinMiddleware(view)(request)
+        return response, reads
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Post), "default")
+
+    def test_reads_go_to_replica_until_a_write(self):
+        response, reads = self.run_view(self.factory.get("/"), write=True)
+        self.assertEqual(reads, ["replica", "default"])
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+
+        _, reads = self.run_view(self.factory.get("/"))
+        self.assertEqual(reads, ["replica"])
+
+    def test_client_sticks_to_primary_after_write(self):
+        request = self.factory.get("/")
+        request.COOKIES[db_router.PIN_COOKIE] = "1"
+        _, reads = self.run_view(request)
+        self.assertEqual(reads, ["default"])
+
+        _, reads = self.run_view(self.factory.post("/"))
+        self.assertEqual(reads, ["default"])
+
+    def test_api_token_sticks_to_primary(self):
+        auth = {"HTTP_AUTHORIZATION": "Bearer token"}
+        self.run_view(self.factory.post("/", **auth), write=True)
+        _, reads = self.run_view(self.factory.get("/", **auth))
+        self.assertEqual(reads, ["default"])
+        _, reads = self.run_view(self.factory.get(
+            "/", HTTP_AUTHORIZATION="Bearer other"))
+        self.assertEqual(reads, ["replica"])
+
+    def test_async_chain_pins_api_client(self):
+        auth = {"HTTP_AUTHORIZATION": "Bearer token"}
+
+        async def view(request):
+            self.router.db_for_write(Post)
+            return HttpResponse()
+
+        middleware = db_router.PrimaryPinMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(self.factory.post("/", **auth))
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+        _, reads = self.run_view(self.factory.get("/", **auth))
+        self.assertEqual(reads, ["default"])
+
+    def test_api_pin_is_seen_by_other_workers(self):
+        with multiprocessing.get_context("fork").Pool(1) as pool:
+            pool.map(_write_as_api_client, ["Bearer token"])
+        _, reads = self.run_view(self.factory.get(
+            "/", HTTP_AUTHORIZATION="Bearer token"))
+        self.assertEqual(reads, ["default"])
+
+    def test_per_process_pin_cache_is_an_error(self):
+        self.assertEqual(db_router.check_pin_cache(None), [])
+        with override_settings(CACHES={"default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            errors = db_router.check_pin_cache(None)
+        self.assertEqual([error.id for error in errors], ["yatube.E001"])
+
+
+class SQLiteWriteQueueTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="John")
+
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA temp_store")
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_concurrent_writes_are_batched(self):
+        def create(i):
+            return sqlite.write(Post.objects.create, text=f"Post {i}",
+                                author=self.user)
+
+        with ThreadPoolExecutor(8) as pool:
+            posts = list(pool.map(create, range(40)))
+        self.assertEqual(len({post.pk for post in posts}), 40)
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(UserStats.objects.get(user=self.user).posts_count,
+                         40)
+
+    def test_failing_job_does_not_abort_the_batch(self):
+        def fail():
+            Post.objects.create(text="Lost", author=self.user)
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            sqlite.write(fail)
+        sqlite.write(Post.objects.create, text="Kept", author=self.user)
+        self.assertEqual(list(Post.objects.values_list("text", flat=True)),
+                         ["Kept"])
+
+    def test_locked_batch_does_not_rerun_jobs(self):
+        post = Post(text="New", author=self.user)
+        lock = sqlite._lock_for_write
+        attempts = []
+
+        def lock_once(connection):
+            attempts.append(connection)
+            if len(attempts) == 1:
+                raise OperationalError("database is locked")
+            lock(connection)
+
+        def locked():
+            raise OperationalError("database is locked")
+
+        batch = [sqlite._Job(post.save, (), {}),
+                 sqlite._Job(locked, (), {})]
+        with mock.patch.object(sqlite, "_lock_for_write", lock_once):
+            sqlite._run_batch(batch)
+        self.assertEqual(len(attempts), 2)
+        self.assertIsNone(batch[0].future.result())
+        with self.assertRaises(OperationalError):
+            batch[1].future.result()
+        self.assertEqual(list(Post.objects.values_list("pk", flat=True)),
+                         [post.pk])
@@ -5,9 +5,12 @@ from django.contrib.flatpages import views
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metrics import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('about/', include('django.contrib.flatpages.urls')),
     path('about-author/', views.flatpage, {'url': '/about-author/'}, name='about'),
     path('about-spec/', views.flatpage, {'url': 'about-spec/'}, name='terms'),